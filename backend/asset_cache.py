@@ -0,0 +1,188 @@
+import asyncio
+import hashlib
+import os
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from backend import storage
+import dotenv
+dotenv.load_dotenv()
+
+from backend.logging_config import logging_config  # Import the configuration file
+import logging.config
+logging.config.dictConfig(logging_config)
+logger = logging.getLogger("storage")
+
+ASSET_CACHE_DIR = os.getenv("ASSET_CACHE_DIR", "/tmp/asset_cache")
+ASSET_CACHE_MAX_BYTES = int(os.getenv("ASSET_CACHE_MAX_BYTES", 1024 ** 3))
+# Seconds a key's ETag is trusted before it is checked again with a HEAD request.
+ASSET_CACHE_TTL = float(os.getenv("ASSET_CACHE_TTL", 300))
+TEMP_SUFFIX = ".part"
+
+
+def entry_name(key, version):
+    """
+    Returns the file name of an object version in the cache: the SHA-256 of its key and ETag (or CID), so a
+    new version of the same key never overwrites a file that is being read.
+    """
+    return hashlib.sha256(f"{key}\0{version}".encode('utf-8')).hexdigest()
+
+
+class AssetCache:
+    def __init__(self, directory=None, max_bytes=None, ttl=None):
+        """
+        Local cache of storage objects, used for the mint inputs.
+
+        Files are named after the object key and ETag, so they are immutable: a download goes to a temporary
+        file that is renamed into place once complete, and readers never see a partial file. The cache is
+        bounded to `max_bytes`, evicting the least recently used files that are not in use. A key's ETag is
+        remembered for `ttl` seconds, during which a cached object is served without any request to storage.
+
+        Parameters:
+        - directory (str, optional): Cache directory. Defaults to ASSET_CACHE_DIR.
+        - max_bytes (int, optional): Size bound. Defaults to ASSET_CACHE_MAX_BYTES.
+        - ttl (float, optional): Seconds before a key is revalidated. Defaults to ASSET_CACHE_TTL.
+
+        Returns:
+        - None
+        """
+        self.directory = directory or ASSET_CACHE_DIR
+        self.max_bytes = max_bytes if max_bytes is not None else ASSET_CACHE_MAX_BYTES
+        self.ttl = ttl if ttl is not None else ASSET_CACHE_TTL
+        self.entries = OrderedDict()
+        self.versions = {}
+        self.pins = {}
+        self.size = 0
+        self.metrics = {"hits": 0, "misses": 0, "revalidations": 0, "evictions": 0, "bytes_downloaded": 0}
+        self._locks = {}
+        self._heads = {}
+        self._loaded = False
+
+    def _load(self):
+        # Picks up the files left by a previous process, least recently used first; drops partial downloads.
+        if self._loaded:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        files = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.endswith(TEMP_SUFFIX):
+                os.remove(path)
+                continue
+            stat = os.stat(path)
+            files.append((stat.st_mtime, name, stat.st_size))
+        for _, name, size in sorted(files):
+            self.entries[name] = size
+            self.size += size
+        self._loaded = True
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    async def _version(self, key):
+        cached = self.versions.get(key)
+        if cached is not None and time.monotonic() - cached[1] < self.ttl:
+            return cached[0]
+        # Concurrent opens of one key share a single HEAD request.
+        head = self._heads.get(key)
+        if head is None:
+            self.metrics["revalidations"] += 1
+            head = self._heads[key] = asyncio.ensure_future(storage.get_storage().head_object(key))
+            head.add_done_callback(lambda _: self._heads.pop(key, None))
+        response = await asyncio.shield(head)
+        version = response.get('Metadata', {}).get('cid') or response['ETag'].strip('"')
+        self.versions[key] = (version, time.monotonic())
+        return version
+
+    async def _fetch(self, key, name):
+        temp = self.path(f"{name}.{uuid.uuid4().hex}{TEMP_SUFFIX}")
+        started = time.perf_counter()
+        try:
+            await storage.get_storage().download_file(key, temp)
+            os.replace(temp, self.path(name))
+        except BaseException:
+            if os.path.exists(temp):
+                os.remove(temp)
+            raise
+        size = os.path.getsize(self.path(name))
+        self.entries[name] = size
+        self.size += size
+        self.metrics["bytes_downloaded"] += size
+        logger.info(f"Cached '{key}' ({size} bytes) in {time.perf_counter() - started:.2f}s")
+
+    def _evict(self):
+        for name in list(self.entries):
+            if self.size <= self.max_bytes:
+                return
+            if self.pins.get(name):
+                continue
+            size = self.entries.pop(name)
+            self.size -= size
+            self._locks.pop(name, None)
+            self.metrics["evictions"] += 1
+            try:
+                os.remove(self.path(name))
+            except FileNotFoundError:
+                pass
+
+    @asynccontextmanager
+    async def open(self, key):
+        """
+        Yields the local path of a storage object, downloading it if this version is not cached. The file is
+        not evicted while the context is open, and must not be modified.
+
+        Parameters:
+        - key (str): The object key.
+
+        Yields:
+        - str: The path of the cached file.
+
+        Raises:
+        - botocore.exceptions.ClientError: If the object does not exist or cannot be downloaded.
+        """
+        self._load()
+        version = await self._version(key)
+        name = entry_name(key, version)
+        lock = self._locks.setdefault(name, asyncio.Lock())
+        async with lock:
+            if name in self.entries and os.path.exists(self.path(name)):
+                self.metrics["hits"] += 1
+                self.entries.move_to_end(name)
+                os.utime(self.path(name))
+            else:
+                self.metrics["misses"] += 1
+                if name in self.entries:
+                    self.size -= self.entries.pop(name)
+                await self._fetch(key, name)
+            self.pins[name] = self.pins.get(name, 0) + 1
+        try:
+            self._evict()
+            yield self.path(name)
+        finally:
+            self.pins[name] -= 1
+            if not self.pins[name]:
+                del self.pins[name]
+            self._evict()
+
+    def invalidate(self, key):
+        """
+        Forgets the ETag of a key, so the next open checks storage again. Called after the key is overwritten.
+        """
+        self.versions.pop(key, None)
+
+    def stats(self):
+        return {**self.metrics, "files": len(self.entries), "bytes": self.size, "max_bytes": self.max_bytes}
+
+
+_cache = None
+
+
+def get_cache():
+    """
+    Returns the process-wide AssetCache, creating it on first call.
+    """
+    global _cache
+    if _cache is None:
+        _cache = AssetCache()
+    return _cache
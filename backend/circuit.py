@@ -0,0 +1,110 @@
+import asyncio
+import time
+from backend.logging_config import logging_config  # Import the configuration file
+import logging.config
+logging.config.dictConfig(logging_config)
+logger = logging.getLogger("database")
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    def __init__(self, name, failure_threshold=3):
+        """
+        Initializes a circuit breaker that tracks whether a dependency is reachable.
+
+        The breaker starts closed. After `failure_threshold` consecutive failures it opens, and callers
+        are expected to fail fast until a probe succeeds and closes it again. While a probe is running
+        the breaker is half open; requests still fail fast so only the probe touches the dependency.
+
+        Parameters:
+        - name (str): Name of the protected dependency, used in logs and health output.
+        - failure_threshold (int): Consecutive failures needed to open the breaker.
+
+        Returns:
+        - None
+        """
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self.last_failure = None
+        self.trips = 0
+        self._closed = asyncio.Event()
+        self._closed.set()
+
+    def allow(self):
+        """
+        Returns True if requests may be sent to the dependency.
+        """
+        return self.state == CLOSED
+
+    def record_success(self):
+        """
+        Resets the failure count and closes the breaker if it was open.
+        """
+        self.failures = 0
+        if self.state != CLOSED:
+            logger.info(f"Circuit {self.name} closed after {time.monotonic() - self.opened_at:.1f}s")
+            self.state = CLOSED
+            self.opened_at = None
+            self._closed.set()
+
+    def record_failure(self, error=None):
+        """
+        Counts a failure and opens the breaker once the threshold is reached.
+
+        Parameters:
+        - error (Exception, optional): The failure, kept for health output.
+
+        Returns:
+        - bool: True if this failure opened the breaker.
+        """
+        self.failures += 1
+        self.last_failure = str(error) if error else None
+        if self.state == CLOSED and self.failures >= self.failure_threshold:
+            self.trip()
+            return True
+        return False
+
+    def trip(self):
+        """
+        Opens the breaker.
+        """
+        if self.state == CLOSED:
+            self.trips += 1
+            self.opened_at = time.monotonic()
+            logger.critical(f"Circuit {self.name} opened after {self.failures} consecutive failures")
+            self._closed.clear()
+        self.state = OPEN
+
+    def half_open(self):
+        """
+        Marks the breaker as probing. Requests keep failing fast until the probe closes it.
+        """
+        if self.state == OPEN:
+            self.state = HALF_OPEN
+
+    async def wait_closed(self):
+        """
+        Waits until the breaker is closed.
+        """
+        await self._closed.wait()
+
+    def snapshot(self):
+        """
+        Returns the breaker state for health checks.
+
+        Returns:
+        - dict: The state, consecutive failures, seconds spent open, trip count and last error.
+        """
+        return {
+            "state": self.state,
+            "failures": self.failures,
+            "open_for": round(time.monotonic() - self.opened_at, 3) if self.opened_at else 0,
+            "trips": self.trips,
+            "last_failure": self.last_failure,
+        }
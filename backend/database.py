@@ -1,90 +1,309 @@
-import mysql.connector
-from mysql.connector import Error
+from mysql.connector import Error, InterfaceError, OperationalError
 import uuid
+import asyncio
+from contextlib import asynccontextmanager
 from backend.logging_config import logging_config  # Import the configuration file
 import logging.config
 from fastapi import FastAPI, HTTPException
 from datetime import datetime
-from backend import storage
 import os 
 import dotenv
+import random
 import time
+import json
+import base64
+from cachetools import TTLCache, LRUCache
+from backend.pool import ConnectionPool, PoolTimeout, is_connection_error
+from backend.circuit import CircuitBreaker
+from backend import orderbook
 dotenv.load_dotenv()
 logging.config.dictConfig(logging_config)
 logger = logging.getLogger("database")
 
+
+# Per (user, collection) TRS counts, maintained alongside the per-token rows when TRS_HOLDINGS_ENABLED is set.
+# With the flag on, the table is created and filled from the 'trs' rows the first time it is needed. Changes
+# made while the flag is off are not mirrored, so before turning it back on drop the table, or run
+# rebuild_holdings (POST /admin/holdings/rebuild) right after.
+HOLDINGS_TABLE = """
+CREATE TABLE IF NOT EXISTS trs_holdings (
+    user_id VARCHAR(64) NOT NULL,
+    collection_name VARCHAR(255) NOT NULL,
+    free INT NOT NULL DEFAULT 0,
+    on_marketplace INT NOT NULL DEFAULT 0,
+    artisan INT NOT NULL DEFAULT 0,
+    creator TINYINT(1) NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, collection_name)
+)
+"""
+
+
+# Central wallet token account of each mint. The mapping never changes once the mint exists.
+TOKEN_ACCOUNTS_TABLE = """
+CREATE TABLE IF NOT EXISTS token_accounts (
+    mint_address VARCHAR(64) NOT NULL PRIMARY KEY,
+    collection_name VARCHAR(255),
+    token_account_address VARCHAR(64) NOT NULL,
+    UNIQUE KEY token_accounts_collection (collection_name)
+)
+"""
+
+
+def holding_bucket(trs):
+    """
+    Returns the trs_holdings column a TRS row is counted in: 'artisan', 'on_marketplace' or 'free'.
+    """
+    if trs['artisan'] == 1:
+        return 'artisan'
+    if trs['marketplace'] == 1:
+        return 'on_marketplace'
+    return 'free'
+
+
+def _run(connection, query, values, fetch, many, dictionary, commit):
+    cursor = connection.cursor(dictionary=dictionary, buffered=True)
+    try:
+        if many:
+            cursor.executemany(query, values)
+        else:
+            cursor.execute(query, values)
+        if fetch == "one":
+            result = cursor.fetchone()
+        elif fetch == "all":
+            result = cursor.fetchall()
+        else:
+            result = cursor.rowcount
+        if commit:
+            connection.commit()
+        return result
+    finally:
+        cursor.close()
+
 class DatabaseManager:
-    def __init__(self, host, user, password, database):
+    def __init__(self, host, user, password, database, min_size=None, max_size=None):
         """
         Initializes a new instance of the DatabaseManager class.
 
+        Queries are served from a bounded connection pool, so concurrent requests each get their own
+        connection and blocking driver calls run off the event loop. No connection is opened until
+        the first query.
+
         Parameters:
         - host (str): The host address of the MySQL database.
         - user (str): The username for connecting to the MySQL database.
         - password (str): The password for connecting to the MySQL database.
         - database (str): The name of the MySQL database.
+        - min_size (int, optional): Connections kept open once the pool is in use. Defaults to DATABASE_POOL_MIN_SIZE or 1.
+        - max_size (int, optional): Maximum concurrent connections. Defaults to DATABASE_POOL_MAX_SIZE or 10.
 
         Returns:
         - None
+        """
+        self.pool = ConnectionPool(
+            host=host,
+            user=user,
+            password=password,
+            database=database,
+            min_size=int(min_size if min_size is not None else os.getenv("DATABASE_POOL_MIN_SIZE", 1)),
+            max_size=int(max_size if max_size is not None else os.getenv("DATABASE_POOL_MAX_SIZE", 10)),
+            acquire_timeout=float(os.getenv("DATABASE_POOL_TIMEOUT", 10)),
+        )
+        self.breaker = CircuitBreaker("database", failure_threshold=int(os.getenv("DATABASE_BREAKER_THRESHOLD", 3)))
+        self.backoff_base = float(os.getenv("DATABASE_BACKOFF_BASE", 0.5))
+        self.backoff_max = float(os.getenv("DATABASE_BACKOFF_MAX", 30))
+        self.read_retry_wait = float(os.getenv("DATABASE_READ_RETRY_WAIT", 2))
+        self.trs_chunk_size = int(os.getenv("TRS_INSERT_CHUNK_SIZE", 1000))
+        self.holdings_enabled = os.getenv("TRS_HOLDINGS_ENABLED", "false").lower() in ("1", "true", "yes")
+        self.wallet_cache = TTLCache(maxsize=int(os.getenv("WALLET_CACHE_SIZE", 1024)), ttl=float(os.getenv("WALLET_CACHE_TTL", 30)))
+        self.marketplace_cache = TTLCache(maxsize=int(os.getenv("MARKETPLACE_CACHE_SIZE", 256)), ttl=float(os.getenv("MARKETPLACE_CACHE_TTL", 10)))
+        # Keyed by ("mint", address) and ("collection", name); entries never go stale, so no TTL.
+        self.token_account_cache = LRUCache(maxsize=int(os.getenv("TOKEN_ACCOUNT_CACHE_SIZE", 4096)))
+        self._token_accounts_ready = False
+        self._holdings_ready = False
+        self._holdings_lock = asyncio.Lock()
+        self._reconnect_task = None
+
+    async def conn(self):
+        """
+        Checks that a connection to the database can be obtained from the pool.
+
+        Returns:
+        - bool: True if a live connection was obtained.
 
         Raises:
         - HTTPException: If there is an error connecting to the MySQL database.
         """
         try:
-            self.connection = mysql.connector.connect(
-                host=host,
-                user=user,
-                password=password,
-                database=database
-            )
-
-            if self.connection.is_connected():
-                logger.info("Successfully connected to the database")
+            async with self.pool.connection() as connection:
+                if await asyncio.to_thread(connection.is_connected):
+                    logger.info("Successfully connected to the database")
+                    return True
         except Error as e:
             logger.error(f"Error: {e}")
-            self.connection = None
             raise HTTPException(status_code=400, detail=str(e))
-            self.connection = None
-    async def conn(self):
+        return False
+
+    async def attempt_connection(self, timeout=None):
         """
-        Attempts to reconnect to the database. 
+        Makes sure the database is reconnecting in the background and waits for it without blocking the event loop.
+
+        Parameters:
+        - timeout (float, optional): Seconds to wait for the connection to come back. Waits indefinitely if None.
 
         Returns:
-        - None
+        - bool: True if the database is reachable, False if it did not come back within the timeout.
+        """
+        if self.breaker.allow():
+            return True
+        self._start_reconnect()
+        try:
+            await asyncio.wait_for(self.breaker.wait_closed(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    def _start_reconnect(self):
+        if self._reconnect_task is None or self._reconnect_task.done():
+            self._reconnect_task = asyncio.create_task(self._reconnect_supervisor())
+
+    async def _reconnect_supervisor(self):
+        """
+        Background task that probes the database with jittered exponential backoff until a connection
+        succeeds, then closes the circuit breaker.
+        """
+        attempt = 0
+        while not self.breaker.allow():
+            delay = min(self.backoff_max, self.backoff_base * 2 ** attempt)
+            await asyncio.sleep(random.uniform(delay / 2, delay))
+            self.breaker.half_open()
+            try:
+                if await self.conn():
+                    self.breaker.record_success()
+                    return
+            except HTTPException as e:
+                logger.error(f"Reconnect attempt {attempt + 1} failed: {e.detail}")
+            self.breaker.trip()
+            attempt += 1
+
+    def _connection_failed(self, error):
+        if self.breaker.record_failure(error):
+            self.pool.clear_idle()
+            self._start_reconnect()
+
+    def _unavailable(self):
+        return HTTPException(
+            status_code=503,
+            detail="Could not connect to the database. Please try later. ",
+            headers={"Retry-After": str(int(self.backoff_max))},
+        )
+
+    @asynccontextmanager
+    async def connection(self):
+        """
+        Checks a connection out of the pool for the duration of the block.
 
         Raises:
-        - HTTPException: If there is an error connecting to the MySQL database.
+        - HTTPException: 503 straight away while the circuit breaker is open, or if the database cannot be reached.
         """
+        if not self.breaker.allow():
+            raise self._unavailable()
         try:
-            self.connection = mysql.connector.connect(
-                host=os.getenv("DATABASE_HOST"),
-                user=os.getenv("DATABASE_USERNAME"),
-                password=os.getenv("DATABASE_PASSWORD"),
-                database =os.getenv("DATABASE_NAME")
-            )
-            if self.connection.is_connected():
-                logger.info("Successfully connected to the database")
-                return True
-
-        except Error as e:
+            connection = await self.pool.acquire()
+        except PoolTimeout as e:
             logger.error(f"Error: {e}")
-            raise HTTPException(status_code=400, detail=str(e))
-        return False
-    async def attempt_connection(self):
-        connection = False
-        for i in range(5):
-            connection = await self.conn()
-            if connection: 
-                
-                return True
-            else:
-                logger.error("Connection failed, trying again in 3.")
-                time.sleep(3)
-        return connection
-            
+            raise HTTPException(status_code=503, detail="The database is busy, please try again. ")
+        except Error as e:
+            logger.critical(f"No database connection: {e}")
+            self._connection_failed(e)
+            raise self._unavailable()
+        discard = False
+        try:
+            yield connection
+            self.breaker.record_success()
+        except (OperationalError, InterfaceError) as e:
+            discard = True
+            if is_connection_error(e):
+                self._connection_failed(e)
+            raise
+        finally:
+            await self.pool.release(connection, discard=discard)
+
+    async def execute(self, query, values=None, fetch=None, many=False, dictionary=False, connection=None):
+        """
+        Runs a single statement in a worker thread and returns its result.
+
+        Reads (a `fetch` outside a caller-managed transaction) are idempotent, so if the connection drops
+        they are retried once on a fresh connection, waiting up to DATABASE_READ_RETRY_WAIT seconds for
+        the database to come back first. While the breaker is already open they fail fast like writes.
+
+        Parameters:
+        - query (str): The SQL statement.
+        - values (tuple | list, optional): Parameters for the statement, or a list of tuples when `many` is set.
+        - fetch (str, optional): "one" or "all" to return rows, otherwise the affected row count is returned.
+        - many (bool): Use executemany with `values`.
+        - dictionary (bool): Return rows as dictionaries.
+        - connection (MySQLConnection, optional): Run inside a caller-managed transaction. When omitted a
+          connection is checked out and the statement is committed on its own.
+
+        Returns:
+        - dict | list | int | None: The fetched row(s) or the affected row count.
+
+        Raises:
+        - HTTPException: 503 if the database is unavailable.
+        - mysql.connector.Error: Other errors from the driver are passed through for the caller to handle.
+        """
+        if connection is not None:
+            return await asyncio.to_thread(_run, connection, query, values, fetch, many, dictionary, False)
+        retry = fetch is not None and self.breaker.allow()
+        while True:
+            try:
+                async with self.connection() as connection:
+                    return await asyncio.to_thread(_run, connection, query, values, fetch, many, dictionary, True)
+            except (OperationalError, InterfaceError) as e:
+                if not retry or not is_connection_error(e):
+                    raise
+                logger.warning(f"Connection lost during read, retrying: {e}")
+            except HTTPException as e:
+                if not retry or e.status_code != 503:
+                    raise
+            retry = False
+            if not await self.attempt_connection(self.read_retry_wait):
+                raise self._unavailable()
+
+    @asynccontextmanager
+    async def transaction(self):
+        """
+        Checks a connection out for a multi-statement unit of work. The transaction is committed when
+        the block exits normally and rolled back if it raises.
+
+        Usage:
+            async with database_client.transaction() as connection:
+                await database_client.execute(query, values, connection=connection)
+        """
+        await self._ensure_holdings()
+        async with self.connection() as connection:
+            yield connection
+            await asyncio.to_thread(connection.commit)
+
+    def health(self):
+        """
+        Returns the database circuit breaker state and pool metrics for health checks.
+
+        Returns:
+        - dict: `breaker` (see CircuitBreaker.snapshot) and `pool` (see ConnectionPool.stats).
+        """
+        return {"breaker": self.breaker.snapshot(), "pool": self.pool.stats()}
+
+    def pool_stats(self):
+        """
+        Returns the connection pool metrics.
 
+        Returns:
+        - dict: See ConnectionPool.stats.
+        """
+        return self.pool.stats()
 
-    async def add_asset(self, values):
+    async def add_asset(self, values, connection=None):
         """
         Adds a new asset (token) to the user's wallet in the database.
 
@@ -96,23 +315,15 @@ class DatabaseManager:
         - user_id (int): The unique identifier of the user who owns the asset.
         - trs_id (str): The unique identifier of the asset (token).
         - collection_id (str): The identifier of the collection to which the asset belongs.
+        - connection (MySQLConnection, optional): Insert as part of a transaction opened with `transaction()`.
 
         Returns:
         - None
         """
-        if not self.connection:
-            logger.critical("No database connection")
-            e = await self.attempt_connection()
-            if not e:
-                raise HTTPException(status_code = 501, detail = "Could not connect to the database. Please try later. ")
-            else:
-                raise HTTPException(status_code=502, detail="Your request couldn't be processed, please try again. ")
         try:
-            cursor = self.connection.cursor()
             query = f"INSERT INTO trs (user_id,trs_id,collection_name,creator) VALUES (%s, %s,%s,%s)"
 
-            cursor.executemany(query, values)
-            self.connection.commit()
+            await self.execute(query, values, many=True, connection=connection)
             logger.info(f"Tokens added succesfully. ")
         except Error as e:
             logger.error(f"Error: {e}")
@@ -133,18 +344,9 @@ class DatabaseManager:
         - dict: A dictionary containing the owner's user ID if the asset exists in the database.
                  If the asset does not exist or there is an error, returns None.
         """
-        if not self.connection:
-            logger.critical("No database connection")
-            e = await self.attempt_connection()
-            if not e:
-                raise HTTPException(status_code = 501, detail = "Could not connect to the database. Please try later. ")
-            else:
-                raise HTTPException(status_code=502, detail="Your request couldn't be processed, please try again. ")
         try:
-            cursor = self.connection.cursor(dictionary=True)
             query = "SELECT user_id FROM trs WHERE trs_id = %s"
-            cursor.execute(query, (trs_id,))
-            result = cursor.fetchone()
+            result = await self.execute(query, (trs_id,), fetch="one", dictionary=True)
             return result
         except Error as e:
             logger.error(f"Error: {e}")
@@ -170,20 +372,11 @@ class DatabaseManager:
         Returns:
         - None
         """
-        if not self.connection:
-            logger.critical("No database connection")
-            e = await self.attempt_connection()
-            if not e:
-                raise HTTPException(status_code = 501, detail = "Could not connect to the database. Please try later. ")
-            else:
-                raise HTTPException(status_code=502, detail="Your request couldn't be processed, please try again. ")
         try:
-            cursor = self.connection.cursor()
             transaction_number = str(uuid.uuid4())
             query = f"INSERT INTO transactions (buyer_transaction_number,transaction_number,trs_id,buyer_id,seller_id,amount,number) VALUES (%s,%s, %s,%s,%s,%s)"
             values = (buyer_transaction_number,transaction_number, trs_id, buyer_id, seller_id, amount, number)
-            cursor.execute(query, values)
-            self.connection.commit()
+            await self.execute(query, values)
             logger.info(f"Transaction {transaction_number} and buyer transaction number {buyer_transaction_number} added successfully")
             
         except Error as e:
@@ -204,19 +397,10 @@ class DatabaseManager:
     Raises:
     - HTTPException: If there is an error updating the transaction record.
         """
-        if not self.connection:
-            logger.critical("No database connection")
-            e = await self.attempt_connection()
-            if not e:
-                raise HTTPException(status_code = 501, detail = "Could not connect to the database. Please try later. ")
-            else:
-                raise HTTPException(status_code=502, detail="Your request couldn't be processed, please try again. ")
         try:
-            cursor = self.connection.cursor()
             query = f"UPDATE transactions set status = %s  where transaction_number = %s "
             values = (status,transaction_number)
-            cursor.execute(query, values)
-            self.connection.commit()
+            await self.execute(query, values)
             logger.info(f"Transaction {transaction_number} modified successfully to {status}")
         except Error as e:
             logger.error(f"Error: {e}")
@@ -237,30 +421,299 @@ class DatabaseManager:
         Returns:
         - None
         """
-        if not self.connection:
-            logger.critical("No database connection")
-            e = await self.attempt_connection()
-            if not e:
-                raise HTTPException(status_code = 501, detail = "Could not connect to the database. Please try later. ")
-            else:
-                raise HTTPException(status_code=502, detail="Your request couldn't be processed, please try again. ")
         try:
-            cursor = self.connection.cursor()
-            query = f"UPDATE trs SET user_id = %s WHERE trs_id = %s"
+            async with self.transaction() as connection:
+                query = "SELECT user_id, collection_name, marketplace, artisan FROM trs WHERE trs_id = %s FOR UPDATE"
+                trs = await self.execute(query, (trs_id,), fetch="one", dictionary=True, connection=connection)
+                query = f"UPDATE trs SET user_id = %s WHERE trs_id = %s"
 
-            cursor.execute(query, (user_id, trs_id))
+                await self.execute(query, (user_id, trs_id), connection=connection)
+                if trs and trs['user_id'] != user_id:
+                    bucket = holding_bucket(trs)
+                    await self.adjust_holdings(connection, trs['user_id'], trs['collection_name'], **{bucket: -1})
+                    await self.adjust_holdings(connection, user_id, trs['collection_name'], **{bucket: 1})
+            self.invalidate_wallet(user_id, trs['user_id'] if trs else None)
             logger.info(f"Transferred TRS {trs_id} to {user_id}.")
         except Error as e:
             logger.error(f"Error: {e}")
             raise HTTPException(status_code=400, detail=str(e))
     
-    
+    async def adjust_holdings(self, connection, user_id, collection_name, free=0, on_marketplace=0, artisan=0, creator=False):
+        """
+        Applies a change to a user's aggregated holdings of a collection. Does nothing unless TRS_HOLDINGS_ENABLED is set.
+
+        Must be called on the same connection, inside the same transaction, as the change to the per-token
+        'trs' rows it mirrors, so the two never drift apart. The caller invalidates the user's cached wallet
+        once that transaction has committed.
+
+        Parameters:
+        - connection (MySQLConnection): The connection of the enclosing `transaction()`.
+        - user_id (str): The unique identifier of the user.
+        - collection_name (str): The name of the collection.
+        - free (int): Change in TRS that are neither on the marketplace nor used for artisan rights.
+        - on_marketplace (int): Change in TRS listed on the marketplace.
+        - artisan (int): Change in TRS with artisan rights activated.
+        - creator (bool): Mark the user as the creator of the collection.
+
+        Returns:
+        - None
+        """
+        if not self.holdings_enabled:
+            return
+        query = (
+            "INSERT INTO trs_holdings (user_id, collection_name, free, on_marketplace, artisan, creator) VALUES (%s, %s, %s, %s, %s, %s) "
+            "ON DUPLICATE KEY UPDATE free = free + VALUES(free), on_marketplace = on_marketplace + VALUES(on_marketplace), "
+            "artisan = artisan + VALUES(artisan), creator = GREATEST(creator, VALUES(creator))"
+        )
+        await self.execute(query, (user_id, collection_name, free, on_marketplace, artisan, int(creator)), connection=connection)
+
+    async def _ensure_holdings(self):
+        # Creates and fills trs_holdings the first time it is needed with TRS_HOLDINGS_ENABLED set, so writes
+        # never hit a missing table. Must run outside any caller transaction: CREATE TABLE commits implicitly.
+        if self._holdings_ready or not self.holdings_enabled:
+            return
+        async with self._holdings_lock:
+            if self._holdings_ready:
+                return
+            query = "SELECT COUNT(*) FROM information_schema.tables WHERE table_schema = DATABASE() AND table_name = 'trs_holdings'"
+            exists = (await self.execute(query, fetch="one"))[0]
+            if not exists:
+                await self.rebuild_holdings()
+            self._holdings_ready = True
+
+    async def rebuild_holdings(self):
+        """
+        Creates the trs_holdings table if needed and recomputes it from the per-token 'trs' rows.
+        Runs by itself the first time the table is needed with TRS_HOLDINGS_ENABLED set; run it again to repair
+        the table, or after the flag was off for a while (see HOLDINGS_TABLE).
+
+        Returns:
+        - None
+        """
+        try:
+            await self.execute(HOLDINGS_TABLE)
+            # Not self.transaction(), which waits for _ensure_holdings, the caller of this method.
+            async with self.connection() as connection:
+                await self.execute("DELETE FROM trs_holdings", connection=connection)
+                query = (
+                    "INSERT INTO trs_holdings (user_id, collection_name, free, on_marketplace, artisan, creator) "
+                    "SELECT user_id, collection_name, SUM(artisan = 0 AND marketplace = 0), SUM(artisan = 0 AND marketplace = 1), "
+                    "SUM(artisan = 1), MAX(creator = user_id) FROM trs GROUP BY user_id, collection_name"
+                )
+                await self.execute(query, connection=connection)
+                await asyncio.to_thread(connection.commit)
+            self.wallet_cache.clear()
+            logger.info("Rebuilt TRS holdings.")
+        except Error as e:
+            logger.error(f"Error: {e}")
+            raise HTTPException(status_code=400, detail=str(e))
+
+    async def get_marketplace_orders(self):
+        """
+        Retrieves every sell listing on the marketplace, aggregated per (collection, seller, price).
+        Used to build the in-memory order books.
+
+        Returns:
+        - list: Dictionaries with collection_name, user_id, bid_price and number.
+        """
+        try:
+            query = (
+                "SELECT collection_name, user_id, bid_price, COUNT(*) AS number FROM marketplace "
+                "WHERE type = 'sell' GROUP BY collection_name, user_id, bid_price"
+            )
+            return await self.execute(query, fetch="all", dictionary=True)
+        except Error as e:
+            logger.error(f"Error: {e}")
+            raise HTTPException(status_code=400, detail=str(e))
+
+    async def get_marketplace_page(self, collection_name=None, cursor=None, limit=50):
+        """
+        Retrieves one page of the marketplace, aggregated per (collection, price) and ordered by collection then price.
+
+        Pages use keyset pagination: `cursor` encodes the last (collection, price) of the previous page, so every page
+        costs the same however deep the client reads. Pages are cached for MARKETPLACE_CACHE_TTL seconds and the cache
+        is cleared whenever listings change through this process.
+
+        Parameters:
+        - collection_name (str, optional): Only return listings of this collection.
+        - cursor (str, optional): The `next_cursor` of the previous page.
+        - limit (int): The maximum number of price levels on the page.
+
+        Returns:
+        - dict: `items` (dictionaries with collection_name, bid_price and number_of_trs) and `next_cursor`
+                (None on the last page).
+
+        Raises:
+        - HTTPException: 400 if the cursor is invalid.
+        """
+        key = (collection_name, cursor, limit)
+        cached = self.marketplace_cache.get(key)
+        if cached is not None:
+            return cached
+        conditions = ["type = 'sell'"]
+        values = []
+        if collection_name is not None:
+            conditions.append("collection_name = %s")
+            values.append(collection_name)
+        if cursor:
+            try:
+                last_collection, last_price = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            except (ValueError, TypeError):
+                raise HTTPException(status_code=400, detail="Invalid cursor.")
+            conditions.append("(collection_name > %s OR (collection_name = %s AND bid_price > %s))")
+            values += [last_collection, last_collection, last_price]
+        query = (
+            f"SELECT collection_name, bid_price, COUNT(*) AS number_of_trs FROM marketplace WHERE {' AND '.join(conditions)} "
+            "GROUP BY collection_name, bid_price ORDER BY collection_name, bid_price LIMIT %s"
+        )
+        try:
+            rows = await self.execute(query, values + [limit + 1], fetch="all", dictionary=True)
+        except Error as e:
+            logger.error(f"Error: {e}")
+            raise HTTPException(status_code=400, detail=str(e))
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            last = rows[-1]
+            next_cursor = base64.urlsafe_b64encode(json.dumps([last['collection_name'], str(last['bid_price'])]).encode()).decode()
+        page = {"items": rows, "next_cursor": next_cursor}
+        self.marketplace_cache[key] = page
+        return page
+
+    def invalidate_marketplace(self):
+        """
+        Clears the cached marketplace pages after listings changed.
+
+        Returns:
+        - None
+        """
+        self.marketplace_cache.clear()
+
+    async def _flag_trs(self, connection, user_id, collection_name, number, condition, assignment, before, after):
+        """
+        Locks exactly `number` of a user's TRS of a collection matching `condition` and applies `assignment`
+        to them. Rows already locked by a concurrent request are skipped rather than waited on, so two
+        requests never flag the same TRS. Nothing is changed unless all `number` rows could be locked.
+
+        Parameters:
+        - connection (MySQLConnection): The connection of the enclosing `transaction()`.
+        - user_id (str): The unique identifier of the owner.
+        - collection_name (str): The name of the collection.
+        - number (int): The number of TRS to flag.
+        - condition (str): SQL condition on the trs row, e.g. "marketplace = 0 AND artisan = 0".
+        - assignment (str): SQL SET clause, e.g. "artisan = 1".
+        - before (str): Holdings bucket the TRS leave.
+        - after (str): Holdings bucket the TRS enter.
+
+        Returns:
+        - list: The flagged trs_ids, or None if fewer than `number` TRS were eligible.
+        """
+        if number <= 0:
+            return None
+        query = f"SELECT trs_id FROM trs WHERE user_id = %s AND collection_name = %s AND {condition} LIMIT %s FOR UPDATE SKIP LOCKED"
+        rows = await self.execute(query, (user_id, collection_name, number), fetch="all", connection=connection)
+        if len(rows) < number:
+            return None
+        trs_ids = [row[0] for row in rows]
+        placeholders = ", ".join(["%s"] * len(trs_ids))
+        await self.execute(f"UPDATE trs SET {assignment} WHERE trs_id IN ({placeholders})", trs_ids, connection=connection)
+        await self.adjust_holdings(connection, user_id, collection_name, **{before: -number, after: number})
+        return trs_ids
+
+    async def place_on_marketplace(self, user_id, collection_name, number, price):
+        """
+        Lists `number` of a user's free TRS of a collection on the marketplace at `price`.
+
+        Parameters:
+        - user_id (str): The unique identifier of the seller.
+        - collection_name (str): The name of the collection.
+        - number (int): The number of TRS to list.
+        - price (float): The bid price per TRS.
+
+        Returns:
+        - int: The number of TRS listed, either `number` or 0 if the user holds fewer free TRS.
+        """
+        try:
+            async with self.transaction() as connection:
+                trs_ids = await self._flag_trs(connection, user_id, collection_name, number, "marketplace = 0 AND artisan = 0", "marketplace = 1", 'free', 'on_marketplace')
+                if not trs_ids:
+                    return 0
+                query = "INSERT INTO marketplace (trs_id, collection_name, type, user_id, bid_price) VALUES (%s, %s, %s, %s, %s)"
+                await self.execute(query, [(trs_id, collection_name, 'sell', user_id, price) for trs_id in trs_ids], many=True, connection=connection)
+            orderbook.books.listed(collection_name, user_id, price, number)
+            self.invalidate_wallet(user_id)
+            self.invalidate_marketplace()
+            logger.info(f"Placed {number} TRS of {collection_name} from {user_id} on the marketplace at {price}.")
+            return number
+        except Error as e:
+            logger.error(f"Error: {e}")
+            raise HTTPException(status_code=400, detail=str(e))
+
+    async def remove_from_marketplace(self, user_id, collection_name, number):
+        """
+        Takes `number` of a user's listed TRS of a collection off the marketplace.
+
+        Parameters:
+        - user_id (str): The unique identifier of the seller.
+        - collection_name (str): The name of the collection.
+        - number (int): The number of TRS to remove.
+
+        Returns:
+        - int: The number of TRS removed, either `number` or 0 if the user has fewer listed.
+        """
+        try:
+            async with self.transaction() as connection:
+                trs_ids = await self._flag_trs(connection, user_id, collection_name, number, "marketplace = 1 AND artisan = 0", "marketplace = 0", 'on_marketplace', 'free')
+                if not trs_ids:
+                    return 0
+                placeholders = ", ".join(["%s"] * len(trs_ids))
+                query = f"SELECT bid_price, COUNT(*) FROM marketplace WHERE trs_id IN ({placeholders}) GROUP BY bid_price"
+                levels = await self.execute(query, trs_ids, fetch="all", connection=connection)
+                await self.execute(f"DELETE FROM marketplace WHERE trs_id IN ({placeholders})", trs_ids, connection=connection)
+            for price, count in levels:
+                orderbook.books.delisted(collection_name, user_id, price, count)
+            self.invalidate_wallet(user_id)
+            self.invalidate_marketplace()
+            logger.info(f"Removed {number} TRS of {collection_name} from {user_id} from the marketplace.")
+            return number
+        except Error as e:
+            logger.error(f"Error: {e}")
+            raise HTTPException(status_code=400, detail=str(e))
+
+    async def set_artisan(self, user_id, collection_name, number, active):
+        """
+        Activates or deactivates artisan rights on `number` of a user's TRS of a collection.
+
+        Parameters:
+        - user_id (str): The unique identifier of the owner.
+        - collection_name (str): The name of the collection.
+        - number (int): The number of TRS to change.
+        - active (bool): True to activate artisan rights on free TRS, False to release TRS with artisan rights.
+
+        Returns:
+        - int: The number of TRS changed, either `number` or 0 if the user holds fewer eligible TRS.
+        """
+        if active:
+            flag = ("marketplace = 0 AND artisan = 0", "artisan = 1", 'free', 'artisan')
+        else:
+            flag = ("marketplace = 0 AND artisan = 1", "artisan = 0", 'artisan', 'free')
+        try:
+            async with self.transaction() as connection:
+                trs_ids = await self._flag_trs(connection, user_id, collection_name, number, *flag)
+            if not trs_ids:
+                return 0
+            self.invalidate_wallet(user_id)
+            logger.info(f"Set artisan rights to {active} on {number} TRS of {collection_name} for {user_id}.")
+            return number
+        except Error as e:
+            logger.error(f"Error: {e}")
+            raise HTTPException(status_code=400, detail=str(e))
+
     async def close_connection(self):
         """
-        Closes the database connection if it is currently open.
+        Closes every pooled database connection.
 
-        This function checks if a database connection is available and if it is connected.
-        If both conditions are met, it closes the connection and prints a success message.
+        Connections that are checked out at the time of the call are closed as soon as they are released.
 
         Parameters:
         - None
@@ -268,51 +721,127 @@ class DatabaseManager:
         Returns:
         - None
         """
-        if self.connection and self.connection.is_connected():
-            self.connection.close()
-            logger.info("Database connection closed")
+        await self.pool.close()
+        logger.info("Database connection closed")
             
-    async def add_trs(self,number, mint_address, collection_name, token_account_address,creator_id):
+    async def add_trs(self,number, mint_address, collection_name, token_account_address,creator_id, chunk_size=None, progress=None):
         """
         Adds a new token to the database.
 
-        This function connects to the database, checks if a connection is available, and then inserts a new token record
-        into the 'collections' table. If the connection is not available, it prints a message indicating the lack of a
-        database connection.
+        The TRS rows are generated and inserted in chunks of `chunk_size`, into both the 'collections' and the
+        'trs' tables, inside a single transaction, and the collection's token account is recorded in 'token_accounts'. Memory use stays bounded by the chunk size, each statement
+        stays well under max_allowed_packet, and either every TRS of the collection is created or none is.
 
         Parameters:
-    
+        - number (int): The number of TRS to create.
         - mint_address (str): The address of the mint that created the token.
         - collection_name (str): The name of the collection to which the token belongs.
         - token_account_address (str): The address of the token account associated with the token.
         - creator_id (int): The unique identifier of the creator of the token.
+        - chunk_size (int, optional): Rows per INSERT. Defaults to TRS_INSERT_CHUNK_SIZE or 1000.
+        - progress (callable, optional): Called as progress(inserted, number) after every chunk.
         Returns:
         - None
         """
-        if not self.connection:
-            logger.critical("No database connection")
-            e = await self.attempt_connection()
-            if not e:
-                raise HTTPException(status_code = 501, detail = "Could not connect to the database. Please try later. ")
-            else:
-                raise HTTPException(status_code=502, detail="Your request couldn't be processed, please try again. ")
+        chunk_size = chunk_size or self.trs_chunk_size
         try:
-            cursor = self.connection.cursor()
-            batch_values = []
-            trs_id_values = []
-            for i in range(number):
-                trs_id = uuid.uuid4().int
-                batch_values.append((str(trs_id), collection_name, str(mint_address), str(token_account_address),str(creator_id)))
-                trs_id_values.append((creator_id,trs_id,collection_name,creator_id))
-            query = f"INSERT INTO collections (trs_id, collection_name, mint_address, token_account_address,creator_id) VALUES (%s, %s, %s, %s,%s)"
-            cursor.executemany(query,batch_values)
-            self.connection.commit()
-            await self.add_asset(trs_id_values)       
-            logger.info(f"Added {number} tokens of collection name {collection_name} to {creator_id}.")
+            started = time.perf_counter()
+            await self._ensure_token_accounts()
+            async with self.transaction() as connection:
+                await self.save_token_account(mint_address, collection_name, token_account_address, connection=connection)
+                inserted = 0
+                while inserted < number:
+                    count = min(chunk_size, number - inserted)
+                    batch_values = []
+                    trs_id_values = []
+                    for i in range(count):
+                        trs_id = str(uuid.uuid4().int)
+                        batch_values.append((trs_id, collection_name, str(mint_address), str(token_account_address),str(creator_id)))
+                        trs_id_values.append((creator_id,trs_id,collection_name,creator_id))
+                    # executemany rewrites a plain INSERT into one multi-row statement per chunk.
+                    query = f"INSERT INTO collections (trs_id, collection_name, mint_address, token_account_address,creator_id) VALUES (%s, %s, %s, %s,%s)"
+                    await self.execute(query, batch_values, many=True, connection=connection)
+                    await self.add_asset(trs_id_values, connection=connection)
+                    inserted += count
+                    logger.debug(f"Inserted {inserted}/{number} TRS of collection {collection_name}")
+                    if progress:
+                        progress(inserted, number)
+                await self.adjust_holdings(connection, creator_id, collection_name, free=number, creator=True)
+            self._cache_token_account(mint_address, collection_name, str(token_account_address))
+            self.invalidate_wallet(creator_id)
+            elapsed = time.perf_counter() - started
+            logger.info(f"Added {number} tokens of collection name {collection_name} to {creator_id} in {elapsed:.2f}s ({number / max(elapsed, 1e-9):.0f} TRS/s).")
         except Error as e:
             logger.error(f"Error: {e}")
             raise HTTPException(status_code=400, detail=str(e))
  
+    async def get_wallet_summary(self, user_id):
+        """
+        Retrieves a user's wallet aggregated per collection, joined with each collection's data, in a single query.
+
+        Results are cached per user for WALLET_CACHE_TTL seconds. Every method that changes which TRS a user holds,
+        or their marketplace/artisan state, calls `invalidate_wallet`, so the cache never outlives a change made
+        through this process.
+
+        Parameters:
+        - user_id (str): The unique identifier of the user.
+
+        Returns:
+        - dict: Keyed by collection name, each value holding `number`, `created`, `artisan`, `marketplace`
+                and `data` (the collection_data rows for the collection).
+        """
+        cached = self.wallet_cache.get(user_id)
+        if cached is not None:
+            return cached
+        if self.holdings_enabled:
+            await self._ensure_holdings()
+            wallet_query = (
+                "SELECT collection_name AS wallet_collection, free + on_marketplace + artisan AS wallet_number, "
+                "artisan AS wallet_artisan, on_marketplace AS wallet_marketplace, creator AS wallet_created "
+                "FROM trs_holdings WHERE user_id = %s"
+            )
+            values = (user_id,)
+        else:
+            wallet_query = (
+                "SELECT collection_name AS wallet_collection, COUNT(*) AS wallet_number, SUM(artisan = 1) AS wallet_artisan, "
+                "SUM(artisan = 0 AND marketplace = 1) AS wallet_marketplace, MAX(creator = %s) AS wallet_created "
+                "FROM trs WHERE user_id = %s GROUP BY collection_name"
+            )
+            values = (user_id, user_id)
+        query = f"SELECT w.*, cd.* FROM ({wallet_query}) w LEFT JOIN collection_data cd ON cd.name = w.wallet_collection"
+        try:
+            rows = await self.execute(query, values, fetch="all", dictionary=True)
+        except Error as e:
+            logger.error(f"Error: {e}")
+            raise HTTPException(status_code=400, detail=str(e))
+        wallet = {}
+        for row in rows:
+            data = {key: value for key, value in row.items() if not key.startswith('wallet_')}
+            wallet[row['wallet_collection']] = {
+                'number': int(row['wallet_number']),
+                'created': bool(row['wallet_created']),
+                'artisan': int(row['wallet_artisan']),
+                'marketplace': int(row['wallet_marketplace']),
+                'data': [data] if data.get('name') is not None else []
+            }
+        self.wallet_cache[user_id] = wallet
+        logger.info(f"Returned wallet summary of user {user_id}")
+        return wallet
+
+    def invalidate_wallet(self, *user_ids):
+        """
+        Drops the cached wallet summary of each given user.
+
+        Parameters:
+        - user_ids (str): The users whose holdings changed. None values are ignored.
+
+        Returns:
+        - None
+        """
+        for user_id in user_ids:
+            if user_id is not None:
+                self.wallet_cache.pop(user_id, None)
+
     async def get_wallet(self, user_id):
         """
         Retrieves the wallet of a user from the database.
@@ -329,52 +858,30 @@ class DatabaseManager:
         - list: A list of dictionaries containing the asset (token) details in the user's wallet.
                  If the user does not exist or there is an error, returns None.
         """
-        if not self.connection:
-            logger.critical("No database connection")
-            e = await self.attempt_connection()
-            if not e:
-                raise HTTPException(status_code = 501, detail = "Could not connect to the database. Please try later. ")
-            else:
-                raise HTTPException(status_code=502, detail="Your request couldn't be processed, please try again. ")
-        elif not await self.get_user(user_id):
+        if not await self.get_user(user_id):
             logger.info(f"User not found {user_id}")
             return None
         else:
             try: 
-                cursor = self.connection.cursor(dictionary=True)
                 query = "SELECT trs_id,collection_name FROM trs WHERE user_id = %s"
-                cursor.execute(query, (user_id,))
-                result = cursor.fetchall()
+                result = await self.execute(query, (user_id,), fetch="all", dictionary=True)
                 logger.info(f"Returned wallet of user {user_id}")
                 return result
             except Error as e:
                 logger.error(f"Error: {e}")
                 raise HTTPException(status_code=400, detail=str(e))
                 return None
-            finally: 
-                cursor.close()
     
     async def get_collection_data(self,name):
-        if not self.connection:
-            logger.critical("No database connection")
-            e = await self.attempt_connection()
-            if not e:
-                raise HTTPException(status_code = 501, detail = "Could not connect to the database. Please try later. ")
-            else:
-                raise HTTPException(status_code=502, detail="Your request couldn't be processed, please try again. ")
         try:
-            cursor = self.connection.cursor(dictionary=True)
             query = "SELECT * FROM collection_data WHERE name = %s"
-            cursor.execute(query, (name,))
-            result = cursor.fetchall()
+            result = await self.execute(query, (name,), fetch="all", dictionary=True)
             return result
         except Error as e:
 
             logger.error(f"Error: {e}")
             raise HTTPException(status_code=400, detail=str(e))
 
-        finally:
-            cursor.close()
 
     async def get_approved_transactions(self,buyer_transaction_id):
         """
@@ -389,26 +896,15 @@ class DatabaseManager:
     Raises:
     HTTPException: If there is an error connecting to the database or retrieving the transactions.
     """
-        if not self.connection:
-            logger.critical("No database connection")
-            e = await self.attempt_connection()
-            if not e:
-                raise HTTPException(status_code = 501, detail = "Could not connect to the database. Please try later. ")
-            else:
-                raise HTTPException(status_code=502, detail="Your request couldn't be processed, please try again. ")
         try:
-            cursor = self.connection.cursor(dictionary=True)
             query = "SELECT * FROM transactions WHERE buyer_id = %s AND status = %s"
-            cursor.execute(query, (buyer_transaction_id, "initiated"))
-            result = cursor.fetchall()
+            result = await self.execute(query, (buyer_transaction_id, "initiated"), fetch="all", dictionary=True)
             logger.info(f"Retrieved approved transactions for buyer {buyer_transaction_id}")
             return result
         except Exception as e:
             logger.error(f"Error: {e}")
             raise HTTPException(status_code=400, detail=str(e))
             return None
-        finally:
-            cursor.close()
         
     
     
@@ -425,26 +921,15 @@ class DatabaseManager:
     Raises:
     HTTPException: If there is an error connecting to the database or retrieving the transactions.
     """
-        if not self.connection:
-            logger.critical("No database connection")
-            e = await self.attempt_connection()
-            if not e:
-                raise HTTPException(status_code = 501, detail = "Could not connect to the database. Please try later. ")
-            else:
-                raise HTTPException(status_code=502, detail="Your request couldn't be processed, please try again. ")
         try:
-            cursor = self.connection.cursor(dictionary=True)
             query = "UPDATE transacations SET status = 'approved' where buyer_id = %s AND status = 'initiated'"
-            cursor.execute(query, (buyer_transaction_id, ))
-            result = cursor.fetchall()
+            await self.execute(query, (buyer_transaction_id, ))
             logger.info(f"Approved initiated transactions for buyer {buyer_transaction_id}")
             return True
         except Exception as e:
             logger.error(f"Error: {e}")
             raise HTTPException(status_code=400, detail=str(e))
             return None
-        finally:
-            cursor.close()
         return
 
 
@@ -462,78 +947,43 @@ class DatabaseManager:
     Raises:
     HTTPException: If there is an error connecting to the database or finishing the transactions.
     """
-        if not self.connection:
-            logger.critical("No database connection")
-            e = await self.attempt_connection()
-            if not e:
-                raise HTTPException(status_code = 501, detail = "Could not connect to the database. Please try later. ")
-            else:
-                raise HTTPException(status_code=502, detail="Your request couldn't be processed, please try again. ")
         try:
-            cursor = self.connection.cursor(dictionary=True)
             query = "UPDATE transacations SET status = 'finished' where buyer_id = %s AND status = 'initiated'"
-            cursor.execute(query, (buyer_transaction_id, ))
-            result = cursor.fetchall()
+            await self.execute(query, (buyer_transaction_id, ))
             logger.info(f"Finished approved transactions for buyer {buyer_transaction_id}")
             return True
         except Exception as e:
             logger.error(f"Error: {e}")
             raise HTTPException(status_code=400, detail=str(e))
             return None
-        finally:
-            cursor.close()
         return
     
     async def get_wallet_by_collection(self,user_id,collection_id):
-        if not self.connection:
-            logger.critical("No database connection")
-            e = await self.attempt_connection()
-            if not e:
-                raise HTTPException(status_code = 501, detail = "Could not connect to the database. Please try later. ")
-            else:
-                raise HTTPException(status_code=502, detail="Your request couldn't be processed, please try again. ")
-        elif not await self.get_user(user_id):
+        if not await self.get_user(user_id):
             logger.error(f"User not found {user_id}")
             return None
         else:
             try:
-                cursor = self.connection.cursor(dictionary=True)
                 query = "SELECT trs_id, collection_name FROM trs WHERE user_id = %s AND collection_name = %s"
-                cursor.execute(query, (user_id, collection_id))
-                result = cursor.fetchall()
+                result = await self.execute(query, (user_id, collection_id), fetch="all", dictionary=True)
                 logger.info(f"Selected wallet by collection {collection_id}, from {user_id}")
                 return result
             except Error as e:
                 logger.error(f"Error: {e}")
                 raise HTTPException(status_code=400, detail=str(e))
                 return None
-            finally:
-                cursor.close()
        
     async def get_mint_address(self,collection_name):
-        if not self.connection:
-            logger.critical("No database connection")
-            e = await self.attempt_connection()
-            if not e:
-                raise HTTPException(status_code = 501, detail = "Could not connect to the database. Please try later. ")
-            else:
-                raise HTTPException(status_code=502, detail="Your request couldn't be processed, please try again. ")
-        else:
-            try:
-                cursor = self.connection.cursor(dictionary=True)
-                query = "SELECT mint_address FROM collections WHERE collection_name = %s"
-                cursor.execute(query, (collection_name,))
-                result = cursor.fetchall()
-                logger.info(f"Retrieved Mint Address by collection {collection_name}")
-                return result
-            except Error as e:
-                logger.error(f"Error: {e}")
-                raise HTTPException(status_code=400, detail=str(e))
+        try:
+            query = "SELECT mint_address FROM collections WHERE collection_name = %s"
+            result = await self.execute(query, (collection_name,), fetch="all", dictionary=True)
+            logger.info(f"Retrieved Mint Address by collection {collection_name}")
+            return result
+        except Error as e:
+            logger.error(f"Error: {e}")
+            raise HTTPException(status_code=400, detail=str(e))
                 
-                return None
-            finally:
-                cursor.close()
-        return 
+            return None
     
     
     async def get_creator(self,collection_name):
@@ -549,51 +999,213 @@ class DatabaseManager:
     Raises:
     HTTPException: If there is an error connecting to the database or retrieving the creator id.
         """
-        if not self.connection:
-            logger.critical("No database connection")
-            e = await self.attempt_connection()
-            if not e:
-                raise HTTPException(status_code = 501, detail = "Could not connect to the database. Please try later. ")
-            else:
-                raise HTTPException(status_code=502, detail="Your request couldn't be processed, please try again. ")
-        else:
-            try:
-                cursor = self.connection.cursor(dictionary=True)
-                query = "SELECT creator_id FROM collections WHERE collection_name = %s LIMIT 1"
+        try:
+            query = "SELECT creator_id FROM collections WHERE collection_name = %s LIMIT 1"
 
-                cursor.execute(query, (collection_name,))
-                result = cursor.fetchall()
-                logger.info(f"Retrieved Creator id of collection {collection_name}")
-                return result['creator_id']
-            except Error as e:
-                logger.error(f"Error: {e}")
-                raise HTTPException(status_code=400, detail=str(e))
-                return None
-            finally:
-                cursor.close()
-        return
+            result = await self.execute(query, (collection_name,), fetch="one", dictionary=True)
+            logger.info(f"Retrieved Creator id of collection {collection_name}")
+            return result['creator_id']
+        except Error as e:
+            logger.error(f"Error: {e}")
+            raise HTTPException(status_code=400, detail=str(e))
+            return None
+
+    async def _ensure_token_accounts(self):
+        # CREATE TABLE commits implicitly, so this must run outside any caller transaction.
+        if not self._token_accounts_ready:
+            await self.execute(TOKEN_ACCOUNTS_TABLE)
+            self._token_accounts_ready = True
+
+    def _cache_token_account(self, mint_address, collection_name, token_account_address):
+        self.token_account_cache[("mint", str(mint_address))] = token_account_address
+        if collection_name is not None:
+            self.token_account_cache[("collection", collection_name)] = token_account_address
+
+    async def save_token_account(self, mint_address, collection_name, token_account_address, connection=None):
+        """
+        Records the central wallet token account of a mint, in the token_accounts table and the in-process cache.
+
+        Parameters:
+        - mint_address (str): The address of the mint.
+        - collection_name (str, optional): The collection minted with it, if known.
+        - token_account_address (str): The central wallet's token account for the mint.
+        - connection (MySQLConnection, optional): Write as part of a transaction opened with `transaction()`.
+          The table must already exist, see `_ensure_token_accounts`. The cache is then left to the caller,
+          to fill once the transaction has committed.
+
+        Returns:
+        - None
+        """
+        try:
+            if connection is None:
+                await self._ensure_token_accounts()
+            query = (
+                "INSERT INTO token_accounts (mint_address, collection_name, token_account_address) VALUES (%s, %s, %s) "
+                "ON DUPLICATE KEY UPDATE collection_name = COALESCE(VALUES(collection_name), collection_name), "
+                "token_account_address = VALUES(token_account_address)"
+            )
+            await self.execute(query, (str(mint_address), collection_name, str(token_account_address)), connection=connection)
+            if connection is None:
+                self._cache_token_account(mint_address, collection_name, str(token_account_address))
+            logger.info(f"Saved token account {token_account_address} of mint {mint_address}")
+        except Error as e:
+            logger.error(f"Error: {e}")
+            raise HTTPException(status_code=400, detail=str(e))
+
+    async def get_token_account_by_mint(self, mint_address):
+        """
+        Returns the central wallet token account of a mint from the cache or the token_accounts table.
+
+        Parameters:
+        - mint_address (str): The address of the mint.
+
+        Returns:
+        - str | None: The token account address, or None if it was never recorded.
+        """
+        key = ("mint", str(mint_address))
+        if key in self.token_account_cache:
+            return self.token_account_cache[key]
+        try:
+            await self._ensure_token_accounts()
+            query = "SELECT collection_name, token_account_address FROM token_accounts WHERE mint_address = %s"
+            result = await self.execute(query, (str(mint_address),), fetch="one", dictionary=True)
+        except Error as e:
+            logger.error(f"Error: {e}")
+            raise HTTPException(status_code=400, detail=str(e))
+        if result is None:
+            return None
+        self._cache_token_account(mint_address, result['collection_name'], result['token_account_address'])
+        return result['token_account_address']
 
     async def get_token_account_address(self, collection_name):
-        if not self.connection:
-            logger.critical("No database connection")
-            e = await self.attempt_connection()
-            if not e:
-                raise HTTPException(status_code = 501, detail = "Could not connect to the database. Please try later. ")
-            else:
-                raise HTTPException(status_code=502, detail="Your request couldn't be processed, please try again. ")
-        else:
-            try: 
-                cursor = self.connection.cursor(dictionary=True)
-                query = "select * from collections where collection_name = %s"
-                cursor.execute(query,(collection_name,))
-                logger.info(f"Fetched token account address of collection : {collection_name}")
-                result = cursor.fetchall()
-                token_account_address = result[0]["token_account_address"]
-                return token_account_address
+        """
+        Returns the central wallet token account of a collection.
+
+        Served from the in-process cache, then from the token_accounts table by primary key. Collections
+        minted before that table existed are looked up once in 'collections' and recorded.
+
+        Parameters:
+        - collection_name (str): The name of the collection.
+
+        Returns:
+        - str: The token account address.
+
+        Raises:
+        - HTTPException: 404 if the collection does not exist, 400 on a database error.
+        """
+        key = ("collection", collection_name)
+        if key in self.token_account_cache:
+            return self.token_account_cache[key]
+        try: 
+            await self._ensure_token_accounts()
+            query = "SELECT mint_address, token_account_address FROM token_accounts WHERE collection_name = %s"
+            result = await self.execute(query, (collection_name,), fetch="one", dictionary=True)
+            if result is None:
+                query = "SELECT mint_address, token_account_address FROM collections WHERE collection_name = %s LIMIT 1"
+                result = await self.execute(query, (collection_name,), fetch="one", dictionary=True)
+                if result is None:
+                    raise HTTPException(status_code=404, detail=f"Collection {collection_name} not found.")
+                await self.save_token_account(result['mint_address'], collection_name, result['token_account_address'])
+            logger.info(f"Fetched token account address of collection : {collection_name}")
+            self._cache_token_account(result['mint_address'], collection_name, result['token_account_address'])
+            return result['token_account_address']
                 
-            except Error as e:
-                logger.error(f"Error: {e}")
-                raise HTTPException(status_code=400, detail=str(e))
+        except Error as e:
+            logger.error(f"Error: {e}")
+            raise HTTPException(status_code=400, detail=str(e))
+
+
+_database_client = None
+
+
+def get_database():
+    """
+    Returns the process-wide DatabaseManager, creating it on first call.
+
+    Every module shares this instance, and therefore one connection pool per worker. Creating it does not
+    open a connection; the pool connects on the first query. It can also be used as a FastAPI dependency,
+    e.g. `database_client: DatabaseManager = Depends(get_database)`.
+
+    Returns:
+    - DatabaseManager: The shared database manager.
+    """
+    global _database_client
+    if _database_client is None:
+        _database_client = DatabaseManager(
+            host=os.getenv("DATABASE_HOST"),
+            user=os.getenv("DATABASE_USERNAME"),
+            password=os.getenv("DATABASE_PASSWORD"),
+            database =os.getenv("DATABASE_NAME")
+        )
+    return _database_client
+
+
+async def close_database():
+    """
+    Closes the shared DatabaseManager's connections, if it was ever created. Called on application shutdown.
+
+    Returns:
+    - None
+    """
+    if _database_client is not None:
+        await _database_client.close_connection()
+
+
+async def _previous_add_trs(database_client, number, mint_address, collection_name, token_account_address, creator_id):
+    # add_trs as it was before chunking, kept for benchmark(): every row built in memory, one executemany
+    # into 'collections' committed on its own, then add_asset's executemany into 'trs', committed separately.
+    batch_values = []
+    trs_id_values = []
+    for i in range(number):
+        trs_id = uuid.uuid4().int
+        batch_values.append((str(trs_id), collection_name, str(mint_address), str(token_account_address),str(creator_id)))
+        trs_id_values.append((creator_id,trs_id,collection_name,creator_id))
+    query = f"INSERT INTO collections (trs_id, collection_name, mint_address, token_account_address,creator_id) VALUES (%s, %s, %s, %s,%s)"
+    await database_client.execute(query, batch_values, many=True)
+    await database_client.add_asset(trs_id_values)
+
+
+async def benchmark(number=10000, chunk_size=None):
+    """
+    Measures add_trs against the configured database: `number` TRS through the previous add_trs (see
+    _previous_add_trs), then `number` TRS through the chunked add_trs, which also records the token account
+    and the holdings in the same transaction. The benchmark rows are deleted afterwards.
+
+    Parameters:
+    - number (int): TRS per run.
+    - chunk_size (int, optional): Rows per INSERT of the chunked run. Defaults to TRS_INSERT_CHUNK_SIZE.
+
+    Returns:
+    - dict: TRS per second of each run, and the speedup.
+    """
+    database_client = get_database()
+    run = uuid.uuid4().hex[:8]
+    previous_name, chunked_name = f"benchmark-{run}-previous", f"benchmark-{run}-chunked"
+    creator_id = f"benchmark-{run}"
+    try:
+        started = time.perf_counter()
+        await _previous_add_trs(database_client, number, f"mint-{run}-1", previous_name, f"account-{run}-1", creator_id)
+        previous = time.perf_counter() - started
+        started = time.perf_counter()
+        await database_client.add_trs(number, f"mint-{run}-2", chunked_name, f"account-{run}-2", creator_id, chunk_size=chunk_size)
+        chunked = time.perf_counter() - started
+    finally:
+        async with database_client.transaction() as connection:
+            for table in ("collections", "trs"):
+                await database_client.execute(f"DELETE FROM {table} WHERE collection_name IN (%s, %s)", (previous_name, chunked_name), connection=connection)
+            await database_client.execute("DELETE FROM token_accounts WHERE collection_name = %s", (chunked_name,), connection=connection)
+            if database_client.holdings_enabled:
+                await database_client.execute("DELETE FROM trs_holdings WHERE user_id = %s", (creator_id,), connection=connection)
+        database_client.token_account_cache.clear()
+        database_client.invalidate_wallet(creator_id)
+    return {
+        "trs": number,
+        "chunk_size": chunk_size or database_client.trs_chunk_size,
+        "previous_per_second": round(number / previous),
+        "chunked_per_second": round(number / chunked),
+        "speedup": round(previous / chunked, 2),
+    }
+
 
-            finally: 
-                cursor.close()
\ No newline at end of file
+if __name__ == "__main__":
+    print(asyncio.run(benchmark()))
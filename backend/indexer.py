@@ -0,0 +1,357 @@
+import asyncio
+import os
+import re
+import time
+from types import SimpleNamespace
+from mysql.connector import Error
+from fastapi import HTTPException
+from solders.keypair import Keypair
+from solders.signature import Signature
+from backend.database import get_database
+from backend.rpc import get_gateway
+from backend.transaction import central_wallet, encode_memo, parse_memo
+import dotenv
+dotenv.load_dotenv()
+
+from backend.logging_config import logging_config  # Import the configuration file
+import logging.config
+logging.config.dictConfig(logging_config)
+logger = logging.getLogger("transaction")
+
+# One row per trade leg memo written by the central wallet; a batched transaction holds several legs.
+CHAIN_MEMOS_TABLE = """
+CREATE TABLE IF NOT EXISTS chain_memos (
+    signature VARCHAR(100) NOT NULL,
+    leg INT NOT NULL,
+    slot BIGINT NOT NULL,
+    block_time BIGINT,
+    failed TINYINT(1) NOT NULL DEFAULT 0,
+    txn VARCHAR(255) NOT NULL,
+    number INT,
+    buyer_uuid VARCHAR(64),
+    seller_uuid VARCHAR(64),
+    buyer_email VARCHAR(255),
+    seller_email VARCHAR(255),
+    PRIMARY KEY (signature, leg),
+    INDEX chain_memos_txn (txn),
+    INDEX chain_memos_buyer (buyer_uuid, slot),
+    INDEX chain_memos_seller (seller_uuid, slot),
+    INDEX chain_memos_slot (slot)
+)
+"""
+CHECKPOINTS_TABLE = """
+CREATE TABLE IF NOT EXISTS indexer_checkpoints (
+    name VARCHAR(64) NOT NULL PRIMARY KEY,
+    slot BIGINT NOT NULL,
+    signature VARCHAR(100) NOT NULL,
+    updated_at DOUBLE NOT NULL
+)
+"""
+# getSignaturesForAddress returns at most 1000 signatures per page.
+PAGE_SIZE = 1000
+MEMO_PREFIX = re.compile(rb"\[(\d+)\] ")
+
+
+def split_memos(field):
+    """
+    Splits the `memo` field of getSignaturesForAddress, "[<bytes>] <memo>; [<bytes>] <memo>", into the
+    memos of the transaction. The byte length prefixes are used, so memos containing "; " are kept whole.
+
+    Parameters:
+    - field (str | None): The memo field.
+
+    Returns:
+    - list: The memos, as str.
+    """
+    if not field:
+        return []
+    data = field.encode('utf-8')
+    memos = []
+    position = 0
+    while position < len(data):
+        prefix = MEMO_PREFIX.match(data, position)
+        if prefix is None:
+            # Not a length-prefixed field; treat the rest as one memo.
+            memos.append(data[position:].decode('utf-8', errors='replace'))
+            break
+        start = prefix.end()
+        end = start + int(prefix.group(1))
+        memos.append(data[start:end].decode('utf-8', errors='replace'))
+        position = end + 2 if data[end:end + 2] == b"; " else end
+    return memos
+
+
+class Indexer:
+    def __init__(self, database_client=None, gateway=None, address=None, name="central_wallet", interval=None):
+        """
+        Indexes the trade memos the central wallet wrote on chain into the chain_memos table.
+
+        Each run pages through getSignaturesForAddress from the newest signature back to the checkpoint left
+        by the previous run, parses our memos straight from the signature list (no per-signature
+        getTransaction), stores them with one multi-row insert per page, and then moves the checkpoint to the
+        newest slot seen. Inserts ignore rows that already exist, so an interrupted run is simply repeated.
+
+        Parameters:
+        - database_client (DatabaseManager, optional): Defaults to the shared one.
+        - gateway (RpcGateway, optional): Defaults to the shared one.
+        - address (Pubkey, optional): The address to index. Defaults to the central wallet.
+        - name (str): Checkpoint name.
+        - interval (float, optional): Seconds between runs when started. Defaults to INDEXER_INTERVAL or 30.
+
+        Returns:
+        - None
+        """
+        self.database_client = database_client or get_database()
+        self.gateway = gateway or get_gateway()
+        self.address = address or central_wallet
+        self.name = name
+        self.interval = float(interval if interval is not None else os.getenv("INDEXER_INTERVAL", 30))
+        self.metrics = {"runs": 0, "signatures": 0, "legs": 0, "last_run_seconds": 0.0, "signatures_per_minute": 0.0}
+        self._ready = False
+        self._task = None
+        self._lock = asyncio.Lock()
+
+    async def _setup(self):
+        if not self._ready:
+            await self.database_client.execute(CHAIN_MEMOS_TABLE)
+            await self.database_client.execute(CHECKPOINTS_TABLE)
+            self._ready = True
+
+    async def checkpoint(self):
+        """
+        Returns the last indexed slot and signature, or None before the first run.
+        """
+        await self._setup()
+        query = "SELECT slot, signature FROM indexer_checkpoints WHERE name = %s"
+        return await self.database_client.execute(query, (self.name,), fetch="one", dictionary=True)
+
+    def _rows(self, status):
+        rows = []
+        for leg, memo in enumerate(split_memos(status.memo)):
+            fields = parse_memo(memo)
+            if fields is None:
+                continue
+            rows.append((
+                str(status.signature), leg, status.slot, status.block_time, int(status.err is not None),
+                fields['txn'], fields['number'], fields['buyer_uuid'], fields['seller_uuid'],
+                fields['buyer_email'], fields['seller_email'],
+            ))
+        return rows
+
+    async def run(self):
+        """
+        Indexes every signature newer than the checkpoint.
+
+        Returns:
+        - dict: The number of signatures and trade legs indexed.
+        """
+        async with self._lock:
+            started = time.perf_counter()
+            await self._setup()
+            checkpoint = await self.checkpoint()
+            until = Signature.from_string(checkpoint['signature']) if checkpoint else None
+            newest = None
+            before = None
+            signatures = legs = 0
+            while True:
+                resp = await self.gateway.read("get_signatures_for_address", self.address, before=before, until=until, limit=PAGE_SIZE)
+                page = resp.value
+                if not page:
+                    break
+                if newest is None:
+                    newest = page[0]
+                rows = [row for status in page for row in self._rows(status)]
+                if rows:
+                    query = (
+                        "INSERT IGNORE INTO chain_memos (signature, leg, slot, block_time, failed, txn, number, "
+                        "buyer_uuid, seller_uuid, buyer_email, seller_email) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)"
+                    )
+                    await self.database_client.execute(query, rows, many=True)
+                signatures += len(page)
+                legs += len(rows)
+                if len(page) < PAGE_SIZE:
+                    break
+                before = page[-1].signature
+            if newest is not None:
+                query = (
+                    "INSERT INTO indexer_checkpoints (name, slot, signature, updated_at) VALUES (%s, %s, %s, %s) "
+                    "ON DUPLICATE KEY UPDATE slot = VALUES(slot), signature = VALUES(signature), updated_at = VALUES(updated_at)"
+                )
+                await self.database_client.execute(query, (self.name, newest.slot, str(newest.signature), time.time()))
+            seconds = time.perf_counter() - started
+            self.metrics["runs"] += 1
+            self.metrics["signatures"] += signatures
+            self.metrics["legs"] += legs
+            self.metrics["last_run_seconds"] = round(seconds, 3)
+            if signatures:
+                self.metrics["signatures_per_minute"] = round(signatures / seconds * 60)
+            logger.info(f"Indexed {signatures} signatures, {legs} trade legs in {seconds:.2f}s")
+            return {"signatures": signatures, "legs": legs}
+
+    async def _loop(self):
+        while True:
+            try:
+                await self.run()
+            except Exception as e:
+                logger.error(f"Indexer run failed: {getattr(e, 'error_msg', None) or getattr(e, 'detail', None) or e}")
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        """
+        Runs the indexer every `interval` seconds in the background.
+        """
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+
+    async def lookup(self, payment_id=None, buyer_id=None, seller_id=None, limit=100):
+        """
+        Returns indexed trade legs by PayPal payment id, buyer or seller, newest first.
+
+        Parameters:
+        - payment_id (str, optional): The PayPal payment id written in the memo.
+        - buyer_id (str, optional): The buyer's user id.
+        - seller_id (str, optional): The seller's user id.
+        - limit (int): Maximum number of legs.
+
+        Returns:
+        - list: Dictionaries with signature, leg, slot, block_time, failed, txn, number, buyer and seller ids and emails.
+
+        Raises:
+        - HTTPException: 400 if no filter is given or on a database error.
+        """
+        filters = [(column, value) for column, value in (("txn", payment_id), ("buyer_uuid", buyer_id), ("seller_uuid", seller_id)) if value is not None]
+        if not filters:
+            raise HTTPException(status_code=400, detail="Give a paymentId, buyer or seller.")
+        try:
+            await self._setup()
+            query = (
+                "SELECT signature, leg, slot, block_time, failed, txn, number, buyer_uuid, seller_uuid, buyer_email, seller_email "
+                f"FROM chain_memos WHERE {' AND '.join(f'{column} = %s' for column, _ in filters)} ORDER BY slot DESC, leg LIMIT %s"
+            )
+            return await self.database_client.execute(query, (*[value for _, value in filters], limit), fetch="all", dictionary=True)
+        except Error as e:
+            logger.error(f"Error: {e}")
+            raise HTTPException(status_code=400, detail=str(e))
+
+    def stats(self):
+        return dict(self.metrics)
+
+
+_indexer = None
+
+
+def get_indexer():
+    """
+    Returns the process-wide Indexer for the central wallet, creating it on first call.
+    """
+    global _indexer
+    if _indexer is None:
+        _indexer = Indexer()
+    return _indexer
+
+
+class StubGateway:
+    def __init__(self, statuses, latency=0.0):
+        """
+        Stands in for RpcGateway with an in-memory signature history, for benchmark() and tests. Answers
+        get_signatures_for_address pages like the RPC node: newest first, from `before` (exclusive) back to
+        `until` (exclusive), at most `limit` at a time, each after `latency` seconds.
+
+        Parameters:
+        - statuses (list): Signature statuses, newest first, see synthetic_statuses.
+        - latency (float): Seconds per call.
+
+        Returns:
+        - None
+        """
+        self.statuses = statuses
+        self.latency = latency
+        self.calls = 0
+
+    async def read(self, method, address, before=None, until=None, limit=PAGE_SIZE):
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        start = 0
+        if before is not None:
+            start = next(index for index, status in enumerate(self.statuses) if status.signature == before) + 1
+        page = []
+        for status in self.statuses[start:]:
+            if status.signature == until or len(page) == limit:
+                break
+            page.append(status)
+        return SimpleNamespace(value=page)
+
+
+class StubDatabase:
+    def __init__(self):
+        """
+        Stands in for DatabaseManager under the indexer, for benchmark() and tests: chain_memos keyed by
+        (signature, leg) with INSERT IGNORE semantics, and the checkpoints.
+        """
+        self.memos = {}
+        self.checkpoints = {}
+        self.inserts = 0
+
+    async def execute(self, query, values=None, fetch=None, many=False, dictionary=False, connection=None):
+        if query.startswith("INSERT IGNORE INTO chain_memos"):
+            self.inserts += 1
+            for row in values:
+                self.memos.setdefault(row[:2], row)
+        elif query.startswith("INSERT INTO indexer_checkpoints"):
+            name, slot, signature, _ = values
+            self.checkpoints[name] = {"slot": slot, "signature": signature}
+        elif query.startswith("SELECT slot, signature FROM indexer_checkpoints"):
+            return self.checkpoints.get(values[0])
+        return None
+
+
+def synthetic_statuses(number, first_slot=1, legs=3):
+    """
+    Returns `number` signature statuses, newest first, whose memo fields hold 1 to `legs` trade memos
+    each, in the "[<bytes>] <memo>; ..." layout of getSignaturesForAddress.
+    """
+    statuses = []
+    payer = Keypair()
+    for index in reversed(range(number)):
+        memos = [
+            encode_memo(f"PAY-{first_slot + index}", f"seller{leg}@example.com", "buyer@example.com", leg + 1, f"seller{leg}", "buyer").decode('utf-8')
+            for leg in range(1 + index % legs)
+        ]
+        statuses.append(SimpleNamespace(
+            signature=payer.sign_message(f"{first_slot + index}".encode('utf-8')),
+            slot=first_slot + index,
+            block_time=1700000000 + index,
+            err=None,
+            memo="; ".join(f"[{len(memo.encode('utf-8'))}] {memo}" for memo in memos),
+        ))
+    return statuses
+
+
+async def benchmark(signatures=5000, latency=0.05):
+    """
+    Backfills `signatures` synthetic signatures from a stub RPC node answering each page after `latency`
+    seconds into an in-memory database, then runs again to show an up-to-date run costs one page.
+
+    Returns:
+    - dict: Signatures and legs indexed, signatures per minute of the backfill, and RPC calls per run.
+    """
+    gateway = StubGateway(synthetic_statuses(signatures), latency)
+    indexer = Indexer(StubDatabase(), gateway, Keypair().pubkey(), name="benchmark")
+    result = await indexer.run()
+    backfill_calls = gateway.calls
+    await indexer.run()
+    return {
+        **result,
+        "signatures_per_minute": indexer.stats()["signatures_per_minute"],
+        "backfill_rpc_calls": backfill_calls,
+        "incremental_rpc_calls": gateway.calls - backfill_calls,
+    }
+
+
+if __name__ == "__main__":
+    print(asyncio.run(benchmark()))
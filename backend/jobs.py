@@ -0,0 +1,512 @@
+import abc
+import asyncio
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+from backend.logging_config import logging_config  # Import the configuration file
+import logging.config
+logging.config.dictConfig(logging_config)
+logger = logging.getLogger("jobs")
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+DEAD = "dead"
+
+# Same schema for MySQL and the SQLite stand-in. Times are epoch seconds.
+JOBS_TABLE = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job_key VARCHAR(255) NOT NULL PRIMARY KEY,
+    job_type VARCHAR(64) NOT NULL,
+    reference VARCHAR(255),
+    payload TEXT NOT NULL,
+    status VARCHAR(16) NOT NULL,
+    attempts INT NOT NULL DEFAULT 0,
+    max_attempts INT NOT NULL,
+    run_at DOUBLE NOT NULL,
+    locked_until DOUBLE,
+    last_error TEXT,
+    result TEXT,
+    created_at DOUBLE NOT NULL,
+    updated_at DOUBLE NOT NULL
+)
+"""
+JOBS_INDEXES = [
+    "CREATE INDEX {if_not_exists}jobs_status_run_at ON jobs (status, run_at)",
+    "CREATE INDEX {if_not_exists}jobs_reference ON jobs (reference)",
+]
+
+
+def _decode(job):
+    if job is None:
+        return None
+    job = dict(job)
+    job['payload'] = json.loads(job['payload'])
+    job['result'] = json.loads(job['result']) if job.get('result') else None
+    return job
+
+
+class JobStore(abc.ABC):
+    """
+    Persistence for the job queue. Subclasses provide `_execute` and `_claim`; the statements are written
+    with %s placeholders and shared between backends.
+    """
+    insert_ignore = "INSERT IGNORE"
+    if_not_exists = ""
+    for_update = " FOR UPDATE"
+
+    @abc.abstractmethod
+    async def _execute(self, query, values=(), fetch=None, connection=None):
+        """
+        Runs one statement. Returns the row (fetch="one"), the rows as dicts (fetch="all"), or the number
+        of affected rows.
+        """
+
+    @abc.abstractmethod
+    async def _claim(self, now, limit, lease):
+        """
+        Atomically marks up to `limit` due jobs as running until `now + lease`, counting the attempt, and
+        returns them as rows.
+        """
+
+    async def setup(self):
+        """
+        Creates the jobs table and its indexes if they do not exist yet.
+        """
+        await self._execute(JOBS_TABLE)
+        for query in JOBS_INDEXES:
+            try:
+                await self._execute(query.format(if_not_exists=self.if_not_exists))
+            except Exception as e:
+                # MySQL has no CREATE INDEX IF NOT EXISTS; a duplicate index is expected on restart.
+                logger.debug(f"Index not created: {e}")
+
+    async def enqueue(self, job_key, job_type, payload, reference=None, max_attempts=5, run_at=None, connection=None):
+        """
+        Inserts a job unless one with the same key already exists. With `connection`, the insert is part of
+        that open transaction and the job only becomes visible to workers once it commits.
+
+        Returns:
+        - bool: True if the job was created, False if the key was already queued (in any state).
+        """
+        now = time.time()
+        query = f"""{self.insert_ignore} INTO jobs
+            (job_key, job_type, reference, payload, status, attempts, max_attempts, run_at, created_at, updated_at)
+            VALUES (%s, %s, %s, %s, %s, 0, %s, %s, %s, %s)"""
+        values = (job_key, job_type, reference, json.dumps(payload, default=str), PENDING, max_attempts, run_at or now, now, now)
+        return await self._execute(query, values, connection=connection) == 1
+
+    async def claim(self, limit, lease):
+        """
+        Marks up to `limit` due jobs as running for `lease` seconds and returns them. Running jobs whose
+        lease expired, because their worker died, are due again.
+
+        Returns:
+        - list: The claimed jobs, with `attempts` already counting this run.
+        """
+        return [_decode(job) for job in await self._claim(time.time(), limit, lease)]
+
+    async def complete(self, job_key, result=None):
+        query = "UPDATE jobs SET status = %s, result = %s, locked_until = NULL, last_error = NULL, updated_at = %s WHERE job_key = %s"
+        await self._execute(query, (DONE, json.dumps(result, default=str), time.time(), job_key))
+
+    async def fail(self, job_key, error, retry_at=None):
+        """
+        Records a failed run. The job is retried at `retry_at`, or moved to the dead-letter state if None.
+        """
+        status = PENDING if retry_at is not None else DEAD
+        query = "UPDATE jobs SET status = %s, last_error = %s, run_at = %s, locked_until = NULL, updated_at = %s WHERE job_key = %s"
+        await self._execute(query, (status, error, retry_at or time.time(), time.time(), job_key))
+
+    async def retry(self, job_key):
+        """
+        Moves a dead job back to pending with a fresh set of attempts.
+
+        Returns:
+        - bool: True if a dead job was found.
+        """
+        query = "UPDATE jobs SET status = %s, attempts = 0, run_at = %s, updated_at = %s WHERE job_key = %s AND status = %s"
+        return await self._execute(query, (PENDING, time.time(), time.time(), job_key, DEAD)) == 1
+
+    async def get(self, job_key):
+        return _decode(await self._execute("SELECT * FROM jobs WHERE job_key = %s", (job_key,), fetch="one"))
+
+    async def lock(self, job_key, connection=None):
+        """
+        Reads a job with a locking read inside the open transaction `connection`, so a second run of the
+        same job blocks here until the first one commits or rolls back.
+
+        Returns:
+        - dict | None: The job, or None if there is no job with this key.
+        """
+        query = f"SELECT * FROM jobs WHERE job_key = %s{self.for_update}"
+        return _decode(await self._execute(query, (job_key,), fetch="one", connection=connection))
+
+    async def set_result(self, job_key, result, connection=None):
+        """
+        Stores a job's result without changing its status, e.g. to mark work as done inside the transaction
+        that did it, before the job itself is completed.
+        """
+        query = "UPDATE jobs SET result = %s, updated_at = %s WHERE job_key = %s"
+        await self._execute(query, (json.dumps(result, default=str), time.time(), job_key), connection=connection)
+
+    async def by_reference(self, reference, connection=None):
+        """
+        Returns every job enqueued with `reference`, oldest first.
+        """
+        rows = await self._execute("SELECT * FROM jobs WHERE reference = %s ORDER BY created_at, job_key", (reference,), fetch="all", connection=connection)
+        return [_decode(row) for row in rows]
+
+    async def counts(self):
+        """
+        Returns the number of jobs per type and status.
+        """
+        rows = await self._execute("SELECT job_type, status, COUNT(*) AS number FROM jobs GROUP BY job_type, status", fetch="all")
+        counts = {}
+        for row in rows:
+            counts.setdefault(row['job_type'], {})[row['status']] = int(row['number'])
+        return counts
+
+
+class MySQLJobStore(JobStore):
+    def __init__(self, database_client):
+        """
+        Keeps jobs in the application's MySQL database, through the shared DatabaseManager pool.
+
+        Parameters:
+        - database_client (DatabaseManager): The database manager to run statements with.
+
+        Returns:
+        - None
+        """
+        self.database_client = database_client
+
+    async def _execute(self, query, values=(), fetch=None, connection=None):
+        return await self.database_client.execute(query, values, fetch=fetch, dictionary=True, connection=connection)
+
+    async def _claim(self, now, limit, lease):
+        async with self.database_client.transaction() as connection:
+            query = """SELECT * FROM jobs
+                WHERE (status = %s AND run_at <= %s) OR (status = %s AND locked_until < %s)
+                ORDER BY run_at LIMIT %s FOR UPDATE SKIP LOCKED"""
+            jobs = await self.database_client.execute(query, (PENDING, now, RUNNING, now, limit), fetch="all", dictionary=True, connection=connection)
+            if jobs:
+                keys = [job['job_key'] for job in jobs]
+                query = f"""UPDATE jobs SET status = %s, attempts = attempts + 1, locked_until = %s, updated_at = %s
+                    WHERE job_key IN ({', '.join(['%s'] * len(keys))})"""
+                await self.database_client.execute(query, (RUNNING, now + lease, now, *keys), connection=connection)
+        for job in jobs:
+            job['attempts'] += 1
+        return jobs
+
+
+class SQLiteJobStore(JobStore):
+    insert_ignore = "INSERT OR IGNORE"
+    if_not_exists = "IF NOT EXISTS "
+    # SQLite has no row locks; its single lock already serializes every statement.
+    for_update = ""
+
+    def __init__(self, path=":memory:"):
+        """
+        Keeps jobs in a local SQLite file. A stand-in for MySQL in tests and local development; it is safe
+        for several workers in one process but not across processes. It is not in the application database,
+        so a `connection` passed to its methods is ignored and jobs are written outside that transaction.
+
+        Parameters:
+        - path (str): The database file, or ":memory:".
+
+        Returns:
+        - None
+        """
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+
+    def _run(self, query, values, fetch):
+        with self._lock:
+            cursor = self.connection.execute(query.replace("%s", "?"), values)
+            try:
+                if fetch == "one":
+                    row = cursor.fetchone()
+                    return dict(row) if row else None
+                if fetch == "all":
+                    return [dict(row) for row in cursor.fetchall()]
+                self.connection.commit()
+                return cursor.rowcount
+            finally:
+                cursor.close()
+
+    async def _execute(self, query, values=(), fetch=None, connection=None):
+        return await asyncio.to_thread(self._run, query, values, fetch)
+
+    def _claim_sync(self, now, limit, lease):
+        with self._lock:
+            query = """SELECT * FROM jobs
+                WHERE (status = ? AND run_at <= ?) OR (status = ? AND locked_until < ?)
+                ORDER BY run_at LIMIT ?"""
+            jobs = [dict(row) for row in self.connection.execute(query, (PENDING, now, RUNNING, now, limit))]
+            for job in jobs:
+                job['attempts'] += 1
+                self.connection.execute(
+                    "UPDATE jobs SET status = ?, attempts = ?, locked_until = ?, updated_at = ? WHERE job_key = ?",
+                    (RUNNING, job['attempts'], now + lease, now, job['job_key']),
+                )
+            self.connection.commit()
+            return jobs
+
+    async def _claim(self, now, limit, lease):
+        return await asyncio.to_thread(self._claim_sync, now, limit, lease)
+
+
+class JobQueue:
+    def __init__(self, store, workers=None, poll_interval=None, timeout=None, lease=None, backoff_base=None, backoff_max=None):
+        """
+        Initializes a persistent job queue served by a pool of async workers.
+
+        Jobs are identified by a caller-chosen key, so enqueueing the same work twice is a no-op. A job that
+        raises is retried with jittered exponential backoff until it has run `max_attempts` times, then it
+        is moved to the dead-letter state and kept for inspection and manual retry. Jobs survive restarts:
+        pending jobs are picked up by the next worker, and jobs whose worker died become due again once their
+        lease expires.
+
+        Parameters:
+        - store (JobStore): Where jobs are persisted.
+        - workers (int, optional): Concurrent jobs. Defaults to JOB_WORKERS or 4.
+        - poll_interval (float, optional): Seconds between polls when idle. Defaults to JOB_POLL_INTERVAL or 1.
+        - timeout (float, optional): Seconds a handler may run before it is cancelled and the run counts as
+          failed. Defaults to JOB_TIMEOUT or 300.
+        - lease (float, optional): Seconds a claimed job is reserved for its worker; once it expires the job
+          is considered abandoned and handed out again. It must be longer than `timeout` plus `poll_interval`,
+          so a job that is still running or recording its outcome is never run twice. Defaults to JOB_LEASE
+          or `timeout` + `poll_interval` + 60.
+        - backoff_base (float, optional): First retry delay in seconds. Defaults to JOB_BACKOFF_BASE or 2.
+        - backoff_max (float, optional): Longest retry delay in seconds. Defaults to JOB_BACKOFF_MAX or 600.
+
+        Returns:
+        - None
+
+        Raises:
+        - ValueError: If `lease` is not longer than `timeout` plus `poll_interval`.
+        """
+        self.store = store
+        self.workers = int(workers if workers is not None else os.getenv("JOB_WORKERS", 4))
+        self.poll_interval = float(poll_interval if poll_interval is not None else os.getenv("JOB_POLL_INTERVAL", 1))
+        self.timeout = float(timeout if timeout is not None else os.getenv("JOB_TIMEOUT", 300))
+        self.lease = float(lease if lease is not None else os.getenv("JOB_LEASE", self.timeout + self.poll_interval + 60))
+        if self.lease <= self.timeout + self.poll_interval:
+            raise ValueError(f"Job lease ({self.lease}s) must be longer than the handler timeout plus the poll interval ({self.timeout + self.poll_interval}s)")
+        self.backoff_base = float(backoff_base if backoff_base is not None else os.getenv("JOB_BACKOFF_BASE", 2))
+        self.backoff_max = float(backoff_max if backoff_max is not None else os.getenv("JOB_BACKOFF_MAX", 600))
+        self.handlers = {}
+        self.metrics = {}
+        self._tasks = []
+        self._wake = asyncio.Event()
+        self._ready = False
+        self._started_at = None
+
+    def register(self, job_type, handler, max_attempts=5):
+        """
+        Registers the coroutine function that runs jobs of `job_type`. It is called with the job payload
+        and its return value is stored as the job result.
+
+        Parameters:
+        - job_type (str): The job type.
+        - handler (callable): `async def handler(payload) -> result`.
+        - max_attempts (int): Default number of runs before a job of this type is dead-lettered.
+
+        Returns:
+        - None
+        """
+        self.handlers[job_type] = (handler, max_attempts)
+
+    def _metrics(self, job_type):
+        metrics = self.metrics.get(job_type)
+        if metrics is None:
+            metrics = self.metrics[job_type] = {
+                "enqueued": 0,
+                "duplicates": 0,
+                "succeeded": 0,
+                "retried": 0,
+                "dead": 0,
+                "run_seconds": 0.0,
+                "run_max_seconds": 0.0,
+                "wait_seconds": 0.0,
+            }
+        return metrics
+
+    async def _setup(self):
+        if not self._ready:
+            await self.store.setup()
+            self._ready = True
+
+    async def enqueue(self, job_key, job_type, payload, reference=None, max_attempts=None, connection=None):
+        """
+        Persists a job for the workers.
+
+        Parameters:
+        - job_key (str): Idempotency key. A second enqueue with the same key is ignored.
+        - job_type (str): A type registered with `register`.
+        - payload (dict): JSON-serializable arguments for the handler.
+        - reference (str, optional): Groups related jobs, e.g. the payment they belong to.
+        - max_attempts (int, optional): Overrides the type's default.
+        - connection (optional): An open database transaction to insert the job in, see JobStore.enqueue.
+
+        Returns:
+        - bool: True if the job was created, False if it already existed.
+        """
+        if job_type not in self.handlers:
+            raise ValueError(f"No handler registered for job type {job_type}")
+        await self._setup()
+        created = await self.store.enqueue(job_key, job_type, payload, reference, max_attempts or self.handlers[job_type][1], connection=connection)
+        self._metrics(job_type)["enqueued" if created else "duplicates"] += 1
+        if created:
+            logger.info(f"Enqueued job {job_key}")
+            self._wake.set()
+        self.start()
+        return created
+
+    def backoff(self, attempts):
+        """
+        Returns the jittered delay in seconds before retry number `attempts`.
+        """
+        delay = min(self.backoff_max, self.backoff_base * 2 ** (attempts - 1))
+        return random.uniform(delay / 2, delay)
+
+    async def run_job(self, job):
+        """
+        Runs one claimed job and records the outcome in the store.
+
+        Returns:
+        - bool: True if the job succeeded.
+        """
+        job_type = job['job_type']
+        metrics = self._metrics(job_type)
+        if job['attempts'] == 1:
+            metrics["wait_seconds"] += max(0.0, time.time() - job['created_at'])
+        if job['attempts'] > job['max_attempts']:
+            # The lease of the last allowed run expired without an outcome, most likely a crash mid-job.
+            metrics["dead"] += 1
+            await self.store.fail(job['job_key'], job['last_error'] or "Lease expired on the last attempt")
+            logger.critical(f"Job {job['job_key']} dead-lettered after its last attempt was abandoned")
+            return False
+        handler = self.handlers.get(job_type)
+        started = time.perf_counter()
+        try:
+            if handler is None:
+                raise LookupError(f"No handler registered for job type {job_type}")
+            result = await asyncio.wait_for(handler[0](job['payload']), self.timeout)
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            if job['attempts'] < job['max_attempts'] and handler is not None:
+                metrics["retried"] += 1
+                delay = self.backoff(job['attempts'])
+                await self.store.fail(job['job_key'], error, time.time() + delay)
+                logger.warning(f"Job {job['job_key']} failed on attempt {job['attempts']}, retrying in {delay:.1f}s: {error}")
+            else:
+                metrics["dead"] += 1
+                await self.store.fail(job['job_key'], error)
+                logger.critical(f"Job {job['job_key']} dead-lettered after {job['attempts']} attempts: {error}")
+            return False
+        finally:
+            seconds = time.perf_counter() - started
+            metrics["run_seconds"] += seconds
+            metrics["run_max_seconds"] = max(metrics["run_max_seconds"], seconds)
+        metrics["succeeded"] += 1
+        await self.store.complete(job['job_key'], result)
+        logger.info(f"Job {job['job_key']} done in {seconds:.2f}s")
+        return True
+
+    async def _worker(self, number):
+        while True:
+            try:
+                await self._setup()
+                jobs = await self.store.claim(1, self.lease)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Worker {number} could not claim jobs: {e}")
+                jobs = []
+                await asyncio.sleep(self.poll_interval * 5)
+            if not jobs:
+                self._wake.clear()
+                try:
+                    await asyncio.wait_for(self._wake.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            for job in jobs:
+                try:
+                    await self.run_job(job)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    # The outcome could not be stored; the lease expiry will hand the job out again.
+                    logger.error(f"Worker {number} could not record job {job['job_key']}: {e}")
+
+    def start(self):
+        """
+        Starts the worker tasks, if they are not running yet. Called by the first enqueue of the process, or
+        at startup when JOBS_ENABLED is set so that jobs left pending by a previous process are picked up
+        without waiting for new work. Call from a running event loop.
+        """
+        if self._tasks:
+            return
+        self._started_at = time.monotonic()
+        self._tasks = [asyncio.create_task(self._worker(number)) for number in range(self.workers)]
+        logger.info(f"Started {self.workers} job workers")
+
+    async def stop(self):
+        """
+        Cancels the worker tasks. Jobs that were running are handed out again when their lease expires.
+        """
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        logger.info("Stopped job workers")
+
+    async def stats(self):
+        """
+        Returns per-type throughput and latency metrics of this process, and job counts per status from the store.
+
+        Returns:
+        - dict: `workers`, `types` (per type: counters, jobs per minute, mean and max run time, mean queue wait)
+                and `counts` (per type and status).
+        """
+        uptime = time.monotonic() - self._started_at if self._started_at else 0
+        types = {}
+        for job_type, metrics in self.metrics.items():
+            runs = metrics["succeeded"] + metrics["retried"] + metrics["dead"]
+            types[job_type] = {
+                **metrics,
+                "per_minute": round(metrics["succeeded"] / uptime * 60, 3) if uptime else 0,
+                "run_mean_seconds": round(metrics["run_seconds"] / runs, 3) if runs else 0,
+                "wait_mean_seconds": round(metrics["wait_seconds"] / (metrics["succeeded"] + metrics["dead"]), 3) if metrics["succeeded"] + metrics["dead"] else 0,
+            }
+        await self._setup()
+        return {"workers": len(self._tasks), "types": types, "counts": await self.store.counts()}
+
+
+_queue = None
+
+
+def get_queue():
+    """
+    Returns the process-wide JobQueue, creating it on first call. JOB_STORE selects the backend: "mysql"
+    (default) uses the application database, "sqlite" uses the file at JOB_SQLITE_PATH.
+
+    Returns:
+    - JobQueue: The shared job queue.
+    """
+    global _queue
+    if _queue is None:
+        if os.getenv("JOB_STORE", "mysql").lower() == "sqlite":
+            store = SQLiteJobStore(os.getenv("JOB_SQLITE_PATH", "jobs.sqlite3"))
+        else:
+            from backend.database import get_database
+            store = MySQLJobStore(get_database())
+        _queue = JobQueue(store)
+    return _queue
@@ -60,6 +60,12 @@ logging_config = {
             'formatter': 'standard',
             'filename': 'logs/storage.log',
             'level': 'DEBUG',
+        },
+        'file_jobs': {
+            'class': 'logging.FileHandler',
+            'formatter': 'standard',
+            'filename': 'logs/jobs.log',
+            'level': 'DEBUG',
         }
     },
     'loggers': {
@@ -98,6 +104,11 @@ logging_config = {
             'level': 'DEBUG',
             'propagate': False,
         },
+        'jobs': {  # Logger for background jobs
+            'handlers': ['console', 'file_jobs'],
+            'level': 'DEBUG',
+            'propagate': False,
+        },
     }
 }
 
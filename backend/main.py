@@ -1,26 +1,26 @@
 from fastapi import FastAPI, HTTPException, Query,Depends,Form,status, Request, File, UploadFile
 from backend import database, paypal, utils, storage,mint
 from backend import transaction as transaction_module
+from backend import orderbook, settlement, jobs, rpc, indexer, asset_cache, preprocess
 from typing import Optional, List
-from solders.pubkey import Pubkey
 from pydantic import BaseModel,Field,EmailStr
 from datetime import datetime, timedelta,date
 import subprocess
-from fastapi.responses import RedirectResponse, JSONResponse
+from fastapi.responses import RedirectResponse, JSONResponse, Response
+from fastapi.encoders import jsonable_encoder
 from google.oauth2 import id_token
 from google.auth.transport import requests as google_requests
 from dotenv import load_dotenv
 import os  
 import requests
 import logging
-import uuid
-from decimal import Decimal
 import shutil
+from contextlib import asynccontextmanager
+import hashlib
+import json
 from backend.models import SignupRequest, NFTData, CreatePaymentData,BlockChainTransactionData, MintTrsData,TradeCreateData, KYCData, Metadata, User
 from . import mint 
 
-ROYALTY  = 2.5
-FEES = 2.5
 # Initialize logging
 from backend.logging_config import logging_config  # Import the configuration file
 import logging.config
@@ -28,6 +28,32 @@ logging.config.dictConfig(logging_config)
 logger = logging.getLogger("main")
 
 from backend.utils import get_current_user,get_current_verified_user,get_current_admin,create_auth_token,verify_token,User,Token,TokenData,authenticate_user,SECRET_KEY,ALGORITHM,ACCESS_TOKEN_EXPIRE_MINUTES,SERVER_URL
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Application lifespan. The database pool connects lazily on first use, and the job workers start on the
+    first enqueue, so nothing polls the database at boot unless JOBS_ENABLED (start the job workers, to resume
+    jobs left by a previous process) or INDEXER_ENABLED (run the on-chain indexer) is set. On shutdown they
+    are stopped and every pooled database and RPC connection is closed.
+    """
+    if os.getenv("JOBS_ENABLED", "false").lower() in ("1", "true", "yes"):
+        jobs.get_queue().start()
+    if os.getenv("INDEXER_ENABLED", "false").lower() in ("1", "true", "yes"):
+        indexer.get_indexer().start()
+    yield
+    await indexer.get_indexer().stop()
+    await jobs.get_queue().stop()
+    await mint.close_pool()
+    preprocess.close_executor()
+    await transaction_module.close_submitter()
+    await rpc.close_gateway()
+    await storage.close_storage()
+    await database.close_database()
+    logger.info("Shut down cleanly.")
+
+
 app = FastAPI(
     title="Whiplano API",
     description="The API used for the IP platform Whiplano",
@@ -35,15 +61,11 @@ app = FastAPI(
     contact={
         "name": "Dan",
         "email": "danielvincent1718@gmail.com",
-    }
+    },
+    lifespan=lifespan
 )
 whiplano_id = '0000-0000-0000'
-database_client = database.DatabaseManager(
-    host=os.getenv("DATABASE_HOST"),
-    user=os.getenv("DATABASE_USERNAME"),
-    password=os.getenv("DATABASE_PASSWORD"),
-    database =os.getenv("DATABASE_NAME")
-)
+database_client = database.get_database()
 
 
 GOOGLE_CLIENT_ID = os.getenv('GOOGLE_CLIENT_ID')
@@ -67,6 +89,18 @@ async def root():
     return ("Current working directory:", current_directory)
     return {"message": "App is running."}
 
+@app.get("/health", tags=["Health"], summary="Health check", description="Returns the database circuit breaker state and connection pool metrics.")
+async def health():
+    """
+    Reports whether the API can currently reach the database.
+
+    Returns:
+    JSONResponse: 200 with the breaker state and pool metrics while the breaker is closed, 503 otherwise.
+    """
+    data = database_client.health()
+    status_code = 200 if data['breaker']['state'] == 'closed' else 503
+    return JSONResponse(status_code=status_code, content=data)
+
 @app.post("/login", response_model=Token,tags=["Authentication"], summary="Logs in the User", description="Used to log in users via email/password")
 async def login(email: str = Form(...), password: str = Form(...)):
     """
@@ -171,9 +205,11 @@ async def submit_kyc(
     Returns:
     dict: A dictionary containing the message, KYC data, and URLs of the uploaded files.
     """
-    identity_url = await storage.upload_to_s3(identity_card, f"identity_cards/{current_user.id}")
-    utility_url = await storage.upload_to_s3(address_proof, f"address_proof/{current_user.id}")
-    selfie_url = await storage.upload_to_s3(selfie_with_id, f"selfies/{current_user.id}")
+    identity_url, utility_url, selfie_url = await storage.upload_many([
+        (identity_card, f"identity_cards/{current_user.id}"),
+        (address_proof, f"address_proof/{current_user.id}"),
+        (selfie_with_id, f"selfies/{current_user.id}"),
+    ], staged=True)
     logger.info(f"Uploaded Identity, Utility, and selfie to Filebase for user {current_user.email}.")
     await database_client.verify_user(current_user.email)
     logger.info(f"User {current_user.email} has been verified. ")
@@ -234,20 +270,74 @@ async def admin_creation_requests():
         return HTTPException(status_code= 500, content= e)
     
 
+@app.get("/admin/creation_requests/files",dependencies=[Depends(get_current_admin)],tags=["Admin"],summary="Lists the files of a TRS creation request",description="Returns every file uploaded for a TRS creation request with its IPFS CID.")
+async def admin_creation_request_files(title: str):
+    """
+    Lists the files stored under `trs_data/{title}/` with their CIDs. Only files new or overwritten since
+    the last listing are looked up in storage, see storage.CidResolver.resolve_prefix.
+
+    Parameters:
+    title (str): The title of the TRS creation request.
+
+    Returns:
+    dict: Object key -> CID, None for a file without one.
+    """
+    return await storage.get_resolver().resolve_prefix(f'trs_data/{title}/')
+
+
 @app.post("/admin/approve",dependencies = [Depends(get_current_user)],tags = ["Admin"],summary = "For approving TRS creation requests, and minting the TRS")
 async def admin_approve(id: int):
+    """
+    Approves a TRS creation request. Minting runs in the background; the response carries the id of the
+    job, to be followed at /admin/approve/status.
 
-    
+    Parameters:
+    id (int): The TRS creation request id.
+
+    Returns:
+    dict: A message and the job id. If the request was already approved, the message carries the status of
+          its existing job instead.
+
+    Raises:
+    HTTPException: 409 if the collection already exists, or if the earlier approval of this request failed:
+                   its job is dead and must be requeued with /admin/jobs/retry.
+    """
     number = 1000
     trs_creation_data = await database_client.get_trs_creation_data(id)
     trs_creation_data = trs_creation_data[0]
     exist = await database_client.check_collection_exists(trs_creation_data['title'])
     if exist: 
         raise HTTPException(status_code= 409, detail = "Collection already exists.")   
-    mint_address = await mint.mint(trs_creation_data['title'],trs_creation_data['description'],number,trs_creation_data['creator_email'])
-    token_account_address = await transaction_module.get_token_account_address(Pubkey.from_string(mint_address))
-    await database_client.approve_trs_creation_request(id,trs_creation_data['creator_email'],number,mint_address,trs_creation_data['title'],token_account_address)
-    return {"message":"TRS Succesfully created. "}
+    job_id, created = await mint.enqueue_approval(id, number)
+    if created:
+        return {"message":"TRS creation approved, minting started. ", "job_id": job_id}
+    job = await jobs.get_queue().store.get(job_id)
+    if job['status'] == jobs.DEAD:
+        raise HTTPException(status_code=409, detail=f"Minting failed for this request: {job['last_error']}. Retry it with /admin/jobs/retry?key={job_id}.")
+    return {"message": f"TRS creation already approved, minting job is {job['status']}. ", "job_id": job_id}
+
+
+@app.get("/admin/approve/status",dependencies = [Depends(get_current_admin)],tags = ["Admin"],summary = "Status of a TRS approval", description="Returns the state of the minting job started by /admin/approve.")
+async def admin_approve_status(job_id: str):
+    """
+    Returns the state of a minting job.
+
+    Parameters:
+    job_id (str): The job id returned by /admin/approve.
+
+    Returns:
+    dict: The job status ("pending", "running", "done" or "dead"), its result (mint and token account
+          addresses) once done, and the error, with the mint script's exit code and stderr, if it failed.
+
+    Raises:
+    HTTPException: 404 if there is no such job.
+    """
+    job = await jobs.get_queue().store.get(job_id)
+    if job is None or job['job_type'] != mint.APPROVE_JOB:
+        raise HTTPException(status_code=404, detail="No approval job found with this id.")
+    return {"job_id": job_id, "status": job['status'], "result": job['result'], "error": job['last_error']}
+
+
 @app.get("/callback/google", response_model = Token)
 async def google_callback(request: Request):
     """
@@ -349,27 +439,61 @@ async def create_trs_request(
         raise HTTPException(status_code=409, detail = "Collection already exists.")
     try:
         
-        file_urls = []
-        for file in files:
-            file_url = await storage.upload_to_s3(file,f'trs_data/{title}/{file.filename}')
-            file_urls.append(file_url)
-        image_url = await storage.upload_to_s3(image, f'trs_data/{title}/thumbnail.png')
+        uploads = [(file, f'trs_data/{title}/{file.filename}') for file in files] + [(image, f'trs_data/{title}/thumbnail.png')]
+        *file_urls, image_url = await storage.upload_many(uploads)
+        asset_cache.get_cache().invalidate(f'trs_data/{title}/thumbnail.png')
         file_url_header =  f'trs_data/{title}/'
 
-        await database_client.add_trs_creation_request(model_name,title,description,current_user.email, file_url_header)
+        try:
+            await database_client.add_trs_creation_request(model_name,title,description,current_user.email, file_url_header)
+        except Exception:
+            await storage.delete_many([object_name for _, object_name in uploads])
+            raise
 
         return JSONResponse(status_code= 200, content = {"message":"Trs creation request submitted succesfully. "})
     except Exception as e:
         return HTTPException(status_code = 500, detail = str(e))
 
+@app.put("/create_trs_request/files/{title}/{filename}", dependencies=[Depends(get_current_user)],tags=["TRS"], summary="Streams a TRS source file to storage", description="Uploads one large TRS source file as the raw request body, streamed to storage as it arrives. Use it before /create_trs_request for files too large to send as form data.")
+async def create_trs_request_file(title: str, filename: str, request: Request, current_user: User = Depends(get_current_user)):
+    """
+    Streams a TRS source file to `trs_data/{title}/{filename}`, the same place /create_trs_request puts its
+    files. The body is not spooled to disk; it is hashed and sent to storage in multipart parts as it arrives.
+
+    Parameters:
+    title (str): The title of the TRS the file belongs to.
+    filename (str): The name of the file.
+    request (Request): The request; its body is the file.
+    current_user (User): The uploader. This parameter is obtained from the 'get_current_user' function.
+
+    Returns:
+    dict: The file's url, SHA-256, size in bytes and number of parts.
+
+    Raises:
+    HTTPException: 400 for an invalid file name, 409 if the collection already exists or another user has a
+                   pending or approved TRS creation request with this title, 413 if the file is larger than
+                   MAX_UPLOAD_BYTES, 500 if the upload failed.
+    """
+    if filename in ("", ".", "..") or filename != os.path.basename(filename) or filename == "thumbnail.png":
+        raise HTTPException(status_code=400, detail="Invalid file name.")
+    length = request.headers.get("content-length")
+    if length is not None and length.isdigit() and int(length) > storage.MAX_UPLOAD_BYTES:
+        raise HTTPException(status_code=413, detail=f"File is larger than the maximum of {storage.MAX_UPLOAD_BYTES} bytes.")
+    if await database_client.check_collection_exists(title):
+        raise HTTPException(status_code=409, detail = "Collection already exists.")
+    pend_request = await database_client.get_trs_creation_requests('pending')
+    confirmed_request = await database_client.get_trs_creation_requests('approved')
+    for trs_request in pend_request + confirmed_request:
+        if trs_request['title'] == title and trs_request['creator_email'] != current_user.email:
+            raise HTTPException(status_code=409, detail = "There is already a TRS creation request in this Title.")
+    return await storage.stream_upload(request.stream(), f'trs_data/{title}/{filename}', content_type=request.headers.get("content-type"))
+
+
 @app.post('/trade/create',dependencies=[Depends(get_current_user)],tags=['Transactions'],summary="Creates a trade.",description="Creates a trade, adds it to the pending trades database, creates a paypal transaction")
 async def trade_create(data : TradeCreateData,buyer : User = Depends(get_current_user)):
 
-    mrktplace_collection = await database_client.get_marketplace_collection(data.collection_name)
-    number_of_trs = 0
-    for i in mrktplace_collection:
-        if i['collection_name'] == data.collection_name and i['bid_price']  == data.cost:
-            number_of_trs = i['number_of_trs']
+    book = await orderbook.books.get(database_client, data.collection_name)
+    number_of_trs = book.quantity_at(orderbook.SELL, data.cost)
     if number_of_trs < data.number:
         logger.info("Not enough TRS being offered by the sellers at the given price. ")
         raise HTTPException(status_code=400, detail="Not enough TRS being offered by the sellers at the given price. ")
@@ -420,9 +544,10 @@ async def execute_payment(
     """
     This function executes a PayPal payment with the given payment ID and Payer ID.
     It retrieves the payment details, modifies the payment status in the database,
-    approves initiated transactions, retrieves approved transactions, and processes
-    the transactions by executing payouts, updating the transaction records, and
-    transferring assets between users.
+    and enqueues the trade on the persistent job queue. The job workers then execute
+    the trade, which records the transfer of assets between users, and settle every
+    seller with a PayPal payout and an on-chain memo, retrying failed steps.
+    Progress can be followed at /trade/settlement.
 
     Parameters:
     paymentId (str, optional): The ID of the PayPal payment.
@@ -430,7 +555,8 @@ async def execute_payment(
 
     Returns:
     dict: A dictionary containing a success message if the payment is executed successfully.
-        - message (str): "Completed Trade with buyer transaction number {paymentId}"
+        - message (str): "Trade with buyer transaction number {paymentId} is being executed"
+        - status_url (str): Where to follow the settlement of the trade.
 
     Raises:
     HTTPException: If an error occurs during the payment execution.
@@ -441,57 +567,120 @@ async def execute_payment(
         logger.info(f"Executed payment with id {paymentId}")
         await database_client.modify_paypal_transaction(paymentId,'executed')
 
-        batch_id = str(uuid.uuid4)
-        seller_data = await database_client.execute_trade(paymentId)
-        logger.info(f"Trade executed with id {paymentId}")
-        token_account_address = None
-        for seller in seller_data:
-            amount = Decimal(seller['cost']) * Decimal(seller['number'])
-            amount1 = amount * (Decimal(100-ROYALTY+FEES)/Decimal(100))
-            amount2 = amount * (Decimal(ROYALTY)/Decimal(100))
-            payout_info = {
-                    "batch_id":batch_id,
-                    "recipient_email":seller['seller_email'],
-                    "amount":str(amount1),
-                    "currency":"USD",
-                    "note": f"Payment to {seller['seller_email']} for TRS of collection {seller['collection_name']}. "
-                }
-            await paypal.payout(payout_info)
-            logger.info(f"Paypal payout sent to {seller['seller_email']}. ")
-            royalty_payout_info = payout_info = {
-                    "batch_id":batch_id,
-                    "recipient_email":seller['seller_email'],
-                    "amount":str(amount2),
-                    "currency":"USD",
-                    "note": f"Royalty for {seller['creator_email']} for trade of TRS of collection {seller['collection_name']}. "
-                }
-            if not token_account_address:
-                token_account_address = 1
-            else: 
-                token_account_address = await database_client.get_token_account_address(seller['collection_name'])
-            data = {
-                "transaction_number":paymentId,
-                "buyer_id": seller['buyer_id'],
-                "seller_id": seller['seller_id'],
-                "seller_email": seller['seller_email'],
-                "buyer_email":seller['buyer_email'],
-                "trs_count": seller['number'],
-                'token_account_address':token_account_address
-            }
-            
-            await transaction_module.transaction(data)
-            logger.info(f"Sent transaction to complete trade {paymentId}")
-            
-        logger.info(f"Completed Trade with buyer transaction number {paymentId}")
-        return {"message": f"Completed Trade with buyer transaction number {paymentId}"}
-
-
+        await settlement.enqueue_trade(paymentId)
+        logger.info(f"Enqueued trade with buyer transaction number {paymentId}")
+        return {"message": f"Trade with buyer transaction number {paymentId} is being executed", "status_url": f"/trade/settlement?paymentId={paymentId}"}
 
     except Exception as error:
         logger.error(f"Error executing transaction {paymentId} {error}")
         raise HTTPException(status_code=500, detail=str(error))
 
 
+@app.get('/trade/settlement',tags=['Transactions'],summary='Settlement status of a trade.',description='Returns the payout and on-chain memo outcome for every seller of a trade.')
+async def trade_settlement(paymentId: str):
+    """
+    Returns the settlement status of a trade executed by /trade/execute_payment.
+
+    Parameters:
+    paymentId (str): The ID of the PayPal payment.
+
+    Returns:
+    dict: The overall status ("running", "completed" or "failed") and the state of the trade job and of each
+          seller's payout and memo jobs.
+
+    Raises:
+    HTTPException: 404 if no settlement is known for the payment.
+    """
+    result = await settlement.status(paymentId)
+    if result is None:
+        raise HTTPException(status_code=404, detail="No settlement found for this payment.")
+    return result
+
+
+@app.get('/admin/jobs',dependencies=[Depends(get_current_admin)],tags=["Admin"],summary="Job queue metrics",description="Returns throughput and latency per job type, the number of jobs per status and the state of the mint workers.")
+async def admin_jobs():
+    """
+    Returns the background job queue and mint worker metrics.
+
+    Returns:
+    dict: See JobQueue.stats, plus `mint_workers` (see MintWorkerPool.stats) and `asset_cache` (see AssetCache.stats).
+    """
+    return {**await jobs.get_queue().stats(), "mint_workers": mint.get_pool().stats(), "asset_cache": asset_cache.get_cache().stats()}
+
+
+@app.get('/admin/rpc',dependencies=[Depends(get_current_admin)],tags=["Admin"],summary="Solana RPC metrics",description="Returns the health of every Solana RPC endpoint, latency histograms per RPC method, and transaction submission and confirmation metrics.")
+async def admin_rpc():
+    """
+    Returns the Solana RPC gateway and transaction submitter metrics.
+
+    Returns:
+    dict: `gateway` (see RpcGateway.stats) and `submitter` (see TransactionSubmitter.stats).
+    """
+    return {"gateway": rpc.get_gateway().stats(), "submitter": transaction_module.get_submitter().stats()}
+
+
+@app.get('/admin/chain/trades',dependencies=[Depends(get_current_admin)],tags=["Admin"],summary="On-chain trade legs",description="Looks up the trade memos indexed from the central wallet's transactions by payment, buyer or seller.")
+async def admin_chain_trades(paymentId: Optional[str] = None, buyer: Optional[str] = None, seller: Optional[str] = None, limit: int = Query(100, ge=1, le=1000)):
+    """
+    Returns the on-chain trade legs recorded for a payment, buyer or seller, for reconciliation with the
+    'transactions' table.
+
+    Parameters:
+    paymentId (str, optional): The PayPal payment id.
+    buyer (str, optional): The buyer's user id.
+    seller (str, optional): The seller's user id.
+    limit (int): Maximum number of legs, newest first.
+
+    Returns:
+    dict: `legs`, see Indexer.lookup, and the indexer metrics.
+    """
+    legs = await indexer.get_indexer().lookup(paymentId, buyer, seller, limit)
+    return {"legs": legs, "indexer": indexer.get_indexer().stats()}
+
+
+@app.post('/admin/chain/index',dependencies=[Depends(get_current_admin)],tags=["Admin"],summary="Runs the on-chain indexer",description="Indexes the central wallet's signatures newer than the last checkpoint.")
+async def admin_chain_index():
+    """
+    Runs the on-chain indexer once.
+
+    Returns:
+    dict: The number of signatures and trade legs indexed.
+    """
+    return await indexer.get_indexer().run()
+
+
+@app.post('/admin/jobs/retry',dependencies=[Depends(get_current_admin)],tags=["Admin"],summary="Retries a dead job",description="Moves a dead-lettered job back to the queue with a fresh set of attempts.")
+async def admin_jobs_retry(key: str):
+    """
+    Requeues a dead-lettered job.
+
+    Parameters:
+    key (str): The job key, as shown by /trade/settlement.
+
+    Returns:
+    dict: A success message.
+
+    Raises:
+    HTTPException: 404 if there is no dead job with this key.
+    """
+    if not await jobs.get_queue().store.retry(key):
+        raise HTTPException(status_code=404, detail="No dead job found with this key.")
+    logger.info(f"Requeued job {key}")
+    return {"message": f"Job {key} requeued."}
+
+
+@app.post('/admin/holdings/rebuild',dependencies=[Depends(get_current_admin)],tags=["Admin"],summary="Rebuilds the TRS holdings table",description="Recomputes the per-user, per-collection TRS counts from the per-token rows. Needed after TRS_HOLDINGS_ENABLED was off for a while.")
+async def admin_holdings_rebuild():
+    """
+    Recomputes the trs_holdings table from the 'trs' rows.
+
+    Returns:
+    dict: A success message.
+    """
+    await database_client.rebuild_holdings()
+    return {"message": "TRS holdings rebuilt."}
+
+
 @app.get('/wallet/get', dependencies=[Depends(get_current_user)],tags=["User"], description="Returns a formatted wallet, as a JSON with created TRS, TRS on marketplace, and TRS with artisan rights.")
 async def wallet_get(user: User = Depends(get_current_user)):
     """
@@ -502,75 +691,116 @@ async def wallet_get(user: User = Depends(get_current_user)):
     user (User): The current user. This parameter is obtained from the 'get_current_user' function.
 
     Returns:
-    dict: A dictionary representing the formatted wallet. The dictionary contains the following keys:
-        - created_trs: A list of TRS created by the user.
-        - trs_on_marketplace: A list of TRS on the marketplace.
-        - trs_with_artisan_rights: A list of TRS with artisan rights.
+    dict: A dictionary representing the formatted wallet, keyed by collection name. Each entry contains:
+        - number: The number of TRS of the collection held by the user.
+        - created: Whether the user created the collection.
+        - artisan: The number of those TRS with artisan rights.
+        - marketplace: The number of those TRS on the marketplace.
+        - data: The collection's data.
     """
     try:
-        wallet = await database_client.get_wallet_formatted(user.id)
-        final_wallet = {}
-        
-        for trs in wallet['trs']:
-            if trs['collection_name'] in final_wallet.keys():
-                final_wallet[trs['collection_name']]['number'] +=1 
-                if trs['artisan'] == 1:
-                    final_wallet[trs['collection_name']]['artisan'] +=1
-                elif trs['marketplace'] == 1:
-                    final_wallet[trs['collection_name']]['marketplace'] +=1 
-                elif trs['creator'] == user.id:
-                    final_wallet[trs['collection_name']]['created'] = True
-            else:
-                collection_data = await database_client.get_collection_data(trs['collection_name'])
-                final_wallet[trs['collection_name']] = {'number': 1, 'created': False, 'artisan': 0,'marketplace': 0,'data':collection_data}
-                if trs['artisan'] == 1:
-                    final_wallet[trs['collection_name']]['artisan'] +=1
-                elif trs['marketplace'] == 1:
-                    final_wallet[trs['collection_name']]['marketplace'] +=1 
-
-        return final_wallet
+        return await database_client.get_wallet_summary(user.id)
     except Exception as e:
         logger.error(f"Error fetching wallet: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@app.get('/marketplace',tags=["Marketplace"],summary="Fetches the marketplace",description="Fetches all the martketplace entries, along with the respective data. ")
-async def marketplace():
+def etag_response(request: Request, content, max_age: int = 0) -> Response:
+    """
+    Serializes `content` to JSON with a strong ETag derived from the body.
+
+    If the client's If-None-Match header already holds that ETag, an empty 304 is returned instead of the payload.
+
+    Parameters:
+    request (Request): The incoming request.
+    content: Any JSON-encodable value.
+    max_age (int): Seconds clients may reuse the response without revalidating.
+
+    Returns:
+    Response: A 200 JSON response, or a 304 Not Modified.
+    """
+    body = json.dumps(jsonable_encoder(content), separators=(",", ":")).encode()
+    etag = '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+    headers = {"ETag": etag, "Cache-Control": f"public, max-age={max_age}"}
+    if_none_match = request.headers.get("if-none-match", "")
+    if etag in [tag.strip() for tag in if_none_match.split(",")] or if_none_match.strip() == "*":
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+@app.get('/marketplace',tags=["Marketplace"],summary="Fetches the marketplace",description="Fetches the marketplace entries, aggregated per collection and price, one page at a time. ")
+async def marketplace(request: Request, cursor: Optional[str] = None, limit: int = Query(50, ge=1, le=500)):
     """
-    Retrieves all TRS currently listed on the marketplace.
+    Retrieves one page of the TRS currently listed on the marketplace.
+
+    Parameters:
+    cursor (str, optional): The `next_cursor` returned with the previous page. Omit it for the first page.
+    limit (int): The maximum number of entries on the page.
 
     Returns:
-    list: A list of dictionaries, where each dictionary represents a TRS on the marketplace.
-          Each dictionary contains the following keys:
-          - trs_id: The unique identifier of the TRS.
-          - collection_name: The name of the collection to which the TRS belongs.
-          - owner_id: The unique identifier of the owner of the TRS.
-          - price: The price of the TRS on the marketplace.
+    dict: A page of the marketplace, with an ETag. Requests sending a matching If-None-Match get a 304.
+          - items: A list of dictionaries with the following keys:
+            - collection_name: The name of the collection.
+            - bid_price: The price per TRS.
+            - number_of_trs: The number of TRS listed at that price.
+          - next_cursor: The cursor of the next page, or None on the last page.
 
     """
     try:
-        trs_on_marketplace = await database_client.get_marketplace_all()
-        return trs_on_marketplace
+        page = await database_client.get_marketplace_page(cursor=cursor, limit=limit)
+        return etag_response(request, page)
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error fetching marketplace: {e}")
         raise HTTPException(status_code=500, detail=str(e))
     
-@app.get('/marketplace/collection',tags=["Marketplace"],summary="Fetches the marketplace for one collection",description="Fetches the martketplace entries for one specific collection, along with the respective data. ")
-async def marketplace_collection(collection_name: str):
+@app.get('/marketplace/collection',tags=["Marketplace"],summary="Fetches the marketplace for one collection",description="Fetches the martketplace entries for one specific collection, aggregated per price, one page at a time. ")
+async def marketplace_collection(request: Request, collection_name: str, cursor: Optional[str] = None, limit: int = Query(50, ge=1, le=500)):
     """
-    Retrieves all TRS of a specific collection currently listed on the marketplace.
+    Retrieves one page of the TRS of a specific collection currently listed on the marketplace.
 
     Parameters:
     collection_name (str): The name of the collection.
+    cursor (str, optional): The `next_cursor` returned with the previous page. Omit it for the first page.
+    limit (int): The maximum number of price levels on the page.
+
+    Returns:
+    dict: A page in the same format as /marketplace, with an ETag.
     """
     try:
-        trs_on_marketplace = await database_client.get_marketplace_collection(collection_name)
-        
-        return trs_on_marketplace
+        page = await database_client.get_marketplace_page(collection_name=collection_name, cursor=cursor, limit=limit)
+        return etag_response(request, page)
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error fetching marketplace for collection {collection_name}: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get('/marketplace/book',tags=["Marketplace"],summary="Fetches the order book for one collection",description="Returns the best ask and the price levels of a collection's order book. ")
+async def marketplace_book(collection_name: str, levels: int = 10, number: Optional[int] = None):
+    """
+    Returns the order book of a collection.
+
+    Parameters:
+    collection_name (str): The name of the collection.
+    levels (int): The number of price levels to return per side.
+    number (int, optional): If given, also returns how a buy of this many TRS would fill across price levels.
+
+    Returns:
+    dict: The best bid and ask, the depth per side, and the simulated fills if `number` was given.
+    """
+    try:
+        book = await orderbook.books.get(database_client, collection_name)
+        response = {"best_bid": book.best_bid(), "best_ask": book.best_ask(), **book.depth(levels)}
+        if number is not None:
+            response["fills"] = book.match_buy(number, dry_run=True)
+        return response
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error fetching order book for collection {collection_name}: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 @app.post('/marketplace/place',dependencies=[Depends(get_current_user)],tags=["Marketplace"],summary="Adds TRS to the marketplace",description="Adds TRS to the martketplace from a users wallet.  ")
 async def marketplace_add(collection_name: str, number: int,price:int, user: User = Depends(get_current_user)) -> dict:
     """
@@ -587,23 +817,7 @@ async def marketplace_add(collection_name: str, number: int,price:int, user: Use
         - message (str): "TRS added to marketplace successfully."
     """
     try:
-        wallet = await database_client.get_wallet_formatted(user.id)
-        req_wallet = []
-        
-        for i in wallet['trs']: 
-            
-            if i['collection_name'] == collection_name and i['marketplace'] == 0 and i['artisan'] == 0:
-                req_wallet.append(i)
-
-        if len(req_wallet) >= number:   
-            values = []
-            values2 = []
-            for i in req_wallet[:number]:
-        
-                values.append((i['trs_id'],collection_name,'sell', user.id,price))
-                values2.append((i['trs_id'],))
-            await database_client.add_trs_to_marketplace(user.id,values,values2,i['collection_name'])
-
+        if await database_client.place_on_marketplace(user.id, collection_name, number, price):
             return {"message": "TRS added to marketplace successfully."}
         else:
             return {"message": F"Insufficient TRS of {collection_name} in wallet."}
@@ -628,18 +842,7 @@ async def marketplace_remove(collection_name: str, number: int, user: User = Dep
         - message (str): "Insufficient TRS of {collection_name} in wallet."
     """
     try:
-        wallet = await database_client.get_wallet_formatted(user.id)
-        req_wallet = []
-        for i in wallet['trs']: 
-            if i['collection_name'] == collection_name and i['marketplace'] == 1 and i['artisan'] == 0:
-                req_wallet.append(i)
-
-        if len(req_wallet) >= number:
-            values = []
-            for i in req_wallet[:number]:
-                values.append((i['trs_id'],))
-            await database_client.remove_trs_from_marketplace(values,user.id)
-
+        if await database_client.remove_from_marketplace(user.id, collection_name, number):
             return {"message": "TRS removed from marketplace successfully."}
         else:
             return {"message": F"Insufficient TRS of {collection_name} in wallet."}
@@ -651,19 +854,7 @@ async def marketplace_remove(collection_name: str, number: int, user: User = Dep
 @app.post('/artisan/activate',dependencies=[Depends(get_current_user)],tags=["User"],summary="Activates artisan rights for a user's TRS",description="Activates artisan rights for a user's TRS")
 async def artisan_activate(collection_name: str, number: int, user: User = Depends(get_current_user)) -> dict:
     try:
-        wallet = await database_client.get_wallet_formatted(user.id)
-        req_wallet = []
-        for i in wallet['trs']: 
-            logger.debug(i)
-            if i['collection_name'] == collection_name and i['marketplace'] == 0 and i['artisan'] == 0:
-                req_wallet.append(i)
-
-        if len(req_wallet) >= number:
-            values = []
-            for i in req_wallet[:number]:
-                values.append((i['trs_id'],))
-            await database_client.activate_artisan_trs(values, user.id)
-
+        if await database_client.set_artisan(user.id, collection_name, number, True):
             return {"message": "Artisan rights activated. "}
         else:
             return {"message": F"Insufficient TRS of {collection_name} in wallet."}
@@ -676,17 +867,7 @@ async def artisan_activate(collection_name: str, number: int, user: User = Depen
 @app.post('/artisan/deactivate',dependencies=[Depends(get_current_user)],tags=["User"],summary="Deactivates artisan rights for a user's TRS",description="Deactivates artisan rights for a user's TRS")
 async def artisan_deactivate(collection_name: str, number: int, user: User = Depends(get_current_user)) -> dict:
     try:
-        wallet = await database_client.get_wallet_formatted(user.id)
-        req_wallet = []
-        for i in wallet['trs']: 
-            if i['collection_name'] == collection_name and i['marketplace'] == 0 and i['artisan'] == 1:
-                req_wallet.append(i)
-        if len(req_wallet) >= number:
-            values = []
-            for i in req_wallet[:number]:
-                values.append((i['trs_id'],))
-            await database_client.deactivate_artisan_trs(values, user.id)
-
+        if await database_client.set_artisan(user.id, collection_name, number, False):
             return {"message": f"Artisan rights deactivated for the trs {collection_name}"}
         else:
             return {"message": f"Insufficient TRS of {collection_name} in wallet."}
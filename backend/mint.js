@@ -27,15 +27,14 @@ import { dirname } from "path";
 import dotenv from "dotenv";
 
 dotenv.config();
-const args = process.argv.slice(2);
-const imagePath = args[0];
-const metadataPath = args[1]; // Now passing metadata file path
-const name = args[2];
 
 // Get the current directory name
 const __filename = fileURLToPath(import.meta.url);
 const __dirname = dirname(__filename);
-const createNft = async (name, ImagePath, MetadataPath) => {
+
+// Sets up Umi and the central wallet signer. Done once per process: mint_worker.js reuses the result for
+// every mint.
+export const setupUmi = () => {
     //
     // ** Setting Up Umi **
     //
@@ -64,7 +63,10 @@ const createNft = async (name, ImagePath, MetadataPath) => {
     );
     const signer = createSignerFromKeypair(umi, keypair);
     umi.use(signerIdentity(signer));
+    return { umi, signer };
+};
 
+export const createNft = async ({ umi, signer }, name, ImagePath, MetadataPath) => {
     //
     // ** Upload an image to Arweave **
     //
@@ -132,17 +134,19 @@ const createNft = async (name, ImagePath, MetadataPath) => {
         tokenStandard: TokenStandard.NonFungible,
     }).sendAndConfirm(umi);
 
-    const asset = await fetchDigitalAsset(umi, mint.publicKey);
-    console.log(
-        JSON.stringify({
-            mintAddress: mint.publicKey,
-        }),
-    );
+    await fetchDigitalAsset(umi, mint.publicKey);
+    return mint.publicKey;
 };
 
-// Get command-line arguments
-createNft(name, imagePath, metadataPath)
-    .then((nftSigner) => {})
-    .catch((error) => {
-        console.error(error);
-    });
+// Run as a script: node mint.js <image path> <metadata path> <name>
+if (process.argv[1] && path.resolve(process.argv[1]) === __filename) {
+    const [imagePath, metadataPath, name] = process.argv.slice(2);
+    createNft(setupUmi(), name, imagePath, metadataPath)
+        .then((mintAddress) => {
+            console.log(JSON.stringify({ mintAddress }));
+        })
+        .catch((error) => {
+            console.error(error);
+            process.exitCode = 1;
+        });
+}
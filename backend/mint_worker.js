@@ -0,0 +1,74 @@
+// Long-lived mint worker, driven by backend/mint.py over newline-delimited JSON on stdin/stdout.
+//
+// Requests:  {"id": 1, "method": "mint", "params": {"image_path": ..., "metadata_path": ..., "name": ...}}
+//            {"id": 2, "method": "ping"}
+// Responses: {"id": 1, "result": {"mintAddress": ...}}
+//            {"id": 1, "error": {"message": ..., "stack": ...}}
+// Once Umi and the keypair are set up the worker writes {"ready": true, "pid": ...}. stdout carries only
+// protocol messages; logs go to stderr.
+import readline from "readline";
+
+console.log = console.error;
+console.info = console.error;
+console.warn = console.error;
+
+const { setupUmi, createNft } = await import("./mint.js");
+
+const started = Date.now();
+const context = setupUmi();
+let mints = 0;
+let inFlight = 0;
+
+const send = (message) => {
+    process.stdout.write(JSON.stringify(message) + "\n");
+};
+
+const methods = {
+    ping: async () => ({
+        uptime: (Date.now() - started) / 1000,
+        mints,
+        inFlight,
+        rss: process.memoryUsage().rss,
+    }),
+    mint: async ({ image_path, metadata_path, name }) => {
+        const mintAddress = await createNft(context, name, image_path, metadata_path);
+        mints += 1;
+        return { mintAddress };
+    },
+};
+
+const handle = async (line) => {
+    let request;
+    try {
+        request = JSON.parse(line);
+    } catch (error) {
+        console.error(`Ignoring malformed request: ${line}`);
+        return;
+    }
+    const method = methods[request.method];
+    if (!method) {
+        send({ id: request.id, error: { message: `Unknown method ${request.method}` } });
+        return;
+    }
+    inFlight += 1;
+    try {
+        send({ id: request.id, result: await method(request.params || {}) });
+    } catch (error) {
+        console.error(error);
+        send({ id: request.id, error: { message: String(error && error.message ? error.message : error), stack: error && error.stack } });
+    } finally {
+        inFlight -= 1;
+    }
+};
+
+readline.createInterface({ input: process.stdin }).on("line", (line) => {
+    if (line.trim()) {
+        handle(line);
+    }
+}).on("close", () => {
+    // The parent closed stdin: finish what is in flight, then exit.
+    const exit = () => (inFlight ? setTimeout(exit, 100) : process.exit(0));
+    exit();
+});
+
+send({ ready: true, pid: process.pid });
@@ -0,0 +1,343 @@
+import asyncio
+import time
+import random
+from collections import deque
+from decimal import Decimal
+from sortedcontainers import SortedList
+from backend.logging_config import logging_config  # Import the configuration file
+import logging.config
+logging.config.dictConfig(logging_config)
+logger = logging.getLogger("marketplace")
+
+BUY = "buy"
+SELL = "sell"
+
+
+def to_price(price):
+    """
+    Normalizes a price to a Decimal so that 5, 5.0 and Decimal('5.00') land on the same level.
+    """
+    return Decimal(str(price)).normalize()
+
+
+class Order:
+    __slots__ = ("order_id", "user_id", "side", "price", "quantity")
+
+    def __init__(self, order_id, user_id, side, price, quantity):
+        self.order_id = order_id
+        self.user_id = user_id
+        self.side = side
+        self.price = price
+        self.quantity = quantity
+
+
+class PriceLevel:
+    __slots__ = ("price", "orders", "quantity")
+
+    def __init__(self, price):
+        self.price = price
+        self.orders = deque()
+        # Cancelled orders stay in the queue with quantity 0 until they reach the front; matching drops them.
+        self.quantity = 0
+
+
+class OrderBook:
+    def __init__(self, collection_name):
+        """
+        Initializes an empty order book for one collection.
+
+        Each side keeps a SortedList of prices and a FIFO queue of orders per price. Levels are found through
+        a dict, adding or removing a price level is O(log n) in the number of levels, and cancelling an order
+        is O(1) once the level is found because cancelled orders are removed lazily when they reach the front
+        of their queue.
+
+        Parameters:
+        - collection_name (str): The name of the collection.
+
+        Returns:
+        - None
+        """
+        self.collection_name = collection_name
+        self._levels = {BUY: {}, SELL: {}}
+        self._prices = {BUY: SortedList(), SELL: SortedList()}
+        self._orders = {}
+
+    def add(self, order_id, user_id, side, price, quantity):
+        """
+        Adds quantity to an order, creating it at the back of its price level if it is new.
+
+        Parameters:
+        - order_id (hashable): Identifier of the order.
+        - user_id (str): The unique identifier of the order owner.
+        - side (str): BUY or SELL.
+        - price (Decimal | float | int): The price per TRS.
+        - quantity (int): The number of TRS.
+
+        Returns:
+        - Order: The order.
+        """
+        price = to_price(price)
+        order = self._orders.get(order_id)
+        if order is not None and order.quantity > 0:
+            if order.price != price or order.side != side:
+                raise ValueError(f"Order {order_id} already exists at {order.side} {order.price}")
+            order.quantity += quantity
+            self._levels[side][price].quantity += quantity
+            return order
+        level = self._levels[side].get(price)
+        if level is None:
+            level = self._levels[side][price] = PriceLevel(price)
+            self._prices[side].add(price)
+        order = Order(order_id, user_id, side, price, quantity)
+        level.orders.append(order)
+        level.quantity += quantity
+        self._orders[order_id] = order
+        return order
+
+    def cancel(self, order_id, quantity=None):
+        """
+        Removes quantity from an order, or the whole order if `quantity` is None.
+
+        Parameters:
+        - order_id (hashable): Identifier of the order.
+        - quantity (int, optional): The number of TRS to remove.
+
+        Returns:
+        - int: The quantity actually removed.
+        """
+        order = self._orders.get(order_id)
+        if order is None:
+            return 0
+        removed = order.quantity if quantity is None else min(quantity, order.quantity)
+        self._reduce(order, removed)
+        return removed
+
+    def _reduce(self, order, quantity):
+        order.quantity -= quantity
+        level = self._levels[order.side][order.price]
+        level.quantity -= quantity
+        if order.quantity == 0:
+            del self._orders[order.order_id]
+        if level.quantity == 0:
+            del self._levels[order.side][order.price]
+            self._prices[order.side].remove(order.price)
+
+    def best_bid(self):
+        """
+        Returns the highest buy price, or None if there are no bids.
+        """
+        prices = self._prices[BUY]
+        return prices[-1] if prices else None
+
+    def best_ask(self):
+        """
+        Returns the lowest sell price, or None if there are no asks.
+        """
+        prices = self._prices[SELL]
+        return prices[0] if prices else None
+
+    def quantity_at(self, side, price):
+        """
+        Returns the total quantity resting at one price level.
+        """
+        level = self._levels[side].get(to_price(price))
+        return level.quantity if level else 0
+
+    def depth(self, levels=10):
+        """
+        Returns a snapshot of the best price levels on each side.
+
+        Parameters:
+        - levels (int): The number of levels per side.
+
+        Returns:
+        - dict: `bids` (highest first) and `asks` (lowest first), each a list of {price, quantity, orders}.
+        """
+        def snapshot(side, prices):
+            return [
+                {"price": price, "quantity": self._levels[side][price].quantity, "orders": sum(1 for o in self._levels[side][price].orders if o.quantity)}
+                for price in prices
+            ]
+        return {
+            "collection_name": self.collection_name,
+            "bids": snapshot(BUY, self._prices[BUY].islice(max(0, len(self._prices[BUY]) - levels), reverse=True)),
+            "asks": snapshot(SELL, self._prices[SELL].islice(0, levels)),
+        }
+
+    def match_buy(self, quantity, limit_price=None, dry_run=False):
+        """
+        Matches a buy against the asks, best price first and FIFO within a price, across as many levels as needed.
+
+        Parameters:
+        - quantity (int): The number of TRS to buy.
+        - limit_price (Decimal | float | int, optional): The highest price the buyer accepts. No limit if None.
+        - dry_run (bool): Compute the fills without changing the book.
+
+        Returns:
+        - list: Fills as dictionaries with order_id, user_id, price and quantity. The total may be less than
+                `quantity` if the book does not hold enough at or below the limit.
+        """
+        limit = to_price(limit_price) if limit_price is not None else None
+        fills = []
+        remaining = quantity
+        prices = self._prices[SELL]
+        index = 0
+        while remaining and index < len(prices):
+            price = prices[index]
+            if limit is not None and price > limit:
+                break
+            level = self._levels[SELL][price]
+            if dry_run:
+                for order in level.orders:
+                    if remaining == 0:
+                        break
+                    take = min(order.quantity, remaining)
+                    if take:
+                        fills.append({"order_id": order.order_id, "user_id": order.user_id, "price": price, "quantity": take})
+                        remaining -= take
+                index += 1
+                continue
+            while remaining and level.orders:
+                order = level.orders[0]
+                if order.quantity == 0:
+                    level.orders.popleft()
+                    continue
+                take = min(order.quantity, remaining)
+                fills.append({"order_id": order.order_id, "user_id": order.user_id, "price": price, "quantity": take})
+                remaining -= take
+                if take == order.quantity:
+                    level.orders.popleft()
+                # Emptying the level removes prices[index], so the next level slides into place.
+                self._reduce(order, take)
+        return fills
+
+    def available(self, limit_price=None):
+        """
+        Returns the quantity a buy could fill at or below `limit_price`.
+        """
+        limit = to_price(limit_price) if limit_price is not None else None
+        total = 0
+        for price in self._prices[SELL]:
+            if limit is not None and price > limit:
+                break
+            total += self._levels[SELL][price].quantity
+        return total
+
+
+class MarketBooks:
+    def __init__(self):
+        """
+        Holds one OrderBook per collection for the whole marketplace.
+
+        The books mirror the 'marketplace' table. They are loaded from the database on first use, and kept in
+        sync by DatabaseManager after every placement and removal, and by the trade flow after every fill.
+        Sell listings are keyed by (user_id, price), so repeated listings by a seller at one price form a
+        single order.
+
+        Returns:
+        - None
+        """
+        self.books = {}
+        self.loaded = False
+        self._lock = asyncio.Lock()
+        self._changes = 0
+
+    def book(self, collection_name):
+        """
+        Returns the OrderBook of a collection, creating an empty one if needed.
+        """
+        book = self.books.get(collection_name)
+        if book is None:
+            book = self.books[collection_name] = OrderBook(collection_name)
+        return book
+
+    async def load(self, database_client):
+        """
+        Rebuilds every book from the database. Reloads if listings change while the snapshot is being read.
+
+        Parameters:
+        - database_client (DatabaseManager): The database to read the marketplace listings from.
+
+        Returns:
+        - None
+        """
+        async with self._lock:
+            while True:
+                changes = self._changes
+                rows = await database_client.get_marketplace_orders()
+                if changes == self._changes:
+                    break
+            self.books = {}
+            for row in rows:
+                self.book(row['collection_name']).add((row['user_id'], to_price(row['bid_price'])), row['user_id'], SELL, row['bid_price'], int(row['number']))
+            self.loaded = True
+            logger.info(f"Loaded order books for {len(self.books)} collections from {len(rows)} price levels.")
+
+    async def get(self, database_client, collection_name):
+        """
+        Returns a collection's OrderBook, loading every book from the database first if needed.
+        """
+        if not self.loaded:
+            await self.load(database_client)
+        return self.book(collection_name)
+
+    def listed(self, collection_name, user_id, price, quantity):
+        """
+        Records `quantity` TRS listed for sale by `user_id` at `price`.
+        """
+        self._changes += 1
+        if self.loaded:
+            self.book(collection_name).add((user_id, to_price(price)), user_id, SELL, price, quantity)
+
+    def delisted(self, collection_name, user_id, price, quantity):
+        """
+        Records `quantity` TRS of `user_id` at `price` leaving the marketplace, through removal or a trade.
+        """
+        self._changes += 1
+        if self.loaded:
+            self.book(collection_name).cancel((user_id, to_price(price)), quantity)
+
+
+books = MarketBooks()
+
+
+def benchmark(levels=200, orders_per_level=50, buys=100000, seed=1):
+    """
+    Measures matching throughput on a synthetic book: `levels` ask prices with `orders_per_level` orders each,
+    then `buys` random market buys, each followed by a replenishing order so the book keeps its depth, then
+    `buys` orders at a random new price that are cancelled right away, each creating and removing a level.
+
+    Returns:
+    - dict: Insert, match and level change rates per second.
+    """
+    rng = random.Random(seed)
+    book = OrderBook("benchmark")
+    started = time.perf_counter()
+    order_id = 0
+    for level in range(levels):
+        for _ in range(orders_per_level):
+            order_id += 1
+            book.add(order_id, f"user{order_id}", SELL, 100 + level, rng.randint(1, 20))
+    inserted = time.perf_counter() - started
+    started = time.perf_counter()
+    for _ in range(buys):
+        fills = book.match_buy(rng.randint(1, 40))
+        order_id += 1
+        book.add(order_id, f"user{order_id}", SELL, fills[-1]["price"] if fills else 100, sum(f["quantity"] for f in fills) or 1)
+    matched = time.perf_counter() - started
+    started = time.perf_counter()
+    for _ in range(buys):
+        order_id += 1
+        book.add(order_id, f"user{order_id}", SELL, Decimal(100 + rng.randrange(levels * 100)) / 100 + Decimal("0.005"), 1)
+        book.cancel(order_id)
+    churned = time.perf_counter() - started
+    return {
+        "orders": levels * orders_per_level,
+        "inserts_per_second": round(levels * orders_per_level / inserted),
+        "matches_per_second": round(buys / matched),
+        "level_changes_per_second": round(buys / churned),
+    }
+
+
+if __name__ == "__main__":
+    print(benchmark())
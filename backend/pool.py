@@ -0,0 +1,222 @@
+import asyncio
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+import mysql.connector
+from mysql.connector import Error, InterfaceError, OperationalError
+from backend.logging_config import logging_config  # Import the configuration file
+import logging.config
+logging.config.dictConfig(logging_config)
+logger = logging.getLogger("database")
+
+
+# Client error codes meaning the server could not be reached or the socket was lost.
+CONNECTION_ERRNOS = {2003, 2006, 2013, 2055}
+
+
+class PoolTimeout(Error):
+    """Raised when no pooled connection becomes free within the acquire timeout."""
+
+
+def is_connection_error(error):
+    """
+    Returns True if a driver error means the connection itself is unusable, as opposed to a failed statement.
+    """
+    return isinstance(error, InterfaceError) or getattr(error, "errno", None) in CONNECTION_ERRNOS
+
+
+class ConnectionPool:
+    def __init__(self, host, user, password, database, min_size=1, max_size=10, acquire_timeout=10.0, ping_interval=30.0):
+        """
+        Initializes a bounded pool of MySQL connections for use from async code.
+
+        No connection is opened here. The first checkout opens `min_size` connections, and further
+        connections are opened on demand until `max_size` are checked out at once. Every blocking
+        mysql.connector call is run in a worker thread so the event loop is never stalled by a query.
+
+        Parameters:
+        - host (str): The host address of the MySQL database.
+        - user (str): The username for connecting to the MySQL database.
+        - password (str): The password for connecting to the MySQL database.
+        - database (str): The name of the MySQL database.
+        - min_size (int): The number of connections kept open once the pool is in use.
+        - max_size (int): The maximum number of connections checked out at the same time.
+        - acquire_timeout (float): Seconds to wait for a free connection before raising PoolTimeout.
+        - ping_interval (float): Idle seconds after which a connection is pinged before being reused.
+
+        Returns:
+        - None
+        """
+        if min_size < 0 or max_size < 1 or min_size > max_size:
+            raise ValueError(f"Invalid pool size min={min_size} max={max_size}")
+        self.connect_args = {
+            "host": host,
+            "user": user,
+            "password": password,
+            "database": database,
+        }
+        self.min_size = min_size
+        self.max_size = max_size
+        self.acquire_timeout = acquire_timeout
+        self.ping_interval = ping_interval
+        self._idle = deque()
+        self._size = 0
+        self._in_use = 0
+        self._semaphore = asyncio.Semaphore(max_size)
+        self._filled = False
+        self._closed = False
+        self.metrics = {
+            "acquired": 0,
+            "released": 0,
+            "created": 0,
+            "discarded": 0,
+            "timeouts": 0,
+            "wait_seconds": 0.0,
+        }
+
+    async def _open(self):
+        connection = await asyncio.to_thread(mysql.connector.connect, **self.connect_args)
+        self._size += 1
+        self.metrics["created"] += 1
+        logger.info(f"Opened pooled database connection ({self._size}/{self.max_size})")
+        return connection
+
+    async def _fill(self):
+        self._filled = True
+        while self._size < self.min_size:
+            self._idle.append((await self._open(), time.monotonic()))
+
+    def _discard(self, connection):
+        self._size -= 1
+        self.metrics["discarded"] += 1
+        try:
+            connection.close()
+        except Error:
+            pass
+
+    async def acquire(self):
+        """
+        Checks a connection out of the pool, waiting up to `acquire_timeout` seconds for one to be free.
+
+        Returns:
+        - MySQLConnection: A live connection. It must be handed back with `release`.
+
+        Raises:
+        - PoolTimeout: If every connection stays checked out for longer than the timeout.
+        - mysql.connector.Error: If a new connection cannot be opened.
+        """
+        if self._closed:
+            raise InterfaceError("Connection pool is closed")
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), self.acquire_timeout)
+        except asyncio.TimeoutError:
+            self.metrics["timeouts"] += 1
+            raise PoolTimeout(f"No database connection free after {self.acquire_timeout}s")
+        self.metrics["wait_seconds"] += time.perf_counter() - started
+        try:
+            if not self._filled:
+                await self._fill()
+            connection = await self._checkout()
+        except BaseException:
+            self._semaphore.release()
+            raise
+        self._in_use += 1
+        self.metrics["acquired"] += 1
+        return connection
+
+    async def _checkout(self):
+        while self._idle:
+            connection, returned_at = self._idle.pop()
+            if time.monotonic() - returned_at < self.ping_interval:
+                return connection
+            if await asyncio.to_thread(connection.is_connected):
+                return connection
+            logger.info("Dropping stale pooled database connection")
+            self._discard(connection)
+        return await self._open()
+
+    async def release(self, connection, discard=False):
+        """
+        Returns a connection to the pool. Any open transaction is rolled back first.
+
+        Parameters:
+        - connection (MySQLConnection): A connection obtained from `acquire`.
+        - discard (bool): Close the connection instead of reusing it, e.g. after a connection-level error.
+
+        Returns:
+        - None
+        """
+        self._in_use -= 1
+        self.metrics["released"] += 1
+        try:
+            if not discard and not self._closed:
+                try:
+                    if connection.in_transaction:
+                        await asyncio.to_thread(connection.rollback)
+                    self._idle.append((connection, time.monotonic()))
+                    return
+                except Error as e:
+                    logger.error(f"Error: {e}")
+            self._discard(connection)
+        finally:
+            self._semaphore.release()
+
+    @asynccontextmanager
+    async def connection(self):
+        """
+        Async context manager that checks a connection out for the duration of the block.
+
+        Connections that raised an OperationalError or InterfaceError are closed instead of being
+        returned, so a dropped socket is never handed to the next caller.
+        """
+        connection = await self.acquire()
+        discard = False
+        try:
+            yield connection
+        except (OperationalError, InterfaceError):
+            discard = True
+            raise
+        finally:
+            await self.release(connection, discard=discard)
+
+    def clear_idle(self):
+        """
+        Drops every idle connection, e.g. after the server went away, so they are not handed out again.
+
+        Returns:
+        - None
+        """
+        while self._idle:
+            connection, _ = self._idle.pop()
+            self._discard(connection)
+
+    async def close(self):
+        """
+        Closes every idle connection and stops the pool from handing out new ones.
+        Connections still checked out are closed when they are released.
+
+        Returns:
+        - None
+        """
+        self._closed = True
+        while self._idle:
+            connection, _ = self._idle.pop()
+            await asyncio.to_thread(self._discard, connection)
+        logger.info("Database connection pool closed")
+
+    def stats(self):
+        """
+        Returns a snapshot of the pool size and usage counters.
+
+        Returns:
+        - dict: Current size, idle and in-use counts, configured bounds and cumulative metrics.
+        """
+        return {
+            "size": self._size,
+            "idle": len(self._idle),
+            "in_use": self._in_use,
+            "min_size": self.min_size,
+            "max_size": self.max_size,
+            **self.metrics,
+        }
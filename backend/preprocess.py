@@ -0,0 +1,245 @@
+import asyncio
+import hashlib
+import io
+import json
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from PIL import Image, ImageOps
+import dotenv
+dotenv.load_dotenv()
+
+from backend.logging_config import logging_config  # Import the configuration file
+import logging.config
+logging.config.dictConfig(logging_config)
+logger = logging.getLogger("mint")
+
+# Longest side of a preprocessed image, in pixels; smaller images are not upscaled.
+PREPROCESS_SIZE = int(os.getenv("PREPROCESS_SIZE", 1024))
+PREPROCESS_FORMAT = os.getenv("PREPROCESS_FORMAT", "PNG").upper()
+PREPROCESS_WORKERS = int(os.getenv("PREPROCESS_WORKERS", os.cpu_count() or 1))
+# Items per task sent to a worker process; larger chunks spend less time pickling results.
+PREPROCESS_CHUNK = int(os.getenv("PREPROCESS_CHUNK", 64))
+EXTENSIONS = {"PNG": "png", "JPEG": "jpg", "WEBP": "webp"}
+MIME_TYPES = {"PNG": "image/png", "JPEG": "image/jpeg", "WEBP": "image/webp"}
+
+
+def _write_atomic(path, data):
+    temp = f"{path}.{os.getpid()}.part"
+    with open(temp, 'wb') as file:
+        file.write(data)
+    os.replace(temp, path)
+
+
+def process_image(source, destination, size=PREPROCESS_SIZE, image_format=PREPROCESS_FORMAT):
+    """
+    Resizes an image to fit in `size` x `size`, applies its EXIF orientation, and re-encodes it in
+    `image_format` without any of the source's metadata (EXIF, ICC profile, text chunks).
+
+    Runs in a worker process; everything it takes and returns is picklable.
+
+    Parameters:
+    - source (str): Path of the source image.
+    - destination (str): Path of the output image, written atomically.
+    - size (int): Longest side of the output, in pixels.
+    - image_format (str): "PNG", "JPEG" or "WEBP".
+
+    Returns:
+    - dict: path, sha256 and size in bytes of the output, and its width and height.
+    """
+    with Image.open(source) as image:
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((size, size), Image.LANCZOS)
+        if image_format == "JPEG" and image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+        elif image.mode not in ("RGB", "RGBA", "L", "LA"):
+            image = image.convert("RGBA")
+        # Drop everything Pillow would otherwise carry over from the source file.
+        image.info = {}
+        buffer = io.BytesIO()
+        # PNG's optimize retries the encode with every zlib setting; JPEG's only optimizes the Huffman tables.
+        image.save(buffer, image_format, optimize=image_format == "JPEG")
+        width, height = image.size
+    data = buffer.getvalue()
+    _write_atomic(destination, data)
+    return {"path": destination, "sha256": hashlib.sha256(data).hexdigest(), "bytes": len(data), "width": width, "height": height}
+
+
+def item_metadata(name, symbol, description, number, image_uri, image_format=PREPROCESS_FORMAT, sha256=None):
+    """
+    Returns the metadata JSON of one collection item, in the layout of collections/assets/<n>.json.
+    """
+    metadata = {
+        "name": f"{name} #{number}",
+        "symbol": symbol,
+        "description": description,
+        "image": image_uri,
+        "attributes": [
+            {
+                "trait_type": "Number",
+                "value": str(number),
+            }
+        ],
+        "properties": {
+            "files": [
+                {
+                    "uri": image_uri,
+                    "type": MIME_TYPES[image_format],
+                }
+            ]
+        },
+    }
+    if sha256:
+        metadata["properties"]["files"][0]["sha256"] = sha256
+    return metadata
+
+
+def _process_chunk(items, destination, name, symbol, description, size, image_format):
+    # Worker process side of preprocess_collection: images and metadata of a chunk of items.
+    extension = EXTENSIONS[image_format]
+    results = []
+    for number, source in items:
+        image_path = os.path.join(destination, f"{number}.{extension}")
+        result = process_image(source, image_path, size, image_format)
+        metadata = item_metadata(name, symbol, description, number, f"{number}.{extension}", image_format, result["sha256"])
+        _write_atomic(os.path.join(destination, f"{number}.json"), json.dumps(metadata, indent=4).encode('utf-8'))
+        results.append({"number": number, "image": f"{number}.{extension}", "sha256": result["sha256"], "bytes": result["bytes"], "width": result["width"], "height": result["height"]})
+    return results
+
+
+def collection_items(source):
+    """
+    Returns the (number, path) of every `<n>.<image extension>` file in a collection directory, by number.
+    """
+    items = []
+    for filename in os.listdir(source):
+        stem, extension = os.path.splitext(filename)
+        if stem.isdigit() and extension.lower() in (".png", ".jpg", ".jpeg", ".webp", ".gif", ".bmp"):
+            items.append((int(stem), os.path.join(source, filename)))
+    return sorted(items)
+
+
+_executor = None
+
+
+def get_executor():
+    """
+    Returns the process-wide ProcessPoolExecutor for preprocessing, creating it on first call.
+    """
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=PREPROCESS_WORKERS)
+    return _executor
+
+
+def close_executor():
+    """
+    Shuts the preprocessing processes down, if they were ever started. Called on application shutdown.
+    """
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+async def preprocess_image(source, destination, size=None, image_format=None):
+    """
+    Runs process_image in the preprocessing pool.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_executor(), process_image, source, destination, size or PREPROCESS_SIZE, image_format or PREPROCESS_FORMAT)
+
+
+async def preprocess_collection(source, destination, name, symbol, description, size=None, image_format=None, executor=None, chunk_size=None):
+    """
+    Preprocesses a collection: every `<n>.<ext>` image in `source` is resized, stripped and re-encoded into
+    `destination` as `<n>.<ext>` next to its `<n>.json` metadata, and a manifest.json with the content hash
+    of every image is written. Items are handed to the process pool in chunks, so throughput scales with
+    the number of worker processes.
+
+    Parameters:
+    - source (str): Directory with the item images.
+    - destination (str): Output directory, created if needed.
+    - name (str): Collection name; items are named "<name> #<n>".
+    - symbol (str): Collection symbol.
+    - description (str): Item description.
+    - size (int, optional): Longest side of the images. Defaults to PREPROCESS_SIZE.
+    - image_format (str, optional): Output format. Defaults to PREPROCESS_FORMAT.
+    - executor (ProcessPoolExecutor, optional): Defaults to the shared one.
+    - chunk_size (int, optional): Items per task. Defaults to PREPROCESS_CHUNK.
+
+    Returns:
+    - dict: items, bytes, seconds, items_per_second and the manifest path.
+
+    Raises:
+    - ValueError: If the format is not supported or `source` holds no item images.
+    """
+    size = size or PREPROCESS_SIZE
+    image_format = (image_format or PREPROCESS_FORMAT).upper()
+    chunk_size = chunk_size or PREPROCESS_CHUNK
+    if image_format not in EXTENSIONS:
+        raise ValueError(f"Unsupported image format {image_format}")
+    items = collection_items(source)
+    if not items:
+        raise ValueError(f"No item images in {source}")
+    os.makedirs(destination, exist_ok=True)
+    started = time.perf_counter()
+    loop = asyncio.get_running_loop()
+    executor = executor or get_executor()
+    chunks = [items[start:start + chunk_size] for start in range(0, len(items), chunk_size)]
+    results = await asyncio.gather(*(
+        loop.run_in_executor(executor, _process_chunk, chunk, destination, name, symbol, description, size, image_format)
+        for chunk in chunks
+    ))
+    entries = [entry for chunk in results for entry in chunk]
+    manifest = os.path.join(destination, "manifest.json")
+    _write_atomic(manifest, json.dumps({"name": name, "symbol": symbol, "format": image_format, "size": size, "items": entries}).encode('utf-8'))
+    seconds = time.perf_counter() - started
+    total = sum(entry["bytes"] for entry in entries)
+    logger.info(f"Preprocessed {len(entries)} items of {name} ({total} bytes) in {seconds:.2f}s")
+    return {"items": len(entries), "bytes": total, "seconds": round(seconds, 3), "items_per_second": round(len(entries) / seconds, 1), "manifest": manifest}
+
+
+def _synthesize_chunk(numbers, directory, size):
+    # Writes noisy gradient PNGs with some EXIF, roughly what users upload.
+    for number in numbers:
+        noise = Image.effect_noise((size, size), 40 + number % 50)
+        image = Image.merge("RGB", (noise, Image.linear_gradient("L").resize((size, size)), noise.rotate(90)))
+        exif = Image.Exif()
+        exif[0x010E] = f"synthetic item {number}"
+        image.save(os.path.join(directory, f"{number}.png"), exif=exif)
+
+
+async def benchmark(items=10000, size=512, target=256, workers=None):
+    """
+    Preprocesses a synthetic collection of `items` images of `size` x `size` down to `target` with 1 worker
+    process and with `workers`, to show how throughput scales with cores.
+
+    Returns:
+    - dict: Items per second per number of worker processes.
+    """
+    workers = workers or PREPROCESS_WORKERS
+    directory = tempfile.mkdtemp(prefix="preprocess-benchmark-")
+    results = {}
+    try:
+        source = os.path.join(directory, "source")
+        os.makedirs(source)
+        loop = asyncio.get_running_loop()
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            await asyncio.gather(*(
+                loop.run_in_executor(executor, _synthesize_chunk, range(start, min(start + 250, items)), source, size)
+                for start in range(0, items, 250)
+            ))
+        for count in sorted({1, workers}):
+            with ProcessPoolExecutor(max_workers=count) as executor:
+                result = await preprocess_collection(source, os.path.join(directory, f"out-{count}"), "Benchmark", "BENCH", "Synthetic collection", target, "PNG", executor)
+            results[count] = result["items_per_second"]
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    return {"items": items, "items_per_second": results}
+
+
+if __name__ == "__main__":
+    print(asyncio.run(benchmark()))
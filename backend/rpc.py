@@ -0,0 +1,321 @@
+import asyncio
+import os
+import time
+from bisect import bisect_left
+import httpx
+from solana.rpc.async_api import AsyncClient
+from solana.exceptions import SolanaRpcException
+import dotenv
+dotenv.load_dotenv()
+
+from backend.logging_config import logging_config  # Import the configuration file
+import logging.config
+logging.config.dictConfig(logging_config)
+logger = logging.getLogger("transaction")
+
+DEFAULT_ENDPOINT = "https://api.devnet.solana.com"
+# Upper bounds in seconds of the latency histogram buckets; the last bucket is unbounded.
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        """
+        Rate limiter allowing `rate` requests per second on average and bursts of up to `burst`.
+
+        Parameters:
+        - rate (float): Tokens added per second.
+        - burst (float): Bucket capacity.
+
+        Returns:
+        - None
+        """
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self):
+        """
+        Returns the seconds until a token is available, 0 if one is available now.
+        """
+        self._refill()
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    async def acquire(self):
+        """
+        Takes a token, sleeping until one is available.
+        """
+        while True:
+            wait = self.wait_time()
+            if wait == 0:
+                self.tokens -= 1
+                return
+            await asyncio.sleep(wait)
+
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        """
+        Fixed-bucket latency histogram.
+        """
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect_left(self.buckets, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+
+    def quantile(self, q):
+        """
+        Returns the upper bound of the bucket holding quantile `q`, or None without samples.
+        """
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return self.buckets[index] if index < len(self.buckets) else float("inf")
+        return float("inf")
+
+    def snapshot(self):
+        return {
+            "count": self.count,
+            "mean": round(self.total / self.count, 4) if self.count else 0,
+            "p50": self.quantile(0.5),
+            "p90": self.quantile(0.9),
+            "p99": self.quantile(0.99),
+            "buckets": {str(bound): count for bound, count in zip(self.buckets + ("inf",), self.counts)},
+        }
+
+
+class Endpoint:
+    def __init__(self, url, rate, burst, timeout):
+        """
+        One RPC node: its client, whose HTTP connection pool is reused for every request, its rate limit
+        and its health.
+        """
+        self.url = url
+        self.client = AsyncClient(url, timeout=timeout)
+        self.bucket = TokenBucket(rate, burst)
+        self.latency = None
+        self.requests = 0
+        self.errors = 0
+        self.failures = 0
+        self.cooldown_until = 0.0
+
+    def score(self, now):
+        """
+        Lower is better: the smoothed latency, plus the wait for a rate limit token, plus a penalty while
+        the endpoint is cooling down after failures. Endpoints without samples score 0 so they get tried.
+        """
+        score = (self.latency or 0.0) + self.bucket.wait_time()
+        if now < self.cooldown_until:
+            score += 1000 + self.cooldown_until - now
+        return score
+
+    def record_slow(self, seconds):
+        self.latency = seconds if self.latency is None else max(self.latency, 0.8 * self.latency + 0.2 * seconds)
+
+    def record(self, seconds, ok, cooldown):
+        self.requests += 1
+        if ok:
+            self.latency = seconds if self.latency is None else 0.8 * self.latency + 0.2 * seconds
+            self.failures = 0
+            return
+        self.errors += 1
+        self.failures += 1
+        if self.failures >= 3:
+            self.cooldown_until = time.monotonic() + cooldown
+            logger.warning(f"RPC endpoint {self.url} cooling down for {cooldown}s after {self.failures} failures")
+
+
+def _not_sent(error):
+    # The request never reached the node, so a write can safely be sent elsewhere.
+    return isinstance(error, SolanaRpcException) and isinstance(error.__cause__, (httpx.ConnectError, httpx.ConnectTimeout))
+
+
+class RpcGateway:
+    def __init__(self, urls=None, rate=None, burst=None, timeout=None, hedge_delay=None, cooldown=None):
+        """
+        Routes Solana RPC calls over a list of endpoints.
+
+        Every endpoint keeps one AsyncClient, so HTTP connections are reused, and a token bucket rate limit.
+        Calls go to the endpoint with the lowest smoothed latency that has a token available. Reads are
+        hedged: if the first endpoint has not answered within the hedge delay the call is also sent to the
+        next best one, and the first answer wins; a failed read is retried on the remaining endpoints. Writes
+        are sent once, and only moved to another endpoint if the connection could not be made.
+
+        Parameters:
+        - urls (list, optional): Endpoint URLs. Defaults to the comma separated SOLANA_RPC_URLS, or devnet.
+        - rate (float, optional): Requests per second per endpoint. Defaults to SOLANA_RPC_RATE or 10.
+        - burst (float, optional): Burst size per endpoint. Defaults to SOLANA_RPC_BURST or `rate`.
+        - timeout (float, optional): Seconds per request. Defaults to SOLANA_RPC_TIMEOUT or 10.
+        - hedge_delay (float, optional): Seconds before a read is hedged, until the method's p90 latency is
+          known. Defaults to SOLANA_RPC_HEDGE_DELAY or 0.5.
+        - cooldown (float, optional): Seconds an endpoint is avoided after 3 consecutive failures. Defaults to
+          SOLANA_RPC_COOLDOWN or 30.
+
+        Returns:
+        - None
+        """
+        if urls is None:
+            urls = [url.strip() for url in os.getenv("SOLANA_RPC_URLS", DEFAULT_ENDPOINT).split(",") if url.strip()]
+        if not urls:
+            raise ValueError("At least one RPC endpoint is required")
+        rate = float(rate if rate is not None else os.getenv("SOLANA_RPC_RATE", 10))
+        burst = float(burst if burst is not None else os.getenv("SOLANA_RPC_BURST", rate))
+        timeout = float(timeout if timeout is not None else os.getenv("SOLANA_RPC_TIMEOUT", 10))
+        self.hedge_delay = float(hedge_delay if hedge_delay is not None else os.getenv("SOLANA_RPC_HEDGE_DELAY", 0.5))
+        self.cooldown = float(cooldown if cooldown is not None else os.getenv("SOLANA_RPC_COOLDOWN", 30))
+        self.endpoints = [Endpoint(url, rate, burst, timeout) for url in urls]
+        self.histograms = {}
+        self.hedges = 0
+
+    def ranked(self):
+        """
+        Returns the endpoints from best to worst, see Endpoint.score.
+        """
+        now = time.monotonic()
+        return sorted(self.endpoints, key=lambda endpoint: endpoint.score(now))
+
+    def _histogram(self, method):
+        histogram = self.histograms.get(method)
+        if histogram is None:
+            histogram = self.histograms[method] = Histogram()
+        return histogram
+
+    async def _call(self, endpoint, method, args, kwargs):
+        await endpoint.bucket.acquire()
+        started = time.perf_counter()
+        try:
+            result = await getattr(endpoint.client, method)(*args, **kwargs)
+        except asyncio.CancelledError:
+            # Lost a hedge race: the endpoint was at least this slow.
+            endpoint.record_slow(time.perf_counter() - started)
+            raise
+        except Exception as e:
+            endpoint.record(time.perf_counter() - started, False, self.cooldown)
+            logger.error(f"RPC {method} on {endpoint.url} failed: {getattr(e, 'error_msg', None) or e}")
+            raise
+        seconds = time.perf_counter() - started
+        endpoint.record(seconds, True, self.cooldown)
+        self._histogram(method).observe(seconds)
+        return result
+
+    def _hedge_after(self, method):
+        histogram = self.histograms.get(method)
+        if histogram is not None and histogram.count >= 20:
+            return max(0.05, histogram.quantile(0.9))
+        return self.hedge_delay
+
+    async def read(self, method, *args, **kwargs):
+        """
+        Calls an idempotent AsyncClient method, e.g. "get_balance", hedged and with failover.
+
+        Returns:
+        - The AsyncClient method's response.
+
+        Raises:
+        - Exception: The last error, if every endpoint failed.
+        """
+        remaining = self.ranked()
+        pending = set()
+        error = None
+        try:
+            while remaining or pending:
+                if remaining:
+                    pending.add(asyncio.ensure_future(self._call(remaining.pop(0), method, args, kwargs)))
+                timeout = self._hedge_after(method) if remaining else None
+                done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    self.hedges += 1
+                    continue
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def write(self, method, *args, **kwargs):
+        """
+        Calls a non-idempotent AsyncClient method, e.g. "send_transaction", on the best endpoint. It is only
+        retried on the next endpoint if the request could not be delivered at all.
+
+        Returns:
+        - The AsyncClient method's response.
+        """
+        endpoints = self.ranked()
+        for index, endpoint in enumerate(endpoints):
+            try:
+                return await self._call(endpoint, method, args, kwargs)
+            except Exception as e:
+                if index == len(endpoints) - 1 or not _not_sent(e):
+                    raise
+
+    def stats(self):
+        """
+        Returns per-endpoint health and per-method latency histograms.
+
+        Returns:
+        - dict: `endpoints` (url, smoothed latency, requests, errors, cooling down), `methods` (see Histogram.snapshot)
+                and the number of hedged reads.
+        """
+        now = time.monotonic()
+        return {
+            "endpoints": [
+                {
+                    "url": endpoint.url,
+                    "latency": round(endpoint.latency, 4) if endpoint.latency is not None else None,
+                    "requests": endpoint.requests,
+                    "errors": endpoint.errors,
+                    "cooling_down": now < endpoint.cooldown_until,
+                }
+                for endpoint in self.endpoints
+            ],
+            "methods": {method: histogram.snapshot() for method, histogram in self.histograms.items()},
+            "hedges": self.hedges,
+        }
+
+    async def close(self):
+        """
+        Closes every endpoint's HTTP connections.
+        """
+        await asyncio.gather(*(endpoint.client.close() for endpoint in self.endpoints), return_exceptions=True)
+
+
+_gateway = None
+
+
+def get_gateway():
+    """
+    Returns the process-wide RpcGateway, creating it on first call.
+
+    Returns:
+    - RpcGateway: The shared gateway.
+    """
+    global _gateway
+    if _gateway is None:
+        _gateway = RpcGateway()
+    return _gateway
+
+
+async def close_gateway():
+    """
+    Closes the shared RpcGateway, if it was ever created. Called on application shutdown.
+    """
+    if _gateway is not None:
+        await _gateway.close()
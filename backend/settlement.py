@@ -0,0 +1,211 @@
+import os
+from decimal import Decimal
+from backend import paypal, jobs, orderbook
+from backend import transaction as transaction_module
+from backend.database import get_database
+from backend.logging_config import logging_config  # Import the configuration file
+import logging.config
+logging.config.dictConfig(logging_config)
+logger = logging.getLogger("transaction")
+
+ROYALTY  = 2.5
+FEES = 2.5
+SETTLEMENT_MAX_ATTEMPTS = int(os.getenv("SETTLEMENT_MAX_ATTEMPTS", 8))
+
+TRADE_JOB = "trade.execute"
+PAYOUT_JOB = "settlement.payout"
+MEMO_JOB = "settlement.memo"
+
+
+def seller_payout(payment_id, seller):
+    """
+    Builds the PayPal payout for one seller of a trade.
+
+    The sender batch id is derived from the payment and the seller, so each payout is unique within a trade
+    and a retried payout reuses the same id.
+
+    Parameters:
+    payment_id (str): The PayPal payment id of the buy.
+    seller (dict): One row returned by DatabaseManager.execute_trade.
+
+    Returns:
+    dict: The payout info for paypal.payout.
+    """
+    amount = Decimal(seller['cost']) * Decimal(seller['number'])
+    amount1 = amount * (Decimal(100-ROYALTY+FEES)/Decimal(100))
+    return {
+        "batch_id": f"{payment_id}-{seller['seller_id']}",
+        "recipient_email": seller['seller_email'],
+        "amount": str(amount1),
+        "currency": "USD",
+        "note": f"Payment to {seller['seller_email']} for TRS of collection {seller['collection_name']}. "
+    }
+
+
+def memo_data(payment_id, seller, token_account_address):
+    """
+    Builds the data for the on-chain memo recording one seller's leg of a trade.
+
+    Parameters:
+    payment_id (str): The PayPal payment id of the buy.
+    seller (dict): One row returned by DatabaseManager.execute_trade.
+    token_account_address (str): The central wallet's token account for the collection.
+
+    Returns:
+    dict: The data for transaction_module.transaction.
+    """
+    return {
+        "transaction_number": payment_id,
+        "buyer_id": seller['buyer_id'],
+        "seller_id": seller['seller_id'],
+        "seller_email": seller['seller_email'],
+        "buyer_email": seller['buyer_email'],
+        "trs_count": seller['number'],
+        'token_account_address': token_account_address
+    }
+
+
+def trade_key(payment_id):
+    """
+    Returns the job key of the trade of a payment.
+    """
+    return f"trade:{payment_id}"
+
+
+async def execute_trade_job(payload):
+    """
+    Job handler that records a paid trade and enqueues the settlement of each of its sellers.
+
+    The trade, its settlement jobs and an "executed" mark on the trade job's own row are written in one
+    database transaction, which starts with a locking read of that row. A run that failed before the commit
+    left nothing behind and is retried with backoff like any job; a run that replays a committed trade,
+    after a lease expiry or a manual requeue, finds the mark and returns without executing the trade again.
+    Two concurrent runs are serialized by the row lock, so only one of them can execute the trade.
+
+    Parameters:
+    payload (dict): `payment_id`, the PayPal payment id of the buy.
+
+    Returns:
+    dict: `executed`, the number of sellers enqueued for settlement, and whether this run was a replay.
+    """
+    payment_id = payload['payment_id']
+    database_client = get_database()
+    store = jobs.get_queue().store
+    async with database_client.transaction() as connection:
+        job = await store.lock(trade_key(payment_id), connection=connection)
+        if job is not None and (job['result'] or {}).get('executed'):
+            logger.warning(f"Trade {payment_id} was already executed, not executing it again")
+            return {**job['result'], "replayed": True}
+        seller_data = await database_client.execute_trade(payment_id, connection=connection)
+        await enqueue_settlement(payment_id, seller_data, connection=connection)
+        result = {"executed": True, "sellers": len(seller_data)}
+        await store.set_result(trade_key(payment_id), result, connection=connection)
+    for seller in seller_data:
+        database_client.invalidate_wallet(seller['buyer_id'], seller['seller_id'])
+        orderbook.books.delisted(seller['collection_name'], seller['seller_id'], seller['cost'], seller['number'])
+    database_client.invalidate_marketplace()
+    logger.info(f"Trade executed with id {payment_id}")
+    return {**result, "replayed": False}
+
+
+async def payout_job(payload):
+    """
+    Job handler that sends one seller's PayPal payout. Retries reuse the same sender batch id, so PayPal
+    rejects a payout that already went through instead of paying twice.
+    """
+    payout_info = seller_payout(payload['payment_id'], payload['seller'])
+    await paypal.payout(payout_info)
+    logger.info(f"Paypal payout sent to {payout_info['recipient_email']}. ")
+    return {"batch_id": payout_info['batch_id']}
+
+
+async def memo_job(payload):
+    """
+    Job handler that sends the on-chain memo recording one seller's leg of a trade. The job result keeps
+    the signature of the transaction the leg went out in, and its position there when memos are batched.
+    """
+    seller = payload['seller']
+    token_account_address = await get_database().get_token_account_address(seller['collection_name'])
+    result = await transaction_module.transaction(memo_data(payload['payment_id'], seller, token_account_address))
+    logger.info(f"Sent transaction to complete trade {payload['payment_id']} for seller {seller['seller_id']}")
+    return {"token_account_address": str(token_account_address), "signature": result['signature'], "index": result.get('index'), "legs": result.get('legs', 1)}
+
+
+async def enqueue_trade(payment_id):
+    """
+    Enqueues the execution of a paid trade. Enqueueing the same payment twice, e.g. when PayPal redirects
+    the buyer again, is a no-op.
+
+    Returns:
+    bool: True if the trade was enqueued, False if it already was.
+    """
+    return await jobs.get_queue().enqueue(trade_key(payment_id), TRADE_JOB, {"payment_id": payment_id}, reference=payment_id)
+
+
+async def enqueue_settlement(payment_id, seller_data, connection=None):
+    """
+    Enqueues a payout job and a memo job for every seller of an executed trade. Jobs are keyed by payment
+    and seller, so each leg is settled once even if the trade job is replayed.
+
+    Parameters:
+    payment_id (str): The PayPal payment id of the buy.
+    seller_data (list): The rows returned by DatabaseManager.execute_trade.
+    connection (optional): The transaction the trade was executed in.
+
+    Returns:
+    None
+    """
+    queue = jobs.get_queue()
+    for seller in seller_data:
+        payload = {"payment_id": payment_id, "seller": seller}
+        await queue.enqueue(f"payout:{payment_id}:{seller['seller_id']}", PAYOUT_JOB, payload, reference=payment_id, connection=connection)
+        await queue.enqueue(f"memo:{payment_id}:{seller['seller_id']}", MEMO_JOB, payload, reference=payment_id, connection=connection)
+
+
+async def status(payment_id):
+    """
+    Returns the settlement status of a trade from its jobs.
+
+    Parameters:
+    payment_id (str): The PayPal payment id of the buy.
+
+    Returns:
+    dict | None: The overall status ("running", "completed" or "failed") and every job of the trade, or None
+                 if nothing was enqueued for the payment.
+    """
+    trade_jobs = await jobs.get_queue().store.by_reference(payment_id)
+    if not trade_jobs:
+        return None
+    states = {job['status'] for job in trade_jobs}
+    if jobs.DEAD in states:
+        overall = "failed"
+    elif states == {jobs.DONE}:
+        overall = "completed"
+    else:
+        overall = "running"
+    return {
+        "status": overall,
+        "jobs": [
+            {
+                "key": job['job_key'],
+                "type": job['job_type'],
+                "status": job['status'],
+                "attempts": job['attempts'],
+                "error": job['last_error'],
+                "result": job['result'],
+            }
+            for job in trade_jobs
+        ],
+    }
+
+
+def register(queue):
+    """
+    Registers the settlement job handlers on a JobQueue.
+    """
+    queue.register(TRADE_JOB, execute_trade_job, max_attempts=SETTLEMENT_MAX_ATTEMPTS)
+    queue.register(PAYOUT_JOB, payout_job, max_attempts=SETTLEMENT_MAX_ATTEMPTS)
+    queue.register(MEMO_JOB, memo_job, max_attempts=SETTLEMENT_MAX_ATTEMPTS)
+
+
+register(jobs.get_queue())
@@ -11,6 +11,17 @@ import os
 from dotenv import load_dotenv
 import asyncio
 import io 
+import time
+import hashlib
+import inspect
+import uuid
+from contextlib import AsyncExitStack
+import aioboto3
+from aiobotocore.config import AioConfig
+from boto3.s3.transfer import TransferConfig
+from botocore.exceptions import ClientError
+from cachetools import LRUCache
+from backend.database import get_database
 #from backend.logging_config import logging_config  # Import the configuration file
 import logging.config
 #logging.config.dictConfig(logging_config)
@@ -24,6 +35,33 @@ FILEBASE_SECRET_KEY = os.getenv("FILEBASE_SECRET")
 ENDPOINT_URL = os.getenv("FILEBASE_ENDPOINT")
 BUCKET_NAME = os.getenv("FILEBASE_BUCKET")
 
+# Async client settings: connections kept open to the endpoint, and when and how files are split into
+# multipart uploads.
+S3_MAX_POOL_CONNECTIONS = int(os.getenv("S3_MAX_POOL_CONNECTIONS", 50))
+S3_MULTIPART_THRESHOLD = int(os.getenv("S3_MULTIPART_THRESHOLD", 8 * 1024 * 1024))
+S3_MULTIPART_CHUNKSIZE = int(os.getenv("S3_MULTIPART_CHUNKSIZE", 8 * 1024 * 1024))
+S3_MAX_CONCURRENCY = int(os.getenv("S3_MAX_CONCURRENCY", 10))
+# Files of one request uploaded at the same time.
+UPLOAD_CONCURRENCY = int(os.getenv("UPLOAD_CONCURRENCY", 4))
+# Largest file accepted by the streaming upload path.
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", 1024 ** 3))
+# S3 rejects multipart parts under 5 MiB, except the last one.
+MIN_PART_SIZE = 5 * 1024 * 1024
+# HEAD requests in flight at once when resolving CIDs in bulk.
+CID_HEAD_CONCURRENCY = int(os.getenv("CID_HEAD_CONCURRENCY", 16))
+# Store the CID that Filebase returns with every file uploaded by upload_many and stream_upload, so reads never
+# HEAD. Uploads whose response carries no CID are not looked up; their CID is resolved on first read.
+STORAGE_RECORD_CIDS = os.getenv("STORAGE_RECORD_CIDS", "true").lower() in ("1", "true", "yes")
+
+OBJECT_CIDS_TABLE = """
+CREATE TABLE IF NOT EXISTS object_cids (
+    object_name VARCHAR(512) NOT NULL PRIMARY KEY,
+    etag VARCHAR(128) NOT NULL,
+    cid VARCHAR(128),
+    updated_at DOUBLE NOT NULL
+)
+"""
+
 # Initialize boto3 S3 resource with Filebase credentials
 s3 = boto3.resource(
     's3',
@@ -51,18 +89,368 @@ def upload_file(file_path, object_name=None):
     except Exception as e:
         print(f"Error uploading file: {e}")
 
+class AsyncStorage:
+    def __init__(self, bucket=None, endpoint_url=None, access_key=None, secret_key=None):
+        """
+        Non-blocking client for the S3-compatible bucket.
+
+        One aioboto3 session and one client are shared by every request, so HTTP connections (up to
+        S3_MAX_POOL_CONNECTIONS) are reused. Files larger than S3_MULTIPART_THRESHOLD are uploaded in parts of
+        S3_MULTIPART_CHUNKSIZE, S3_MAX_CONCURRENCY at a time. Pointing `endpoint_url` at a local stand-in such
+        as `moto_server` is enough to run it without Filebase.
+
+        Parameters:
+        - bucket (str, optional): Defaults to FILEBASE_BUCKET.
+        - endpoint_url (str, optional): Defaults to FILEBASE_ENDPOINT.
+        - access_key (str, optional): Defaults to FILEBASE_ACCESS_KEY.
+        - secret_key (str, optional): Defaults to FILEBASE_SECRET.
+
+        Returns:
+        - None
+        """
+        self.bucket = bucket or BUCKET_NAME
+        self.endpoint_url = endpoint_url or ENDPOINT_URL
+        self.session = aioboto3.Session(
+            aws_access_key_id=access_key or FILEBASE_ACCESS_KEY,
+            aws_secret_access_key=secret_key or FILEBASE_SECRET_KEY,
+        )
+        self.transfer_config = TransferConfig(
+            multipart_threshold=S3_MULTIPART_THRESHOLD,
+            multipart_chunksize=S3_MULTIPART_CHUNKSIZE,
+            max_concurrency=S3_MAX_CONCURRENCY,
+        )
+        self._client = None
+        self._stack = None
+        self._lock = asyncio.Lock()
+
+    async def client(self):
+        """
+        Returns the shared aiobotocore S3 client, opening it on first call.
+        """
+        if self._client is None:
+            async with self._lock:
+                if self._client is None:
+                    stack = AsyncExitStack()
+                    self._client = await stack.enter_async_context(self.session.client(
+                        's3',
+                        endpoint_url=self.endpoint_url,
+                        config=AioConfig(signature_version='s3v4', max_pool_connections=S3_MAX_POOL_CONNECTIONS),
+                    ))
+                    self._stack = stack
+        return self._client
+
+    def url(self, object_name):
+        return f"{self.endpoint_url}/{self.bucket}/{object_name}"
+
+    async def upload_fileobj(self, fileobj, object_name, metadata=None):
+        """
+        Uploads a file object, multipart if it is large.
+
+        Parameters:
+        - fileobj: A binary file object; `read` may be sync or async (e.g. UploadFile).
+        - object_name (str): The object key.
+        - metadata (dict, optional): User metadata to store with the object.
+
+        Returns:
+        - str: The URL of the object.
+        """
+        client = await self.client()
+        extra_args = {"Metadata": metadata} if metadata else None
+        await client.upload_fileobj(fileobj, self.bucket, object_name, ExtraArgs=extra_args, Config=self.transfer_config)
+        return self.url(object_name)
+
+    async def download_file(self, object_name, path):
+        """
+        Downloads an object to `path`, in ranged parts if it is large.
+        """
+        client = await self.client()
+        await client.download_file(self.bucket, object_name, path, Config=self.transfer_config)
+
+    async def head_object(self, object_name):
+        """
+        Returns the object's HEAD response: ETag, ContentLength, Metadata...
+        """
+        client = await self.client()
+        return await client.head_object(Bucket=self.bucket, Key=object_name)
+
+    async def delete_object(self, object_name):
+        client = await self.client()
+        await client.delete_object(Bucket=self.bucket, Key=object_name)
+
+    async def copy_object(self, source, destination):
+        """
+        Copies an object within the bucket, server side, in parts if it is large.
+        """
+        client = await self.client()
+        await client.copy({"Bucket": self.bucket, "Key": source}, self.bucket, destination, Config=self.transfer_config)
+
+    async def close(self):
+        """
+        Closes the client and its connections.
+        """
+        if self._stack is not None:
+            await self._stack.aclose()
+            self._client = None
+            self._stack = None
+
+
+_storage = None
+
+
+def get_storage():
+    """
+    Returns the process-wide AsyncStorage, creating it on first call.
+
+    Returns:
+    - AsyncStorage: The shared storage client.
+    """
+    global _storage
+    if _storage is None:
+        _storage = AsyncStorage()
+    return _storage
+
+
+async def close_storage():
+    """
+    Closes the shared AsyncStorage, if it was ever created. Called on application shutdown.
+    """
+    if _storage is not None:
+        await _storage.close()
+
+
 async def upload_to_s3(file: UploadFile, object_name: str):
     try:
-        # Upload the file object to S3 bucket
-        s3.Bucket(BUCKET_NAME).upload_fileobj(file.file, object_name)
-        # Generate the file URL after uploading
-        file_url = f"{ENDPOINT_URL}/{BUCKET_NAME}/{object_name}"
+        # Upload the file to the S3 bucket without blocking the event loop; UploadFile reads its spooled
+        # temporary file in a thread.
+        file_url = await get_storage().upload_fileobj(file, object_name)
 
         return file_url
     except Exception as e:
         logger.error(f"Error uploading file: {e}")
         raise HTTPException(status_code=500, detail=f"Error uploading file: {e}")
 
+async def delete_many(object_names, concurrency=None):
+    """
+    Deletes objects concurrently. Failures are logged, not raised, as this is used to clean up after errors.
+
+    Parameters:
+    - object_names (list): The object keys.
+    - concurrency (int, optional): Deletes at a time. Defaults to UPLOAD_CONCURRENCY.
+    """
+    semaphore = asyncio.Semaphore(concurrency or UPLOAD_CONCURRENCY)
+
+    async def delete(object_name):
+        async with semaphore:
+            await get_storage().delete_object(object_name)
+
+    results = await asyncio.gather(*(delete(object_name) for object_name in object_names), return_exceptions=True)
+    for object_name, result in zip(object_names, results):
+        if isinstance(result, Exception):
+            logger.error(f"Error deleting '{object_name}': {result}")
+    await get_resolver().invalidate(list(object_names))
+
+
+async def _uploaded(object_name, record_cids=None, etag=None, cid=None):
+    # Keeps the CID cache right after a write: records the new version from the upload response, or forgets
+    # the overwritten one. Never makes a request to storage.
+    resolver = get_resolver()
+    try:
+        if (STORAGE_RECORD_CIDS if record_cids is None else record_cids) and etag and cid:
+            return await resolver.record(object_name, etag, cid)
+        await resolver.invalidate([object_name])
+    except Exception as e:
+        logger.error(f"Error recording the CID of '{object_name}': {e}")
+        await resolver.invalidate([object_name])
+    return None
+
+
+async def _file_chunks(fileobj):
+    # Reads a file object in multipart-sized chunks for stream_upload; a sync `read` runs in a thread.
+    chunk_size = max(S3_MULTIPART_CHUNKSIZE, MIN_PART_SIZE)
+    while True:
+        if inspect.iscoroutinefunction(fileobj.read):
+            chunk = await fileobj.read(chunk_size)
+        else:
+            chunk = await asyncio.to_thread(fileobj.read, chunk_size)
+        if not chunk:
+            return
+        yield chunk
+
+
+async def _promote(moves, concurrency=None, record_cids=None):
+    # Copies staged uploads into place, then deletes the staged copies whatever happened.
+    semaphore = asyncio.Semaphore(concurrency or UPLOAD_CONCURRENCY)
+
+    async def promote(source, destination):
+        async with semaphore:
+            await get_storage().copy_object(source, destination)
+            await _uploaded(destination, record_cids)
+
+    try:
+        await asyncio.gather(*(promote(source, destination) for destination, source in moves.items()))
+    finally:
+        await delete_many(list(moves.values()))
+
+
+async def upload_many(uploads, concurrency=None, record_cids=None, staged=False):
+    """
+    Uploads the files of one request concurrently, at most `concurrency` at a time. If any upload fails the
+    others are cancelled and every object already started is deleted, so a request leaves all of its files
+    or none of them. Each file goes through stream_upload, so its CID comes with the upload response.
+
+    Keys that may already hold data worth keeping, such as a user's verified KYC documents, must be uploaded
+    with `staged`: files then go to temporary keys, which are copied into place only once every upload has
+    succeeded, so a failed request never deletes or partly replaces the previous objects. A failure while
+    copying into place, after every upload succeeded, can still leave a mix of old and new objects.
+
+    Parameters:
+    - uploads (list): (file, object name) pairs; files are UploadFile or binary file objects.
+    - concurrency (int, optional): Uploads at a time. Defaults to UPLOAD_CONCURRENCY.
+    - record_cids (bool, optional): Record the CIDs of the files, see CidResolver. Defaults to STORAGE_RECORD_CIDS.
+    - staged (bool): Upload to temporary keys and copy into place once all succeeded.
+
+    Returns:
+    - list: The URLs of the uploaded files, in the order given.
+
+    Raises:
+    - HTTPException: 413 if a file is larger than MAX_UPLOAD_BYTES, 500 if an upload failed.
+    """
+    semaphore = asyncio.Semaphore(concurrency or UPLOAD_CONCURRENCY)
+    started = []
+    timings = {}
+    began = time.perf_counter()
+    targets = {object_name: f"{object_name}.staging-{uuid.uuid4().hex}" if staged else object_name for _, object_name in uploads}
+
+    async def upload(file, object_name):
+        async with semaphore:
+            target = targets[object_name]
+            started.append(target)
+            file_began = time.perf_counter()
+            await stream_upload(_file_chunks(file), target, content_type=getattr(file, 'content_type', None), record_cids=False if staged else record_cids)
+            timings[object_name] = time.perf_counter() - file_began
+            return get_storage().url(object_name)
+
+    tasks = [asyncio.ensure_future(upload(file, object_name)) for file, object_name in uploads]
+    try:
+        urls = await asyncio.gather(*tasks)
+    except Exception as e:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        logger.error(f"Error uploading files, removing the {len(started)} already started: {e}")
+        await delete_many(started)
+        if isinstance(e, HTTPException):
+            raise
+        raise HTTPException(status_code=500, detail=f"Error uploading file: {e}")
+    if staged:
+        try:
+            await _promote(targets, concurrency, record_cids)
+        except Exception as e:
+            logger.error(f"Error moving uploaded files into place: {e}")
+            raise HTTPException(status_code=500, detail=f"Error uploading file: {e}")
+    logger.info(
+        f"Uploaded {len(uploads)} files in {time.perf_counter() - began:.2f}s: "
+        + ", ".join(f"{object_name} {seconds:.2f}s" for object_name, seconds in timings.items())
+    )
+    return urls
+
+
+async def stream_upload(chunks, object_name, max_bytes=None, content_type=None, record_cids=None):
+    """
+    Uploads a stream of chunks, e.g. a request body, as it arrives, without spooling it to disk or reading
+    it twice. Chunks are gathered into multipart parts of S3_MULTIPART_CHUNKSIZE, and up to S3_MAX_CONCURRENCY
+    parts are uploaded at a time while the next ones are read; reading waits when that many are in flight,
+    which bounds memory to about (S3_MAX_CONCURRENCY + 1) parts. The SHA-256 and size are computed on the way.
+    A body no larger than S3_MULTIPART_THRESHOLD is buffered and sent with a single PUT.
+
+    Parameters:
+    - chunks: An async iterable of bytes.
+    - object_name (str): The object key.
+    - max_bytes (int, optional): Largest accepted size. Defaults to MAX_UPLOAD_BYTES.
+    - content_type (str, optional): Content type stored with the object.
+    - record_cids (bool, optional): Record the CID of the file, see CidResolver. Defaults to STORAGE_RECORD_CIDS.
+
+    Returns:
+    - dict: url, sha256, size, the number of parts, and the CID when recorded.
+
+    Raises:
+    - HTTPException: 413 as soon as the body exceeds `max_bytes`, 500 if the upload failed. The multipart
+      upload is aborted in both cases, and when the client disconnects.
+    """
+    max_bytes = max_bytes or MAX_UPLOAD_BYTES
+    part_size = max(S3_MULTIPART_CHUNKSIZE, MIN_PART_SIZE)
+    threshold = S3_MULTIPART_THRESHOLD
+    storage_client = get_storage()
+    client = await storage_client.client()
+    extra_args = {"ContentType": content_type} if content_type else {}
+    digest = hashlib.sha256()
+    size = 0
+    buffer = bytearray()
+    upload_id = None
+    tasks = []
+    slots = asyncio.Semaphore(S3_MAX_CONCURRENCY)
+    began = time.perf_counter()
+
+    async def upload_part(number, data):
+        try:
+            response = await client.upload_part(Bucket=storage_client.bucket, Key=object_name, UploadId=upload_id, PartNumber=number, Body=data)
+            return {"PartNumber": number, "ETag": response["ETag"]}
+        finally:
+            slots.release()
+
+    async def send(data):
+        nonlocal upload_id
+        if upload_id is None:
+            response = await client.create_multipart_upload(Bucket=storage_client.bucket, Key=object_name, **extra_args)
+            upload_id = response["UploadId"]
+        for task in tasks:
+            if task.done() and task.exception() is not None:
+                raise task.exception()
+        await slots.acquire()
+        tasks.append(asyncio.ensure_future(upload_part(len(tasks) + 1, data)))
+
+    try:
+        async for chunk in chunks:
+            size += len(chunk)
+            if size > max_bytes:
+                raise HTTPException(status_code=413, detail=f"File is larger than the maximum of {max_bytes} bytes.")
+            digest.update(chunk)
+            buffer += chunk
+            if upload_id is None and size <= threshold:
+                continue
+            while len(buffer) >= part_size:
+                data = bytes(buffer[:part_size])
+                del buffer[:part_size]
+                await send(data)
+        if upload_id is None and size <= threshold:
+            response = await client.put_object(Bucket=storage_client.bucket, Key=object_name, Body=bytes(buffer), **extra_args)
+        else:
+            if buffer:
+                await send(bytes(buffer))
+            parts = await asyncio.gather(*tasks)
+            response = await client.complete_multipart_upload(Bucket=storage_client.bucket, Key=object_name, UploadId=upload_id, MultipartUpload={"Parts": parts})
+    except BaseException as e:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if upload_id is not None:
+            try:
+                await client.abort_multipart_upload(Bucket=storage_client.bucket, Key=object_name, UploadId=upload_id)
+            except Exception as abort_error:
+                logger.error(f"Error aborting upload of '{object_name}': {abort_error}")
+        if isinstance(e, HTTPException) or not isinstance(e, Exception):
+            raise
+        logger.error(f"Error uploading file: {e}")
+        raise HTTPException(status_code=500, detail=f"Error uploading file: {e}")
+    seconds = time.perf_counter() - began
+    logger.info(f"Streamed '{object_name}' ({size} bytes, {len(tasks) or 1} parts) in {seconds:.2f}s")
+    result = {"url": storage_client.url(object_name), "sha256": digest.hexdigest(), "size": size, "parts": len(tasks) or 1}
+    # Filebase returns the CID of the new object in the x-amz-meta-cid response header, which saves the HEAD.
+    cid = response.get('ResponseMetadata', {}).get('HTTPHeaders', {}).get('x-amz-meta-cid')
+    result["cid"] = await _uploaded(object_name, record_cids, _etag(response), cid)
+    return result
+
+
 def download_file(object_name, download_path):
     """Download a file from Filebase S3 bucket."""
     try:
@@ -90,22 +478,198 @@ async def test():
 #asyncio.run(test())
 
 
-def get_file_cid( object_name):
+def _etag(response):
+    return response.get('ETag', '').strip('"')
+
+
+class CidResolver:
+    def __init__(self, database_client=None, storage_client=None, concurrency=None, cache_size=None):
+        """
+        Resolves the IPFS CIDs Filebase stores in the `cid` metadata of objects.
+
+        The CID of an object version never changes, so key -> (ETag, CID) is kept in an in-process LRU cache
+        in front of the object_cids table, and a HEAD request is only made for keys seen for the first time.
+        Writes through this module record the new version (or forget the old one), so overwritten keys are
+        not served stale; resolve_prefix also checks ETags against a bucket listing, which catches objects
+        overwritten by other clients for the cost of one request per 1000 keys.
+
+        Parameters:
+        - database_client (DatabaseManager, optional): Defaults to the shared one.
+        - storage_client (AsyncStorage, optional): Defaults to the shared one.
+        - concurrency (int, optional): HEAD requests at once. Defaults to CID_HEAD_CONCURRENCY.
+        - cache_size (int, optional): Keys kept in memory. Defaults to CID_CACHE_SIZE or 65536.
+
+        Returns:
+        - None
+        """
+        self.database_client = database_client or get_database()
+        self.storage_client = storage_client or get_storage()
+        self.concurrency = concurrency or CID_HEAD_CONCURRENCY
+        self.cache = LRUCache(maxsize=int(cache_size or os.getenv("CID_CACHE_SIZE", 65536)))
+        self.metrics = {"hits": 0, "table_hits": 0, "heads": 0, "listed": 0, "stale": 0}
+        self._ready = False
+
+    async def _setup(self):
+        if not self._ready:
+            await self.database_client.execute(OBJECT_CIDS_TABLE)
+            self._ready = True
+
+    async def _load(self, object_names):
+        # Fills the memory cache from the table. The table is only a cache: if it is unavailable the
+        # missing keys are HEADed instead.
+        found = {}
+        try:
+            await self._setup()
+            for start in range(0, len(object_names), 500):
+                batch = object_names[start:start + 500]
+                query = f"SELECT object_name, etag, cid FROM object_cids WHERE object_name IN ({', '.join(['%s'] * len(batch))})"
+                for row in await self.database_client.execute(query, tuple(batch), fetch="all", dictionary=True):
+                    found[row['object_name']] = (row['etag'], row['cid'])
+        except Exception as e:
+            logger.error(f"Error reading object CIDs: {e}")
+        self.cache.update(found)
+        return found
+
+    async def _save(self, entries):
+        if not entries:
+            return
+        self.cache.update(entries)
+        now = time.time()
+        query = (
+            "INSERT INTO object_cids (object_name, etag, cid, updated_at) VALUES (%s, %s, %s, %s) "
+            "ON DUPLICATE KEY UPDATE etag = VALUES(etag), cid = VALUES(cid), updated_at = VALUES(updated_at)"
+        )
+        try:
+            await self._setup()
+            await self.database_client.execute(query, [(object_name, etag, cid, now) for object_name, (etag, cid) in entries.items()], many=True)
+        except Exception as e:
+            logger.error(f"Error saving object CIDs: {e}")
+
+    async def _head_many(self, object_names):
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def head(object_name):
+            async with semaphore:
+                self.metrics["heads"] += 1
+                try:
+                    response = await self.storage_client.head_object(object_name)
+                except ClientError as e:
+                    if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+                        return None
+                    raise
+                return _etag(response), response.get('Metadata', {}).get('cid')
+
+        results = await asyncio.gather(*(head(object_name) for object_name in object_names))
+        entries = {object_name: result for object_name, result in zip(object_names, results) if result is not None}
+        await self._save(entries)
+        return entries
+
+    async def resolve(self, object_names):
+        """
+        Returns the CIDs of many objects, from the cache where possible and otherwise with concurrent HEADs.
+
+        Parameters:
+        - object_names (list): The object keys.
+
+        Returns:
+        - dict: Object key -> CID, None for objects that do not exist or have no CID.
+        """
+        entries = {}
+        missing = []
+        for object_name in dict.fromkeys(object_names):
+            if object_name in self.cache:
+                self.metrics["hits"] += 1
+                entries[object_name] = self.cache[object_name]
+            else:
+                missing.append(object_name)
+        if missing:
+            found = await self._load(missing)
+            self.metrics["table_hits"] += len(found)
+            entries.update(found)
+            missing = [object_name for object_name in missing if object_name not in found]
+        if missing:
+            entries.update(await self._head_many(missing))
+        return {object_name: entries[object_name][1] if object_name in entries else None for object_name in object_names}
+
+    async def resolve_prefix(self, prefix):
+        """
+        Returns the CIDs of every object under a prefix. The listing gives each object's current ETag, so only
+        new or overwritten objects are HEADed.
+
+        Parameters:
+        - prefix (str): The key prefix, e.g. "trs_data/<title>/".
+
+        Returns:
+        - dict: Object key -> CID.
+        """
+        client = await self.storage_client.client()
+        listed = {}
+        async for page in client.get_paginator('list_objects_v2').paginate(Bucket=self.storage_client.bucket, Prefix=prefix):
+            for item in page.get('Contents', []):
+                listed[item['Key']] = _etag(item)
+        self.metrics["listed"] += len(listed)
+        known = {object_name: self.cache[object_name] for object_name in listed if object_name in self.cache}
+        known.update(await self._load([object_name for object_name in listed if object_name not in known]))
+        stale = [object_name for object_name, etag in listed.items() if object_name not in known or known[object_name][0] != etag]
+        self.metrics["stale"] += sum(1 for object_name in stale if object_name in known)
+        entries = {object_name: known[object_name] for object_name in listed if object_name not in stale}
+        entries.update(await self._head_many(stale))
+        return {object_name: entries[object_name][1] if object_name in entries else None for object_name in listed}
+
+    async def record(self, object_name, etag, cid):
+        """
+        Records the version of an object just written, from the ETag and CID of its upload response, so that
+        resolving its CID needs no HEAD.
+
+        Returns:
+        - str: The CID.
+        """
+        await self._save({object_name: (etag, cid)})
+        return cid
+
+    async def invalidate(self, object_names):
+        """
+        Forgets the CIDs of overwritten or deleted objects.
+        """
+        for object_name in object_names:
+            self.cache.pop(object_name, None)
+        try:
+            await self._setup()
+            for start in range(0, len(object_names), 500):
+                batch = object_names[start:start + 500]
+                await self.database_client.execute(f"DELETE FROM object_cids WHERE object_name IN ({', '.join(['%s'] * len(batch))})", tuple(batch))
+        except Exception as e:
+            logger.error(f"Error invalidating object CIDs: {e}")
+
+    def stats(self):
+        return {**self.metrics, "cached": len(self.cache)}
+
+
+_resolver = None
+
+
+def get_resolver():
+    """
+    Returns the process-wide CidResolver, creating it on first call.
+    """
+    global _resolver
+    if _resolver is None:
+        _resolver = CidResolver()
+    return _resolver
+
+
+async def get_file_cid(object_name):
+    """
+    Returns the CID of an object, or None if it does not exist or has none. See CidResolver.
+    """
     try:
-        # Retrieve object metadata
-        response = s3_client.head_object(Bucket=BUCKET_NAME, Key=object_name)
-        
-        # Extract the CID from metadata
-        metadata = response.get('Metadata', {})
-        metadata = metadata
-        cid = metadata['cid']
-        
-        if cid:
-            logger.info(f"CID for '{object_name}' is: {cid}")
-            return cid
-        else:
-            logger.info(f"No CID found in metadata for '{object_name}'.")
-            return None
+        cid = (await get_resolver().resolve([object_name]))[object_name]
     except Exception as e:
-        print(f"Error retrieving CID: {e}")
+        logger.error(f"Error retrieving CID: {e}")
         return None
+    if cid:
+        logger.info(f"CID for '{object_name}' is: {cid}")
+    else:
+        logger.info(f"No CID found in metadata for '{object_name}'.")
+    return cid
+
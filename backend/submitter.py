@@ -0,0 +1,313 @@
+import asyncio
+import os
+import time
+from solders.transaction import Transaction
+from solders.transaction_status import TransactionConfirmationStatus
+from solana.rpc.types import TxOpts
+from backend.rpc import Histogram, get_gateway
+import dotenv
+dotenv.load_dotenv()
+
+from backend.logging_config import logging_config  # Import the configuration file
+import logging.config
+logging.config.dictConfig(logging_config)
+logger = logging.getLogger("transaction")
+
+# getSignatureStatuses accepts at most 256 signatures per call.
+MAX_STATUS_BATCH = 256
+CONFIRMED = (TransactionConfirmationStatus.Confirmed, TransactionConfirmationStatus.Finalized)
+
+
+class TransactionExpired(Exception):
+    """Raised when a transaction was not confirmed before its last resubmission expired."""
+
+
+class TransactionFailed(Exception):
+    """Raised when a transaction was confirmed with an error."""
+
+
+class BlockhashCache:
+    def __init__(self, gateway, refresh_interval=None):
+        """
+        Keeps a recent blockhash for signing, refreshed in the background instead of fetched per transaction.
+
+        A blockhash stays valid for about 150 blocks (~60s); refreshing every `refresh_interval` seconds keeps
+        transactions signed with the cached one well inside that window.
+
+        Parameters:
+        - gateway (RpcGateway): Where to fetch blockhashes from.
+        - refresh_interval (float, optional): Seconds between refreshes. Defaults to SOLANA_BLOCKHASH_REFRESH or 15.
+
+        Returns:
+        - None
+        """
+        self.gateway = gateway
+        self.refresh_interval = float(refresh_interval if refresh_interval is not None else os.getenv("SOLANA_BLOCKHASH_REFRESH", 15))
+        self.blockhash = None
+        self.last_valid_block_height = None
+        self.fetched_at = 0.0
+        self.refreshes = 0
+        self._task = None
+        self._lock = asyncio.Lock()
+
+    def _stale(self):
+        return self.blockhash is None or time.monotonic() - self.fetched_at > 2 * self.refresh_interval
+
+    async def refresh(self, only_if_stale=False):
+        """
+        Fetches a new blockhash.
+
+        Parameters:
+        - only_if_stale (bool): Skip the fetch if another caller refreshed the cache while this one waited.
+
+        Returns:
+        - tuple: The blockhash (Hash) and the last block height at which it is valid.
+        """
+        async with self._lock:
+            if not only_if_stale or self._stale():
+                resp = await self.gateway.read("get_latest_blockhash")
+                self.blockhash = resp.value.blockhash
+                self.last_valid_block_height = resp.value.last_valid_block_height
+                self.fetched_at = time.monotonic()
+                self.refreshes += 1
+            return self.blockhash, self.last_valid_block_height
+
+    async def get(self):
+        """
+        Returns the cached blockhash and its last valid block height, fetching one if the cache is empty or
+        older than twice the refresh interval, e.g. because refreshes failed.
+        """
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._refresher())
+        if self._stale():
+            return await self.refresh(only_if_stale=True)
+        return self.blockhash, self.last_valid_block_height
+
+    async def _refresher(self):
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            try:
+                await self.refresh()
+            except Exception as e:
+                logger.error(f"Blockhash refresh failed: {getattr(e, 'error_msg', None) or e}")
+
+    def close(self):
+        if self._task is not None:
+            self._task.cancel()
+
+
+class _Pending:
+    __slots__ = ("instructions", "future", "submitted_at", "sent_at", "raw", "last_valid_block_height", "resubmits")
+
+    def __init__(self, instructions, future):
+        self.instructions = instructions
+        self.future = future
+        self.submitted_at = time.perf_counter()
+        self.sent_at = 0.0
+        self.raw = None
+        self.last_valid_block_height = None
+        self.resubmits = 0
+
+
+class TransactionSubmitter:
+    def __init__(self, payer, gateway=None, blockhashes=None, poll_interval=None, rebroadcast_interval=None, max_resubmits=None):
+        """
+        Signs, sends and confirms transactions without waiting on each one in turn.
+
+        `submit` signs against the shared cached blockhash and sends right away, so many transactions are in
+        flight at once. A single poller confirms all of them with batched getSignatureStatuses calls. A
+        transaction the cluster has not seen yet is rebroadcast as is while its blockhash is valid; once the
+        blockhash has expired it is re-signed with a fresh one and sent again, up to `max_resubmits` times.
+        A transaction that was seen but is not confirmed yet is only polled, never re-signed, since it may
+        still land.
+
+        Parameters:
+        - payer (Keypair): Fee payer and only signer of the transactions.
+        - gateway (RpcGateway, optional): Defaults to the shared gateway.
+        - blockhashes (BlockhashCache, optional): Defaults to a cache on the same gateway.
+        - poll_interval (float, optional): Seconds between status polls. Defaults to SOLANA_CONFIRM_POLL or 1.
+        - rebroadcast_interval (float, optional): Seconds before an unconfirmed transaction is sent again.
+          Defaults to SOLANA_REBROADCAST or 5.
+        - max_resubmits (int, optional): Re-signs after expiry before giving up. Defaults to SOLANA_MAX_RESUBMITS or 3.
+
+        Returns:
+        - None
+        """
+        self.payer = payer
+        self.gateway = gateway or get_gateway()
+        self.blockhashes = blockhashes or BlockhashCache(self.gateway)
+        self.poll_interval = float(poll_interval if poll_interval is not None else os.getenv("SOLANA_CONFIRM_POLL", 1))
+        self.rebroadcast_interval = float(rebroadcast_interval if rebroadcast_interval is not None else os.getenv("SOLANA_REBROADCAST", 5))
+        self.max_resubmits = int(max_resubmits if max_resubmits is not None else os.getenv("SOLANA_MAX_RESUBMITS", 3))
+        self.pending = {}
+        self.confirm_seconds = Histogram()
+        self.metrics = {"submitted": 0, "sent": 0, "confirmed": 0, "failed": 0, "expired": 0, "resubmits": 0, "rebroadcasts": 0, "abandoned": 0, "status_polls": 0}
+        self._poller = None
+        self._started_at = None
+
+    async def _send(self, entry):
+        blockhash, last_valid_block_height = await self.blockhashes.get()
+        if entry.future.done():
+            # The caller gave up while the blockhash was fetched; do not sign a transaction nobody waits for.
+            return None
+        transaction = Transaction.new_signed_with_payer(entry.instructions, self.payer.pubkey(), [self.payer], blockhash)
+        entry.raw = bytes(transaction)
+        entry.last_valid_block_height = last_valid_block_height
+        signature = transaction.signatures[0]
+        self.pending[signature] = entry
+        try:
+            await self._broadcast(entry)
+        except BaseException:
+            del self.pending[signature]
+            raise
+        return signature
+
+    async def _broadcast(self, entry):
+        entry.sent_at = time.perf_counter()
+        self.metrics["sent"] += 1
+        await self.gateway.write("send_raw_transaction", entry.raw, TxOpts(skip_preflight=True))
+
+    async def submit(self, instructions):
+        """
+        Signs and sends a transaction, and waits for it to be confirmed.
+
+        Parameters:
+        - instructions (list): The instructions, paid for and signed by the payer.
+
+        Returns:
+        - str: The signature of the confirmed transaction. It differs from the first one sent if the
+               transaction had to be re-signed.
+
+        Raises:
+        - TransactionFailed: If the transaction was confirmed with an error.
+        - TransactionExpired: If it was not confirmed after `max_resubmits` re-signs.
+        """
+        if self._started_at is None:
+            self._started_at = time.monotonic()
+        if self._poller is None or self._poller.done():
+            self._poller = asyncio.ensure_future(self._poll())
+        entry = _Pending(instructions, asyncio.get_running_loop().create_future())
+        self.metrics["submitted"] += 1
+        try:
+            signature = await self._send(entry)
+            logger.debug(f"Sent transaction {signature}")
+            return await entry.future
+        finally:
+            # If the caller gave up (timeout, cancellation) the poller drops the entry instead of re-signing it.
+            if not entry.future.done():
+                entry.future.cancel()
+
+    def _abandoned(self, signature, entry):
+        # True, and the entry is no longer tracked, if its caller stopped waiting for it.
+        if not entry.future.done():
+            return False
+        if self.pending.get(signature) is entry:
+            del self.pending[signature]
+            self.metrics["abandoned"] += 1
+            logger.warning(f"Transaction {signature} abandoned by its caller, no longer tracked")
+        return True
+
+    async def _poll(self):
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            if not self.pending:
+                continue
+            try:
+                await self._check()
+            except Exception as e:
+                logger.error(f"Confirmation poll failed: {getattr(e, 'error_msg', None) or e}")
+
+    async def _check(self):
+        signatures = list(self.pending)
+        unconfirmed = []
+        for start in range(0, len(signatures), MAX_STATUS_BATCH):
+            batch = signatures[start:start + MAX_STATUS_BATCH]
+            resp = await self.gateway.read("get_signature_statuses", batch)
+            self.metrics["status_polls"] += 1
+            for signature, status in zip(batch, resp.value):
+                entry = self.pending.get(signature)
+                if entry is None or self._abandoned(signature, entry):
+                    continue
+                if status is None:
+                    unconfirmed.append(signature)
+                    continue
+                if status.confirmation_status not in CONFIRMED:
+                    # Landed but only processed: re-signing now could execute it twice. It is polled until
+                    # it is confirmed, or until it drops off a minority fork and its status is None again.
+                    continue
+                del self.pending[signature]
+                if status.err is not None:
+                    self.metrics["failed"] += 1
+                    entry.future.set_exception(TransactionFailed(f"Transaction {signature} failed: {status.err}"))
+                    continue
+                seconds = time.perf_counter() - entry.submitted_at
+                self.metrics["confirmed"] += 1
+                self.confirm_seconds.observe(seconds)
+                entry.future.set_result(str(signature))
+        if not unconfirmed:
+            return
+        block_height = (await self.gateway.read("get_block_height")).value
+        if self.blockhashes.last_valid_block_height is not None and block_height > self.blockhashes.last_valid_block_height:
+            # The cached blockhash expired too, e.g. refreshes failed; re-signs need a fresh one.
+            await self.blockhashes.refresh()
+        now = time.perf_counter()
+        for signature in unconfirmed:
+            entry = self.pending.get(signature)
+            if entry is None or self._abandoned(signature, entry):
+                continue
+            if block_height > entry.last_valid_block_height:
+                del self.pending[signature]
+                if entry.resubmits >= self.max_resubmits:
+                    self.metrics["expired"] += 1
+                    entry.future.set_exception(TransactionExpired(f"Transaction {signature} expired after {entry.resubmits} resubmits"))
+                    continue
+                entry.resubmits += 1
+                self.metrics["resubmits"] += 1
+                logger.warning(f"Transaction {signature} expired unconfirmed, re-signing (resubmit {entry.resubmits})")
+                asyncio.ensure_future(self._resend(entry))
+            elif now - entry.sent_at > self.rebroadcast_interval:
+                self.metrics["rebroadcasts"] += 1
+                asyncio.ensure_future(self._rebroadcast(entry))
+
+    async def _resend(self, entry):
+        if entry.future.done():
+            return
+        try:
+            await self._send(entry)
+        except Exception as e:
+            self.metrics["failed"] += 1
+            if not entry.future.done():
+                entry.future.set_exception(e)
+
+    async def _rebroadcast(self, entry):
+        if entry.future.done():
+            return
+        try:
+            await self._broadcast(entry)
+        except Exception as e:
+            logger.error(f"Rebroadcast failed: {getattr(e, 'error_msg', None) or e}")
+
+    def stats(self):
+        """
+        Returns submission counters, submissions per second and the time-to-confirm histogram.
+
+        Returns:
+        - dict: Counters, `in_flight`, `submissions_per_second`, `confirm_seconds` (see Histogram.snapshot)
+                and the number of blockhash refreshes.
+        """
+        uptime = time.monotonic() - self._started_at if self._started_at else 0
+        return {
+            **self.metrics,
+            "in_flight": len(self.pending),
+            "submissions_per_second": round(self.metrics["submitted"] / uptime, 3) if uptime else 0,
+            "confirm_seconds": self.confirm_seconds.snapshot(),
+            "blockhash_refreshes": self.blockhashes.refreshes,
+        }
+
+    async def close(self):
+        """
+        Stops the poller and the blockhash refresher. Transactions still in flight are not awaited.
+        """
+        if self._poller is not None:
+            self._poller.cancel()
+        self.blockhashes.close()
@@ -1,119 +1,353 @@
 import asyncio
-from solana.rpc.async_api import AsyncClient
+import time
 from solders.pubkey import Pubkey
 from spl.token.async_client import  AsyncToken
 from solders.keypair import Keypair
 from solana.rpc.types import TokenAccountOpts
-from solana.transaction import Transaction
+from solana.transaction import PACKET_DATA_SIZE
+from solders.message import Message
 from spl.token.instructions import transfer,TransferParams
-from spl.memo.instructions import create_memo,MemoParams
+from solders.instruction import Instruction, AccountMeta
 from spl.memo.constants import MEMO_PROGRAM_ID
 import json
 import os 
 import dotenv
+from backend.database import get_database
 dotenv.load_dotenv()
 
-client = AsyncClient("https://api.devnet.solana.com")
+from backend.rpc import get_gateway
+from backend.submitter import TransactionSubmitter
+gateway = get_gateway()
 
 from backend.logging_config import logging_config  # Import the configuration file
 import logging.config
 logging.config.dictConfig(logging_config)
 logger = logging.getLogger("transaction")
 
+TOKEN_PROGRAM_ID = Pubkey.from_string('TokenkegQfeZyiNwAJbNbGKPFXCWuBvf9Ss623VQ5DA')
+MEMO_LIMIT = 500
+MEMO_VERSION = b"w1"
+MEMO_KEYS = {"t": "txn", "n": "number", "b": "buyer_uuid", "s": "seller_uuid", "be": "buyer_email", "se": "seller_email"}
+LEGACY_MEMO_KEYS = {"txn": "txn", "number": "number", "items": "number", "buyer_uuid": "buyer_uuid", "seller_uuid": "seller_uuid", "buyer": "buyer_email", "seller": "seller_email"}
+# One signature, its compact length prefix, and the message must fit in one packet.
+SIGNATURE_OVERHEAD = 1 + 64
+
 central_wallet = Pubkey.from_string(os.getenv('CENTRAL_WALLET_PUBKEY'))
 central_wallet_keypair = Keypair.from_bytes(json.loads(os.getenv('CENTRAL_WALLET_KEY').encode()))
 
 
-async def get_token_account_address(mint_address):
+async def get_token_account_address(mint_address, collection_name=None):
     """
     Asynchronously retrieves the token account address for a given mint address.
 
     Parameters:
     mint_address (Pubkey): The public key of the mint for which the token account address is to be retrieved.
+    collection_name (str, optional): The collection minted with it. When given, the address is recorded for the collection too.
 
     Returns:
-    Pubkey: The public key of the token account associated with the given mint address.
+    str: The public key of the token account associated with the given mint address, or None if it cannot be found.
 
-    This function uses the Solana Python SDK to interact with the Solana blockchain. It first creates a TokenAccountOpts object with the provided mint address. Then, it calls the get_token_accounts_by_owner method of the AsyncClient to retrieve the token accounts associated with the central wallet and the specified mint. The function extracts the public key of the first token account from the response and returns it.
+    The mapping never changes once the token account exists, so it is served from DatabaseManager's cache and
+    token_accounts table. Only the first lookup of a mint, right after minting, calls get_token_accounts_by_owner
+    for the central wallet and the mint over RPC; the result is then recorded.
     """
+    database_client = get_database()
+    token_account_address = await database_client.get_token_account_by_mint(str(mint_address))
+    if token_account_address is not None:
+        return token_account_address
     try:
         opts = TokenAccountOpts(mint=mint_address)
-        resp = await client.get_token_accounts_by_owner(central_wallet,opts)
-        resp  = resp.to_json()
-        resp = json.loads(resp)
-
-        token_account_address = resp['result']['value'][0]['pubkey']
-        print(token_account_address)
-        return token_account_address
+        resp = await gateway.read("get_token_accounts_by_owner", central_wallet, opts)
+        token_account_address = str(resp.value[0].pubkey)
     except Exception as e:
-        
-        print(f"Error: {e}")
+        logger.error(f"Error: {e}")
+        return None
+    await database_client.save_token_account(str(mint_address), collection_name, token_account_address)
+    return token_account_address
+
+def encode_memo(txn_number, seller_email, buyer_email, trs_count, seller_uuid, buyer_uuid, limit=MEMO_LIMIT):
+    """
+    Encodes the memo of one trade leg to UTF-8 bytes in a single pass.
+
+    The format is "w1;t=<txn>;n=<count>;b=<buyer uuid>;s=<seller uuid>;be=<buyer email>;se=<seller email>".
+    Every field is encoded once and the size is summed from the encoded parts, so the emails can be dropped
+    to stay within `limit` without formatting the memo a second time. See parse_memo for the reverse.
+
+    Parameters:
+    - txn_number (str): PayPal transaction number.
+    - seller_email (str): Seller's email address.
+    - buyer_email (str): Buyer's email address.
+    - trs_count (int): Number of TRS.
+    - seller_uuid (str): UUID of the seller.
+    - buyer_uuid (str): UUID of the buyer.
+    - limit (int): Maximum size in bytes.
+
+    Returns:
+    - bytes: The memo.
+    """
+    parts = [
+        MEMO_VERSION,
+        b"t=" + str(txn_number).encode('utf-8'),
+        b"n=" + str(trs_count).encode('ascii'),
+        b"b=" + str(buyer_uuid).encode('utf-8'),
+        b"s=" + str(seller_uuid).encode('utf-8'),
+    ]
+    emails = [b"be=" + buyer_email.encode('utf-8'), b"se=" + seller_email.encode('utf-8')]
+    size = sum(map(len, parts)) + len(parts) - 1
+    if size + sum(map(len, emails)) + len(emails) <= limit:
+        parts += emails
+    elif size > limit:
+        raise ValueError(f"Memo of {size} bytes exceeds {limit} bytes even without emails")
+    return b";".join(parts)
+
+
+def parse_memo(memo):
+    """
+    Parses a trade memo, in the compact format written by encode_memo or the earlier
+    "txn=...,buyer=...,seller=...,number=...,buyer_uuid=...,seller_uuid=..." format.
+
+    Parameters:
+    - memo (str | bytes): The memo text.
+
+    Returns:
+    - dict | None: txn, number, buyer_uuid, seller_uuid, buyer_email and seller_email (None when absent),
+                   or None if the memo is not a trade memo.
+    """
+    if isinstance(memo, bytes):
+        memo = memo.decode('utf-8', errors='replace')
+    if memo.startswith(MEMO_VERSION.decode() + ";"):
+        separator, keys = ";", MEMO_KEYS
+    elif memo.startswith("txn="):
+        separator, keys = ",", LEGACY_MEMO_KEYS
+    else:
+        return None
+    fields = {}
+    for part in memo.split(separator):
+        key, _, value = part.partition("=")
+        if key in keys:
+            fields[keys[key]] = value
+    if "txn" not in fields:
+        return None
+    try:
+        number = int(fields.get("number", 0))
+    except ValueError:
+        number = None
+    return {
+        "txn": fields["txn"],
+        "number": number,
+        "buyer_uuid": fields.get("buyer_uuid"),
+        "seller_uuid": fields.get("seller_uuid"),
+        "buyer_email": fields.get("buyer_email"),
+        "seller_email": fields.get("seller_email"),
+    }
+
+
+# Accounts of the memo instruction, and the self-transfer instruction, are the same for every leg.
+MEMO_ACCOUNTS = [AccountMeta(pubkey=central_wallet, is_signer=True, is_writable=True)]
+_transfer_templates = {}
+
+
+def transfer_template(token_account_address):
+    """
+    Returns the self-transfer of 1 token on a token account, built once per account and reused.
+    """
+    instruction = _transfer_templates.get(token_account_address)
+    if instruction is None:
+        instruction = _transfer_templates[token_account_address] = transfer(TransferParams(
+            program_id=TOKEN_PROGRAM_ID,
+            source = token_account_address,
+            dest = token_account_address,
+            owner = central_wallet,
+            amount = 1,
+            signers = []
+        ))
+    return instruction
+
+
 class TransactionCreator:
     def __init__(self, token_account_address):
+        if isinstance(token_account_address, str):
+            token_account_address = Pubkey.from_string(token_account_address)
         self.token_account_address = token_account_address
-        
-    
-    async def generate_memo(txn_number: str, seller_email: str, buyer_email: str, trs_count: int, seller_uuid: str, buyer_uuid: str) -> str:
+        self.transfer_instruction = transfer_template(token_account_address)
+
+    @staticmethod
+    def encode_memo(txn_number, seller_email, buyer_email, trs_count, seller_uuid, buyer_uuid):
         """
-        Generates a memo string for a Solana transaction that includes a PayPal transaction number, seller and buyer information, 
-        and the number of TRS. If the memo exceeds 500 bytes, the function will remove email addresses and use UUIDs.
-        
-        Args:
-        - txn_number: PayPal transaction number.
-        - seller_email: Seller's email address.
-        - buyer_email: Buyer's email address.
-        - trs_count: Number of TRS (items).
-        - seller_uuid: UUID for the seller.
-        - buyer_uuid: UUID for the buyer.
-        
+        Encodes the memo of one trade leg, see encode_memo.
+        """
+        return encode_memo(txn_number, seller_email, buyer_email, trs_count, seller_uuid, buyer_uuid)
+
+    def instructions(self, memo):
+        """
+        Returns the memo and the self-transfer of 1 token that record one trade leg on chain.
+
+        Parameters:
+        - memo (bytes | str): The memo, see encode_memo.
+
         Returns:
-        - memo: A UTF-8 encoded string under 500 bytes.
+        - list: The memo instruction followed by the transfer instruction.
         """
-        
-        # Memo template with both emails
-        memo = f"txn={txn_number},buyer={buyer_email},seller={seller_email},number={trs_count},buyer_uuid={buyer_uuid},seller_uuid={seller_uuid}"
-        
-        # Check if the memo size is under 500 bytes when UTF-8 encoded
-        if len(memo.encode('utf-8')) <= 500:
-            return memo
-        
-        # If emails make the memo exceed 500 bytes, remove them and stick to UUIDs
-        memo = f"txn={txn_number},items={trs_count},buyer_uuid={buyer_uuid},seller_uuid={seller_uuid}"
-        logger.info(f"Created memo {memo}")
-        return memo
-          
+        if isinstance(memo, str):
+            memo = memo.encode('utf-8')
+        return [Instruction(MEMO_PROGRAM_ID, memo, MEMO_ACCOUNTS), self.transfer_instruction]
+
     async def send_transaction(self,txn_number,seller_email,buyer_email,trs_count,seller_uuid,buyer_uuid):
-        txn = Transaction()
-        
-        memo_params = MemoParams(
-            program_id = MEMO_PROGRAM_ID,
-            message= await self.generate_memo(txn_number,seller_email,buyer_email,trs_count,seller_uuid,buyer_uuid),
-            signer = central_wallet,
-        )
-        memo = create_memo(memo_params)
-        txn.add(memo)
-        transferparams = TransferParams(
-            program_id=Pubkey.from_string('TokenkegQfeZyiNwAJbNbGKPFXCWuBvf9Ss623VQ5DA'),
-            source = self.token_account_address,
-            dest = self.token_account_address,
-            owner = central_wallet,
-            amount = 1,
-            signers = []
-        )
-        txn.add(
-            transfer(transferparams)
-        )
-        response = await client.send_transaction(txn,central_wallet_keypair)
+        memo = self.encode_memo(txn_number,seller_email,buyer_email,trs_count,seller_uuid,buyer_uuid)
+        signature = await get_submitter().submit(self.instructions(memo))
         
-        logger.info(F"Transaction hash: {response}")
-    
+        logger.info(F"Transaction hash: {signature}")
+        return signature
+
+
+def transaction_size(instructions):
+    """
+    Returns the serialized size in bytes of a transaction signed by the central wallet alone.
+    """
+    return len(bytes(Message(instructions, central_wallet))) + SIGNATURE_OVERHEAD
+
+
+_submitter = None
+
+
+def get_submitter():
+    """
+    Returns the process-wide TransactionSubmitter for the central wallet, creating it on first call.
+    """
+    global _submitter
+    if _submitter is None:
+        _submitter = TransactionSubmitter(central_wallet_keypair, gateway)
+    return _submitter
+
+
+async def close_submitter():
+    """
+    Stops the shared TransactionSubmitter's background tasks, if it was ever created.
+    """
+    if _submitter is not None:
+        await _submitter.close()
+
+
+async def _send_instructions(instructions):
+    return await get_submitter().submit(instructions)
+
+
+class MemoBatcher:
+    def __init__(self, max_wait=None, max_legs=None, sender=None):
+        """
+        Packs the memo and transfer instruction pairs of many trade legs into as few transactions as possible.
+
+        Legs are queued with `submit`. A batch is sent when the next leg would push the transaction over the
+        packet size limit, when it holds `max_legs` legs, or `max_wait` seconds after its first leg arrived,
+        whichever comes first. Every leg gets back the signature of the transaction it was sent in and its
+        position within it.
+
+        Parameters:
+        - max_wait (float, optional): Seconds a leg may wait for others. Defaults to MEMO_BATCH_MAX_WAIT or 0.5.
+        - max_legs (int, optional): Legs per transaction at most. Defaults to MEMO_BATCH_MAX_LEGS or 16.
+        - sender (callable, optional): `async def sender(instructions) -> signature`. Defaults to sending with
+          the central wallet through the shared TransactionSubmitter, which resolves once the transaction is confirmed.
+
+        Returns:
+        - None
+        """
+        self.max_wait = float(max_wait if max_wait is not None else os.getenv("MEMO_BATCH_MAX_WAIT", 0.5))
+        self.max_legs = int(max_legs if max_legs is not None else os.getenv("MEMO_BATCH_MAX_LEGS", 16))
+        self.sender = sender or _send_instructions
+        self._legs = []
+        self._instructions = []
+        self._timer = None
+        self.metrics = {"legs": 0, "transactions": 0, "bytes": 0, "failed": 0}
+
+    def submit(self, token_account_address, memo):
+        """
+        Queues one trade leg.
+
+        Parameters:
+        - token_account_address (Pubkey | str): The central wallet's token account for the collection.
+        - memo (bytes | str): The memo of the leg, see encode_memo.
+
+        Returns:
+        - asyncio.Future: Resolves to a dict with the transaction `signature`, the leg's `index` in it and
+          the number of `legs` it carried, or raises the error the transaction failed with.
+        """
+        instructions = TransactionCreator(token_account_address).instructions(memo)
+        if transaction_size(instructions) > PACKET_DATA_SIZE:
+            raise ValueError(f"Memo of {len(instructions[0].data)} bytes does not fit in a transaction")
+        if self._legs and transaction_size(self._instructions + instructions) > PACKET_DATA_SIZE:
+            self.flush()
+        future = asyncio.get_running_loop().create_future()
+        self._legs.append(future)
+        self._instructions.extend(instructions)
+        if len(self._legs) >= self.max_legs:
+            self.flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.max_wait, self.flush)
+        return future
+
+    def flush(self):
+        """
+        Sends the queued legs now, if any.
+
+        Returns:
+        - asyncio.Task | None: The task sending the batch.
+        """
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._legs:
+            return None
+        legs, instructions = self._legs, self._instructions
+        self._legs, self._instructions = [], []
+        return asyncio.ensure_future(self._send(legs, instructions))
+
+    async def _send(self, legs, instructions):
+        size = transaction_size(instructions)
+        try:
+            signature = await self.sender(instructions)
+        except Exception as e:
+            self.metrics["failed"] += len(legs)
+            logger.error(f"Batched transaction of {len(legs)} legs failed: {e}")
+            for future in legs:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        self.metrics["legs"] += len(legs)
+        self.metrics["transactions"] += 1
+        self.metrics["bytes"] += size
+        logger.info(f"Transaction hash: {signature} ({len(legs)} legs, {size} bytes)")
+        for index, future in enumerate(legs):
+            if not future.done():
+                future.set_result({"signature": signature, "index": index, "legs": len(legs)})
+
+
+_batcher = None
+
+
+def get_batcher():
+    """
+    Returns the process-wide MemoBatcher, creating it on first call.
+    """
+    global _batcher
+    if _batcher is None:
+        _batcher = MemoBatcher()
+    return _batcher
 
 
 async def transaction(data):
-    
-    e = TransactionCreator(data['token_account_address'])
-    
-    await e.send_transaction(
+    """
+    Records one trade leg on chain. When MEMO_BATCHING is set the leg is packed together with other
+    legs submitted around the same time, see MemoBatcher; otherwise it is sent in its own transaction.
+
+    Parameters:
+    data (dict): transaction_number, seller_email, buyer_email, trs_count, seller_id, buyer_id and
+                 token_account_address of the leg.
+
+    Returns:
+    dict: A success message, the transaction signature, and for batched legs the leg's index in the
+          transaction and the number of legs it carried.
+    """
+    memo_args = (
         data['transaction_number'],
         data['seller_email'],
         data['buyer_email'],
@@ -121,11 +355,98 @@ async def transaction(data):
         data['seller_id'],
         data['buyer_id']
     )
-    logger.log(f"Created and signed transaction for {data['transaction_number']}")
-    return {"message": "Created and signed transaction successfully"}
-    
- 
+    if os.getenv("MEMO_BATCHING", "false").lower() in ("1", "true", "yes"):
+        memo = encode_memo(*memo_args)
+        result = await get_batcher().submit(data['token_account_address'], memo)
+    else:
+        e = TransactionCreator(data['token_account_address'])
+        result = {"signature": await e.send_transaction(*memo_args)}
+    logger.info(f"Created and signed transaction for {data['transaction_number']}")
+    return {"message": "Created and signed transaction successfully", **result}
+
+
+async def benchmark(legs=500, latency=0.4, rpc_concurrency=4, concurrency=64, memo_bytes=120):
+    """
+    Compares legs per second of one transaction per leg against MemoBatcher, without network access. Each
+    transaction costs a simulated RPC round trip of `latency` seconds and at most `rpc_concurrency` are in
+    flight, as with a rate-limited RPC endpoint. `concurrency` legs are submitted at once, as with several
+    settlement workers.
+
+    Returns:
+    dict: Legs per second and transactions sent for each path.
+    """
+    token_account_address = Pubkey.new_unique()
+    memo = "x" * memo_bytes
+    sent = []
+    rpc = asyncio.Semaphore(rpc_concurrency)
+
+    async def sender(instructions):
+        async with rpc:
+            await asyncio.sleep(latency)
+        sent.append(len(instructions) // 2)
+        return f"simulated{len(sent)}"
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def single():
+        async with semaphore:
+            await sender(TransactionCreator(token_account_address).instructions(memo))
+
+    started = time.perf_counter()
+    await asyncio.gather(*(single() for _ in range(legs)))
+    single_seconds = time.perf_counter() - started
+    single_transactions = len(sent)
+
+    sent.clear()
+    batcher = MemoBatcher(max_wait=0.05, sender=sender)
+
+    async def batched():
+        async with semaphore:
+            await batcher.submit(token_account_address, memo)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(batched() for _ in range(legs)))
+    batched_seconds = time.perf_counter() - started
+    return {
+        "legs": legs,
+        "single": {"legs_per_second": round(legs / single_seconds, 1), "transactions": single_transactions},
+        "batched": {"legs_per_second": round(legs / batched_seconds, 1), "transactions": len(sent), "legs_per_transaction": max(sent)},
+    }
+
+
+def benchmark_encoding(legs=20000):
+    """
+    Measures memo plus instruction construction per leg: the previous per-call path (f-string memo, encode
+    and size check, Pubkey parsing, MemoParams and TransferParams) against encode_memo and the templates.
+
+    Returns:
+    dict: Microseconds per leg for each path.
+    """
+    from spl.memo.instructions import create_memo, MemoParams
+    token_account_address = Pubkey.new_unique()
+    args = ("PAYID-LNZK2QY5GD123456", "seller@example.com", "buyer@example.com", 25, "1f0e7c2a-9d8b-4e6f-a1b2-c3d4e5f60718", "7a6b5c4d-3e2f-4a1b-9c8d-7e6f5a4b3c2d")
+
+    def previous():
+        memo = f"txn={args[0]},buyer={args[2]},seller={args[1]},number={args[3]},buyer_uuid={args[5]},seller_uuid={args[4]}"
+        if len(memo.encode('utf-8')) > 500:
+            memo = f"txn={args[0]},items={args[3]},buyer_uuid={args[5]},seller_uuid={args[4]}"
+        return [
+            create_memo(MemoParams(program_id=MEMO_PROGRAM_ID, message=memo.encode('utf-8'), signer=central_wallet)),
+            transfer(TransferParams(program_id=Pubkey.from_string('TokenkegQfeZyiNwAJbNbGKPFXCWuBvf9Ss623VQ5DA'), source=token_account_address, dest=token_account_address, owner=central_wallet, amount=1, signers=[])),
+        ]
+
+    def current():
+        return TransactionCreator(token_account_address).instructions(encode_memo(*args))
 
+    results = {}
+    for name, build in (("previous", previous), ("templates", current)):
+        started = time.perf_counter()
+        for _ in range(legs):
+            build()
+        results[name] = {"microseconds_per_leg": round((time.perf_counter() - started) / legs * 1e6, 2)}
+    return results
 
-#asyncio.run(main())
 
+if __name__ == "__main__":
+    print(benchmark_encoding())
+    print(asyncio.run(benchmark()))
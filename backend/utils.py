@@ -24,12 +24,7 @@ SERVER_URL = "https://whiplano-1b8102db6480.herokuapp.com"
 
 load_dotenv()  # Load environment variables
 email_password = os.getenv("GOOGLE_EMAIL_PASSWORD")
-database_client = database.DatabaseManager(
-    host=os.getenv("DATABASE_HOST"),
-    user=os.getenv("DATABASE_USERNAME"),
-    password=os.getenv("DATABASE_PASSWORD"),
-    database =os.getenv("DATABASE_NAME")
-)
+database_client = database.get_database()
 
 SECRET_KEY = os.getenv("SECRET_KEY")
 ALGORITHM = os.getenv("ALGORITHM")
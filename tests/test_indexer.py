@@ -0,0 +1,75 @@
+import asyncio
+import json
+import os
+from solders.keypair import Keypair
+
+if not os.getenv("CENTRAL_WALLET_KEY"):
+    # backend.transaction loads the central wallet at import; any keypair will do here.
+    keypair = Keypair()
+    os.environ["CENTRAL_WALLET_PUBKEY"] = str(keypair.pubkey())
+    os.environ["CENTRAL_WALLET_KEY"] = json.dumps(list(bytes(keypair)))
+
+from backend import indexer
+
+
+def make_indexer(statuses, database=None):
+    gateway = indexer.StubGateway(statuses)
+    return indexer.Indexer(database or indexer.StubDatabase(), gateway, Keypair().pubkey(), name="test"), gateway
+
+
+def test_split_memos():
+    assert indexer.split_memos(None) == []
+    assert indexer.split_memos("") == []
+    assert indexer.split_memos("[5] hello; [5] world") == ["hello", "world"]
+    # The length prefix keeps a memo containing the separator whole.
+    assert indexer.split_memos("[6] a; b c; [1] d") == ["a; b c", "d"]
+    # Lengths are in bytes, not characters.
+    assert indexer.split_memos("[6] héllo; [1] x") == ["héllo", "x"]
+    assert indexer.split_memos("not prefixed") == ["not prefixed"]
+
+
+def test_run_indexes_every_leg_across_pages():
+    statuses = indexer.synthetic_statuses(2500)
+    index, gateway = make_indexer(statuses)
+    result = asyncio.run(index.run())
+    legs = sum(len(indexer.split_memos(status.memo)) for status in statuses)
+    assert result == {"signatures": 2500, "legs": legs}
+    assert len(index.database_client.memos) == legs
+    assert gateway.calls == 3
+    assert index.database_client.checkpoints["test"] == {"slot": statuses[0].slot, "signature": str(statuses[0].signature)}
+
+
+def test_run_resumes_from_the_checkpoint():
+    statuses = indexer.synthetic_statuses(300)
+    index, gateway = make_indexer(statuses)
+    asyncio.run(index.run())
+    assert asyncio.run(index.run()) == {"signatures": 0, "legs": 0}
+    gateway.statuses = indexer.synthetic_statuses(20, first_slot=1000) + statuses
+    result = asyncio.run(index.run())
+    assert result["signatures"] == 20
+    assert index.database_client.checkpoints["test"]["slot"] == 1019
+
+
+def test_replayed_run_inserts_nothing_twice():
+    statuses = indexer.synthetic_statuses(300)
+    index, _ = make_indexer(statuses)
+    first = asyncio.run(index.run())
+    rows = dict(index.database_client.memos)
+    # An interrupted run leaves the checkpoint behind; the next one covers the same signatures again.
+    index.database_client.checkpoints.clear()
+    assert asyncio.run(index.run()) == first
+    assert index.database_client.memos == rows
+
+
+def test_other_memos_are_ignored():
+    statuses = indexer.synthetic_statuses(1)
+    statuses[0].memo = "[11] hello world"
+    index, _ = make_indexer(statuses)
+    assert asyncio.run(index.run()) == {"signatures": 1, "legs": 0}
+
+
+def test_backfill_benchmark_processes_thousands_of_signatures_per_minute():
+    result = asyncio.run(indexer.benchmark(signatures=5000, latency=0.05))
+    assert result["signatures"] == 5000
+    assert result["signatures_per_minute"] > 5000
+    assert result["incremental_rpc_calls"] == 1
@@ -0,0 +1,188 @@
+import asyncio
+import time
+import pytest
+from backend import jobs
+
+
+def make_queue(**kwargs):
+    # No worker tasks: the tests claim and run jobs themselves.
+    options = {"workers": 0, "poll_interval": 0.01, "timeout": 1, "lease": 2, "backoff_base": 0.01, "backoff_max": 0.01}
+    options.update(kwargs)
+    return jobs.JobQueue(jobs.SQLiteJobStore(), **options)
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def test_job_store_is_abstract():
+    with pytest.raises(TypeError):
+        jobs.JobStore()
+
+
+def test_lease_must_outlast_timeout_and_poll_interval():
+    with pytest.raises(ValueError):
+        make_queue(timeout=10, poll_interval=1, lease=11)
+    assert make_queue(timeout=10, poll_interval=1, lease=None).lease > 11
+
+
+def test_enqueue_is_idempotent():
+    async def scenario():
+        queue = make_queue()
+        queue.register("test", lambda payload: None)
+        assert await queue.enqueue("job:1", "test", {"n": 1})
+        assert not await queue.enqueue("job:1", "test", {"n": 2})
+        job = await queue.store.get("job:1")
+        assert job['payload'] == {"n": 1}
+        assert job['status'] == jobs.PENDING
+        assert queue.metrics["test"]["duplicates"] == 1
+    run(scenario())
+
+
+def test_claim_leases_until_expiry():
+    async def scenario():
+        store = jobs.SQLiteJobStore()
+        await store.setup()
+        await store.enqueue("job:1", "test", {})
+        claimed = await store.claim(10, 0.2)
+        assert [job['job_key'] for job in claimed] == ["job:1"]
+        assert claimed[0]['attempts'] == 1
+        assert (await store.get("job:1"))['status'] == jobs.RUNNING
+        # Leased: no other worker gets it.
+        assert await store.claim(10, 0.2) == []
+        await asyncio.sleep(0.3)
+        # The worker died; the expired lease hands the job out again.
+        claimed = await store.claim(10, 0.2)
+        assert [job['job_key'] for job in claimed] == ["job:1"]
+        assert claimed[0]['attempts'] == 2
+    run(scenario())
+
+
+def test_claim_skips_jobs_not_due():
+    async def scenario():
+        store = jobs.SQLiteJobStore()
+        await store.setup()
+        await store.enqueue("job:later", "test", {}, run_at=time.time() + 60)
+        await store.enqueue("job:now", "test", {})
+        assert [job['job_key'] for job in await store.claim(10, 1)] == ["job:now"]
+    run(scenario())
+
+
+def test_failed_job_is_retried_then_completes():
+    calls = []
+
+    async def flaky(payload):
+        calls.append(payload)
+        if len(calls) == 1:
+            raise RuntimeError("boom")
+        return {"ok": True}
+
+    async def scenario():
+        queue = make_queue()
+        queue.register("flaky", flaky, max_attempts=3)
+        await queue.enqueue("job:1", "flaky", {"n": 1})
+        job, = await queue.store.claim(1, queue.lease)
+        assert not await queue.run_job(job)
+        job = await queue.store.get("job:1")
+        assert job['status'] == jobs.PENDING
+        assert job['last_error'] == "RuntimeError: boom"
+        await asyncio.sleep(0.02)
+        job, = await queue.store.claim(1, queue.lease)
+        assert job['attempts'] == 2
+        assert await queue.run_job(job)
+        job = await queue.store.get("job:1")
+        assert job['status'] == jobs.DONE
+        assert job['result'] == {"ok": True}
+        assert job['last_error'] is None
+        assert queue.metrics["flaky"]["retried"] == 1
+        assert queue.metrics["flaky"]["succeeded"] == 1
+    run(scenario())
+
+
+def test_job_is_dead_lettered_after_max_attempts_and_can_be_retried():
+    async def failing(payload):
+        raise RuntimeError("always")
+
+    async def scenario():
+        queue = make_queue()
+        queue.register("failing", failing, max_attempts=2)
+        await queue.enqueue("job:1", "failing", {})
+        for _ in range(2):
+            await asyncio.sleep(0.02)
+            job, = await queue.store.claim(1, queue.lease)
+            assert not await queue.run_job(job)
+        job = await queue.store.get("job:1")
+        assert job['status'] == jobs.DEAD
+        assert job['attempts'] == 2
+        assert await queue.store.claim(1, queue.lease) == []
+        assert queue.metrics["failing"]["dead"] == 1
+        assert await queue.store.retry("job:1")
+        assert not await queue.store.retry("job:1")
+        job = await queue.store.get("job:1")
+        assert (job['status'], job['attempts']) == (jobs.PENDING, 0)
+    run(scenario())
+
+
+def test_handler_timeout_counts_as_a_failed_attempt():
+    async def slow(payload):
+        await asyncio.sleep(1)
+
+    async def scenario():
+        queue = make_queue(timeout=0.05, lease=1)
+        queue.register("slow", slow, max_attempts=1)
+        await queue.enqueue("job:1", "slow", {})
+        job, = await queue.store.claim(1, queue.lease)
+        assert not await queue.run_job(job)
+        job = await queue.store.get("job:1")
+        assert job['status'] == jobs.DEAD
+        assert job['last_error'].startswith("TimeoutError")
+    run(scenario())
+
+
+def test_abandoned_last_attempt_is_dead_lettered():
+    calls = []
+
+    async def handler(payload):
+        calls.append(payload)
+
+    async def scenario():
+        queue = make_queue()
+        queue.register("once", handler, max_attempts=1)
+        await queue.enqueue("job:1", "once", {})
+        # The first claim's worker dies without recording an outcome.
+        await queue.store.claim(1, 0.05)
+        await asyncio.sleep(0.1)
+        job, = await queue.store.claim(1, queue.lease)
+        assert job['attempts'] == 2
+        assert not await queue.run_job(job)
+        assert calls == []
+        job = await queue.store.get("job:1")
+        assert job['status'] == jobs.DEAD
+        assert job['last_error'] == "Lease expired on the last attempt"
+    run(scenario())
+
+
+def test_by_reference_and_counts():
+    async def scenario():
+        queue = make_queue()
+        queue.register("a", lambda payload: None)
+        queue.register("b", lambda payload: None)
+        await queue.enqueue("a:1", "a", {}, reference="payment")
+        await queue.enqueue("b:1", "b", {}, reference="payment")
+        await queue.enqueue("b:2", "b", {}, reference="other")
+        assert [job['job_key'] for job in await queue.store.by_reference("payment")] == ["a:1", "b:1"]
+        assert await queue.store.counts() == {"a": {jobs.PENDING: 1}, "b": {jobs.PENDING: 2}}
+    run(scenario())
+
+
+def test_set_result_keeps_status_and_lock_reads_it():
+    async def scenario():
+        store = jobs.SQLiteJobStore()
+        await store.setup()
+        await store.enqueue("job:1", "test", {})
+        await store.claim(1, 10)
+        await store.set_result("job:1", {"executed": True})
+        job = await store.lock("job:1")
+        assert (job['status'], job['result']) == (jobs.RUNNING, {"executed": True})
+        assert await store.lock("job:missing") is None
+    run(scenario())
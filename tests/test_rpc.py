@@ -0,0 +1,153 @@
+import asyncio
+import json
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+from solders.pubkey import Pubkey
+from solders.signature import Signature
+from solana.rpc.types import TxOpts
+from backend import rpc
+
+
+class StubNode:
+    # A local JSON-RPC node answering every call after `delay` seconds, or with HTTP 500 if `fail`.
+    def __init__(self, delay=0.0, fail=False):
+        self.delay = delay
+        self.fail = fail
+        self.methods = []
+        node = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                node.methods.append(body["method"])
+                time.sleep(node.delay)
+                if node.fail:
+                    self.send_response(500)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                if body["method"] == "sendTransaction":
+                    result = str(Signature.default())
+                else:
+                    result = {"context": {"slot": 1}, "value": 42}
+                out = json.dumps({"jsonrpc": "2.0", "id": body["id"], "result": result}).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(out)))
+                self.end_headers()
+                self.wfile.write(out)
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def nodes():
+    started = []
+
+    def start(**kwargs):
+        node = StubNode(**kwargs)
+        started.append(node)
+        return node
+
+    yield start
+    for node in started:
+        node.close()
+
+
+def unreachable_url():
+    # A port nothing listens on, so connecting fails before the request is sent.
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return f"http://127.0.0.1:{sock.getsockname()[1]}"
+
+
+def run(urls, scenario, **kwargs):
+    async def main():
+        gateway = rpc.RpcGateway(urls, rate=100, timeout=5, **kwargs)
+        try:
+            return await scenario(gateway)
+        finally:
+            await gateway.close()
+    return asyncio.run(main())
+
+
+def test_slow_read_is_hedged_to_the_next_endpoint(nodes):
+    slow, fast = nodes(delay=1.0), nodes()
+
+    async def scenario(gateway):
+        started = time.perf_counter()
+        response = await gateway.read("get_balance", Pubkey.default())
+        assert response.value == 42
+        assert time.perf_counter() - started < 0.8
+        assert gateway.hedges == 1
+        # The losing call records its latency once its cancellation has been processed.
+        await asyncio.sleep(0.01)
+        slow_endpoint, fast_endpoint = gateway.endpoints
+        assert slow_endpoint.latency >= 0.05
+        assert gateway.ranked()[0] is fast_endpoint
+    run([slow.url, fast.url], scenario, hedge_delay=0.05)
+    assert slow.methods == ["getBalance"] and fast.methods == ["getBalance"]
+
+
+def test_failed_read_fails_over(nodes):
+    failing, healthy = nodes(fail=True), nodes()
+
+    async def scenario(gateway):
+        assert (await gateway.read("get_balance", Pubkey.default())).value == 42
+        assert gateway.endpoints[0].errors == 1
+    run([failing.url, healthy.url], scenario, hedge_delay=5)
+
+
+def test_endpoint_cools_down_after_three_failures(nodes):
+    failing, healthy = nodes(fail=True), nodes()
+
+    async def scenario(gateway):
+        for _ in range(5):
+            assert (await gateway.read("get_balance", Pubkey.default())).value == 42
+        assert gateway.stats()["endpoints"][0]["cooling_down"]
+    run([failing.url, healthy.url], scenario, hedge_delay=5, cooldown=60)
+    assert len(failing.methods) == 3
+    assert len(healthy.methods) == 5
+
+
+def test_every_read_endpoint_failing_raises(nodes):
+    first, second = nodes(fail=True), nodes(fail=True)
+
+    async def scenario(gateway):
+        with pytest.raises(Exception):
+            await gateway.read("get_balance", Pubkey.default())
+    run([first.url, second.url], scenario, hedge_delay=5)
+    assert len(first.methods) == len(second.methods) == 1
+
+
+def test_write_fails_over_when_the_connection_fails(nodes):
+    healthy = nodes()
+
+    async def scenario(gateway):
+        response = await gateway.write("send_raw_transaction", b"\x00" * 64, TxOpts(skip_preflight=True))
+        assert response.value == Signature.default()
+    run([unreachable_url(), healthy.url], scenario)
+    assert healthy.methods == ["sendTransaction"]
+
+
+def test_write_is_not_resent_after_it_reached_a_node(nodes):
+    failing, healthy = nodes(fail=True), nodes()
+
+    async def scenario(gateway):
+        with pytest.raises(Exception):
+            await gateway.write("send_raw_transaction", b"\x00" * 64, TxOpts(skip_preflight=True))
+    run([failing.url, healthy.url], scenario)
+    assert failing.methods == ["sendTransaction"]
+    assert healthy.methods == []
@@ -0,0 +1,218 @@
+import asyncio
+import hashlib
+import io
+import os
+import socket
+import pytest
+from botocore.exceptions import ClientError
+from fastapi import HTTPException
+
+moto_server = pytest.importorskip("moto.server")
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+
+from backend import storage
+
+BUCKET = "test-bucket"
+MiB = 1024 * 1024
+
+
+class FakeDatabase:
+    # Stands in for DatabaseManager under the CidResolver: an empty object_cids table.
+    def __init__(self):
+        self.queries = []
+
+    async def execute(self, query, values=None, fetch=None, many=False, dictionary=False, connection=None):
+        self.queries.append(query)
+        return [] if fetch == "all" else None
+
+
+@pytest.fixture(scope="module")
+def endpoint():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    server = moto_server.ThreadedMotoServer(ip_address="127.0.0.1", port=port, verbose=False)
+    server.start()
+    yield f"http://127.0.0.1:{port}"
+    server.stop()
+
+
+@pytest.fixture
+def run(endpoint, monkeypatch):
+    # Runs a scenario against a fresh bucket, with the module's shared clients pointed at moto.
+    def run(scenario):
+        async def main():
+            storage_client = storage.AsyncStorage(bucket=BUCKET, endpoint_url=endpoint, access_key="test", secret_key="test")
+            monkeypatch.setattr(storage, "_storage", storage_client)
+            monkeypatch.setattr(storage, "_resolver", storage.CidResolver(FakeDatabase(), storage_client))
+            client = await storage_client.client()
+            await client.create_bucket(Bucket=BUCKET)
+            try:
+                return await scenario(storage_client, client)
+            finally:
+                listed = await client.list_objects_v2(Bucket=BUCKET)
+                for item in listed.get("Contents", []):
+                    await client.delete_object(Bucket=BUCKET, Key=item["Key"])
+                await client.delete_bucket(Bucket=BUCKET)
+                await storage_client.close()
+        return asyncio.run(main())
+    return run
+
+
+async def keys(client, prefix=""):
+    listed = await client.list_objects_v2(Bucket=BUCKET, Prefix=prefix)
+    return sorted(item["Key"] for item in listed.get("Contents", []))
+
+
+async def pending_uploads(client):
+    return (await client.list_multipart_uploads(Bucket=BUCKET)).get("Uploads", [])
+
+
+async def chunked(data, chunk_size=MiB, fail_after=None):
+    for start in range(0, len(data), chunk_size):
+        if fail_after is not None and start >= fail_after:
+            raise ConnectionResetError("client disconnected")
+        yield data[start:start + chunk_size]
+
+
+class Unreadable(io.BytesIO):
+    def read(self, size=-1):
+        raise OSError("disk gone")
+
+
+def test_upload_head_download_delete(run, tmp_path):
+    async def scenario(storage_client, client):
+        url = await storage_client.upload_fileobj(io.BytesIO(b"hello"), "a/hello.txt", metadata={"cid": "bafy-hello"})
+        assert url.endswith(f"/{BUCKET}/a/hello.txt")
+        head = await storage_client.head_object("a/hello.txt")
+        assert head["ContentLength"] == 5
+        assert head["Metadata"] == {"cid": "bafy-hello"}
+        path = tmp_path / "hello.txt"
+        await storage_client.download_file("a/hello.txt", str(path))
+        assert path.read_bytes() == b"hello"
+        await storage_client.delete_object("a/hello.txt")
+        with pytest.raises(ClientError):
+            await storage_client.head_object("a/hello.txt")
+    run(scenario)
+
+
+def test_upload_many_uploads_every_file_without_head(run):
+    async def scenario(storage_client, client):
+        heads = []
+        head_object = storage_client.head_object
+
+        async def counting_head(object_name):
+            heads.append(object_name)
+            return await head_object(object_name)
+
+        storage_client.head_object = counting_head
+        urls = await storage.upload_many([(io.BytesIO(b"a" * 10), "m/a"), (io.BytesIO(b"b" * 20), "m/b")], record_cids=True)
+        assert [url.rsplit("/", 1)[1] for url in urls] == ["a", "b"]
+        assert await keys(client, "m/") == ["m/a", "m/b"]
+        assert heads == []
+    run(scenario)
+
+
+def test_upload_many_rolls_back_on_failure(run):
+    async def scenario(storage_client, client):
+        uploads = [(io.BytesIO(b"c" * 10), "n/c"), (Unreadable(), "n/bad"), (io.BytesIO(b"d" * 10), "n/d")]
+        with pytest.raises(HTTPException) as error:
+            await storage.upload_many(uploads, concurrency=1)
+        assert error.value.status_code == 500
+        assert await keys(client, "n/") == []
+    run(scenario)
+
+
+def test_stream_upload_multipart(run):
+    async def scenario(storage_client, client):
+        data = os.urandom(12 * MiB)
+        result = await storage.stream_upload(chunked(data), "big/file.bin", content_type="application/octet-stream")
+        assert result["size"] == len(data)
+        assert result["sha256"] == hashlib.sha256(data).hexdigest()
+        assert result["parts"] == 2
+        body = await (await client.get_object(Bucket=BUCKET, Key="big/file.bin"))["Body"].read()
+        assert body == data
+        assert await pending_uploads(client) == []
+    run(scenario)
+
+
+def test_stream_upload_small_file_is_a_single_put(run):
+    async def scenario(storage_client, client):
+        result = await storage.stream_upload(chunked(b"small"), "small.txt")
+        assert (result["size"], result["parts"]) == (5, 1)
+        assert await keys(client) == ["small.txt"]
+    run(scenario)
+
+
+def test_stream_upload_too_large_is_aborted(run):
+    async def scenario(storage_client, client):
+        with pytest.raises(HTTPException) as error:
+            await storage.stream_upload(chunked(os.urandom(12 * MiB)), "big/too-large.bin", max_bytes=10 * MiB)
+        assert error.value.status_code == 413
+        assert await pending_uploads(client) == []
+        assert await keys(client) == []
+    run(scenario)
+
+
+def test_stream_upload_client_disconnect_is_aborted(run):
+    async def scenario(storage_client, client):
+        with pytest.raises(HTTPException) as error:
+            await storage.stream_upload(chunked(os.urandom(12 * MiB), fail_after=9 * MiB), "big/disconnect.bin")
+        assert error.value.status_code == 500
+        assert await pending_uploads(client) == []
+        assert await keys(client) == []
+    run(scenario)
+
+
+def test_staged_upload_failure_keeps_previous_objects(run):
+    async def scenario(storage_client, client):
+        await storage.upload_many([(io.BytesIO(b"old id"), "kyc/id"), (io.BytesIO(b"old selfie"), "kyc/selfie")], staged=True)
+        with pytest.raises(HTTPException):
+            await storage.upload_many([(io.BytesIO(b"new id"), "kyc/id"), (Unreadable(), "kyc/selfie")], concurrency=1, staged=True)
+        assert await keys(client, "kyc/") == ["kyc/id", "kyc/selfie"]
+        body = await (await client.get_object(Bucket=BUCKET, Key="kyc/id"))["Body"].read()
+        assert body == b"old id"
+    run(scenario)
+
+
+def test_staged_upload_replaces_objects(run):
+    async def scenario(storage_client, client):
+        await storage.upload_many([(io.BytesIO(b"old id"), "kyc/id")], staged=True)
+        urls = await storage.upload_many([(io.BytesIO(b"new id"), "kyc/id")], staged=True)
+        assert urls == [storage_client.url("kyc/id")]
+        assert await keys(client, "kyc/") == ["kyc/id"]
+        body = await (await client.get_object(Bucket=BUCKET, Key="kyc/id"))["Body"].read()
+        assert body == b"new id"
+    run(scenario)
+
+
+def test_resolve_prefix_heads_only_new_or_overwritten_objects(run):
+    async def scenario(storage_client, client):
+        await storage_client.upload_fileobj(io.BytesIO(b"one"), "trs_data/t/1.png", metadata={"cid": "bafy-1"})
+        await storage_client.upload_fileobj(io.BytesIO(b"two"), "trs_data/t/2.png", metadata={"cid": "bafy-2"})
+        resolver = storage.get_resolver()
+        assert await resolver.resolve_prefix("trs_data/t/") == {"trs_data/t/1.png": "bafy-1", "trs_data/t/2.png": "bafy-2"}
+        assert resolver.metrics["heads"] == 2
+        assert (await resolver.resolve_prefix("trs_data/t/"))["trs_data/t/2.png"] == "bafy-2"
+        assert resolver.metrics["heads"] == 2
+        # Overwritten by another client: the listed ETag no longer matches.
+        await storage_client.upload_fileobj(io.BytesIO(b"two again"), "trs_data/t/2.png", metadata={"cid": "bafy-2b"})
+        assert (await resolver.resolve_prefix("trs_data/t/"))["trs_data/t/2.png"] == "bafy-2b"
+        assert resolver.metrics["heads"] == 3
+    run(scenario)
+
+
+def test_stream_upload_honours_the_multipart_threshold(run, monkeypatch):
+    async def scenario(storage_client, client):
+        data = os.urandom(12 * MiB)
+        monkeypatch.setattr(storage, "S3_MULTIPART_THRESHOLD", 16 * MiB)
+        assert (await storage.stream_upload(chunked(data), "below.bin"))["parts"] == 1
+        assert "-" not in (await storage_client.head_object("below.bin"))["ETag"]
+        monkeypatch.setattr(storage, "S3_MULTIPART_THRESHOLD", MiB)
+        result = await storage.stream_upload(chunked(data[:2 * MiB]), "above.bin")
+        assert result["parts"] == 1
+        # A multipart ETag ends in -<number of parts>.
+        assert (await storage_client.head_object("above.bin"))["ETag"].strip('"').endswith("-1")
+        body = await (await client.get_object(Bucket=BUCKET, Key="above.bin"))["Body"].read()
+        assert body == data[:2 * MiB]
+    run(scenario)
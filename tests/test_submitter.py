@@ -0,0 +1,142 @@
+import asyncio
+import types
+import pytest
+from solders.hash import Hash
+from solders.keypair import Keypair
+from solders.system_program import TransferParams, transfer
+from solders.transaction_status import TransactionConfirmationStatus
+from backend import submitter
+
+
+class FakeBlockhashes:
+    # A new blockhash on every call, valid up to `last_valid_block_height`.
+    refreshes = 0
+
+    def __init__(self):
+        self.last_valid_block_height = 100
+
+    async def get(self):
+        return Hash.new_unique(), self.last_valid_block_height
+
+    async def refresh(self):
+        return await self.get()
+
+    def close(self):
+        pass
+
+
+class FakeGateway:
+    # Holds the signature statuses and block height the tests set, and records every broadcast.
+    def __init__(self):
+        self.block_height = 50
+        self.statuses = {}
+        self.sent = []
+
+    async def write(self, method, raw, opts):
+        self.sent.append(raw)
+
+    async def read(self, method, *args):
+        if method == "get_block_height":
+            return types.SimpleNamespace(value=self.block_height)
+        return types.SimpleNamespace(value=[self.statuses.get(signature) for signature in args[0]])
+
+
+def status(confirmation_status, err=None):
+    return types.SimpleNamespace(confirmation_status=confirmation_status, err=err)
+
+
+def make_submitter(gateway, **kwargs):
+    options = {"poll_interval": 0.01, "rebroadcast_interval": 0.02, "max_resubmits": 3}
+    options.update(kwargs)
+    return submitter.TransactionSubmitter(Keypair(), gateway, FakeBlockhashes(), **options)
+
+
+def instructions(payer):
+    return [transfer(TransferParams(from_pubkey=payer.pubkey(), to_pubkey=Keypair().pubkey(), lamports=1))]
+
+
+def test_confirmed_transaction_resolves():
+    async def scenario():
+        gateway = FakeGateway()
+        sub = make_submitter(gateway)
+        task = asyncio.ensure_future(sub.submit(instructions(sub.payer)))
+        await asyncio.sleep(0.02)
+        signature, = sub.pending
+        gateway.statuses[signature] = status(TransactionConfirmationStatus.Confirmed)
+        assert await asyncio.wait_for(task, 1) == str(signature)
+        assert sub.pending == {}
+        await sub.close()
+    asyncio.run(scenario())
+
+
+def test_expired_unseen_transaction_is_resigned():
+    async def scenario():
+        gateway = FakeGateway()
+        sub = make_submitter(gateway, rebroadcast_interval=100)
+        task = asyncio.ensure_future(sub.submit(instructions(sub.payer)))
+        await asyncio.sleep(0.02)
+        first, = sub.pending
+        sub.blockhashes.last_valid_block_height = 300
+        gateway.block_height = 101
+        await asyncio.sleep(0.05)
+        assert sub.metrics["resubmits"] == 1
+        second, = sub.pending
+        assert second != first
+        gateway.statuses[second] = status(TransactionConfirmationStatus.Finalized)
+        assert await asyncio.wait_for(task, 1) == str(second)
+        await sub.close()
+    asyncio.run(scenario())
+
+
+def test_processed_transaction_is_not_resigned():
+    async def scenario():
+        gateway = FakeGateway()
+        sub = make_submitter(gateway, rebroadcast_interval=100)
+        task = asyncio.ensure_future(sub.submit(instructions(sub.payer)))
+        await asyncio.sleep(0.02)
+        signature, = sub.pending
+        gateway.statuses[signature] = status(TransactionConfirmationStatus.Processed)
+        gateway.block_height = 200
+        await asyncio.sleep(0.05)
+        assert sub.metrics["resubmits"] == 0
+        assert len(gateway.sent) == 1
+        gateway.statuses[signature] = status(TransactionConfirmationStatus.Finalized)
+        assert await asyncio.wait_for(task, 1) == str(signature)
+        await sub.close()
+    asyncio.run(scenario())
+
+
+def test_abandoned_transaction_is_dropped_not_resigned(caplog):
+    async def scenario():
+        gateway = FakeGateway()
+        sub = make_submitter(gateway)
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(sub.submit(instructions(sub.payer)), 0.005)
+        assert len(gateway.sent) == 1
+        # Past the blockhash and the rebroadcast interval: a tracked entry would be re-signed and rebroadcast.
+        gateway.block_height = 200
+        await asyncio.sleep(0.1)
+        assert sub.pending == {}
+        assert len(gateway.sent) == 1
+        assert sub.metrics["resubmits"] == 0
+        assert sub.metrics["abandoned"] == 1
+        await sub.close()
+    asyncio.run(scenario())
+    assert "Confirmation poll failed" not in caplog.text
+
+
+def test_cancelled_while_resigning_is_not_sent():
+    async def scenario():
+        gateway = FakeGateway()
+        sub = make_submitter(gateway, rebroadcast_interval=100)
+        task = asyncio.ensure_future(sub.submit(instructions(sub.payer)))
+        await asyncio.sleep(0.02)
+        signature, = sub.pending
+        entry = sub.pending[signature]
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        await sub._resend(entry)
+        assert len(gateway.sent) == 1
+        assert sub.pending in ({}, {signature: entry})
+        await sub.close()
+    asyncio.run(scenario())